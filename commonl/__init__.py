@@ -23,6 +23,7 @@ import bisect
 import codecs
 import collections
 import contextlib
+import ctypes
 import errno
 import fnmatch
 import functools
@@ -32,14 +33,17 @@ import importlib
 import importlib.util
 import io
 import inspect
+import itertools
 import json
 import logging
+import mmap
 import multiprocessing
 import numbers
 import os
 import pickle
 import random
 import re
+import select
 import signal
 import shutil
 import socket
@@ -52,10 +56,16 @@ import threading
 import time
 import traceback
 import types
+import zlib
 
 import filelock
 import requests
 
+try:
+    import fcntl
+except ImportError:	# Windows
+    fcntl = None
+
 import urllib.parse
 
 debug_traces = False
@@ -3163,6 +3173,251 @@ class generator_factory_c(object):
         return self.tls.generator.__iter__()
 
 
+# inotify(7) via ctypes, if the platform has it; None if not checked
+# yet, False if not available
+_inotify_libc = None
+
+# IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE |
+# IN_DELETE, from <sys/inotify.h>
+_inotify_mask_changes = 0x002 | 0x004 | 0x008 | 0x080 | 0x100 | 0x200
+
+def _inotify_watch(path, mask):
+    # Return a non-blocking inotify file descriptor watching path,
+    # None if we can't
+    global _inotify_libc
+    if _inotify_libc == None:
+        try:
+            libc = ctypes.CDLL(None, use_errno = True)
+            libc.inotify_init1.argtypes = [ ctypes.c_int ]
+            libc.inotify_add_watch.argtypes = [
+                ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32 ]
+            _inotify_libc = libc
+        except Exception:	# Windows, macOS, no libc symbols...
+            _inotify_libc = False
+    if not _inotify_libc:
+        return None
+    fd = _inotify_libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        _inotify_fallback_log(path, "inotify_init1", ctypes.get_errno())
+        return None
+    if _inotify_libc.inotify_add_watch(fd, path.encode('utf-8'), mask) < 0:
+        _inotify_fallback_log(path, "inotify_add_watch", ctypes.get_errno())
+        os.close(fd)
+        return None
+    return fd
+
+
+def _inotify_fallback_log(path, what, errno_n):
+    # Falling back to polling works, but it is slower and costs CPU;
+    # the usual cause is each waiter needing its own inotify instance
+    # and the per-user limits being low, so say which one to raise
+    if errno_n == errno.EMFILE:
+        hint = " (raise sysctl fs.inotify.max_user_instances?)"
+    elif errno_n == errno.ENOSPC:
+        hint = " (raise sysctl fs.inotify.max_user_watches?)"
+    else:
+        hint = ""
+    logging.warning("%s: can't watch with inotify, polling instead:"
+                    " %s(): %s%s", path, what, os.strerror(errno_n), hint)
+
+
+def _inotify_wait(fd, timeout):
+    # Wait for events on an inotify file descriptor for up to timeout
+    # seconds and drain them.
+    #
+    # Returns None if timed out, otherwise the set of file names the
+    # events are about; an empty name means an event on the watched
+    # path itself or that the event queue overflowed (and thus we
+    # don't know).
+    #
+    # Don't use select.select(), it can't handle file descriptors
+    # over FD_SETSIZE (1024), which a busy daemon easily has open.
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    if not poller.poll(max(0, timeout) * 1000):
+        return None
+    names = set()
+    try:
+        while True:
+            data = os.read(fd, 65536)
+            if not data:
+                break
+            # struct inotify_event { int wd; uint32_t mask, cookie, len;
+            #                        char name[len]; }
+            offset = 0
+            while offset + 16 <= len(data):
+                _wd, _mask, _cookie, name_len = \
+                    struct.unpack_from("iIII", data, offset)
+                offset += 16
+                names.add(data[offset:offset + name_len]
+                          .rstrip(b"\0").decode('utf-8', errors = 'replace'))
+                offset += name_len
+    except BlockingIOError:
+        pass
+    return names
+
+
+def file_wait_grow(filename, size, timeout, check = None,
+                   check_period = 1, poll_period = 0.25):
+    """
+    Wait for a file to grow bigger than a given size
+
+    If the platform supports *inotify*, this sleeps until the file is
+    reported as created or modified; otherwise it polls.
+
+    :param str filename: file to watch (it might not exist yet)
+    :param int size: return when the file is bigger than this
+    :param float timeout: maximum seconds to wait
+    :param callable check: (optional) function called every
+      *check_period* seconds (and when the file changes); if it
+      returns *True*, stop waiting (eg: the file has been replaced by
+      another one)
+    :param float check_period: (optional) seconds between calls to
+      *check* when using *inotify*
+    :param float poll_period: (optional) seconds between checks when
+      *inotify* is not available
+    :returns bool: *True* if the file grew or *check* returned *True*,
+      *False* if timed out
+    """
+    ts_end = time.time() + timeout
+    # We watch the directory, since the file might not exist yet or
+    # be replaced, but only wake up for events on our file; the
+    # directory is usually shared with busy files (eg: the target's
+    # state database).
+    basename = os.path.basename(filename)
+    fd = _inotify_watch(os.path.dirname(filename) or ".",
+                        _inotify_mask_changes)
+    try:
+        while True:
+            try:
+                if os.stat(filename).st_size > size:
+                    return True
+            except FileNotFoundError:
+                pass
+            if check and check():
+                return True
+            remaining = ts_end - time.time()
+            if remaining <= 0:
+                return False
+            if fd == None:
+                time.sleep(min(remaining, poll_period))
+                continue
+            ts_wake = time.time() + min(remaining, check_period)
+            while True:
+                names = _inotify_wait(fd, ts_wake - time.time())
+                if names == None or basename in names or "" in names:
+                    break
+    finally:
+        if fd != None:
+            os.close(fd)
+
+
+# IN_CLOSE_WRITE | IN_CLOSE_NOWRITE, from <sys/inotify.h>
+_inotify_mask_close = 0x008 | 0x010
+
+def flock_timeout(fd, filename, timeout, poll_period = 0.25):
+    """
+    Take an exclusive :func:`fcntl.flock` lock on a file, waiting at
+    most a given time
+
+    :func:`fcntl.flock` can only block forever or fail right away; if
+    the platform supports *inotify*, this sleeps until the file is
+    closed by someone (as the holder will do when releasing the lock)
+    and tries again; otherwise it polls.
+
+    :param int fd: file descriptor opened on *filename*
+    :param str filename: name of the file
+    :param float timeout: maximum seconds to wait
+    :param float poll_period: (optional) seconds between attempts when
+      *inotify* is not available
+    :returns bool: *True* if the lock was taken, *False* if timed out
+    """
+    ts_end = time.time() + timeout
+    watch_fd = None
+    watching = False
+    try:
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                pass
+            if not watching:
+                # watch and then try again, so we don't miss a
+                # release that happens in between
+                watch_fd = _inotify_watch(filename, _inotify_mask_close)
+                watching = True
+                if watch_fd != None:
+                    continue
+            remaining = ts_end - time.time()
+            if remaining <= 0:
+                return False
+            if watch_fd == None:
+                time.sleep(min(remaining, poll_period))
+                continue
+            _inotify_wait(watch_fd, remaining)
+    finally:
+        if watch_fd != None:
+            os.close(watch_fd)
+
+
+class dir_watch_c:
+    """
+    Wait for changes in a directory (files added, removed or modified)
+
+    If the platform supports *inotify*, this sleeps until the kernel
+    reports changes; otherwise it polls the directory's modification
+    time.
+
+    Changes that happen in between calls to :meth:`wait` are not
+    lost, so a consumer can scan the directory and then wait, with
+    no race.
+
+    :param str dirname: directory to watch
+    :param float poll_period: (optional) seconds between checks when
+      *inotify* is not available
+    """
+    def __init__(self, dirname, poll_period = 0.25):
+        self.dirname = dirname
+        self.poll_period = poll_period
+        self.fd = _inotify_watch(dirname, _inotify_mask_changes)
+        self.mtime_ns = os.stat(dirname).st_mtime_ns
+
+    def wait(self, timeout):
+        """
+        Wait for changes in the directory
+
+        :param float timeout: maximum seconds to wait
+        :returns bool: *True* if there were changes since the last
+          call, *False* if timed out
+        """
+        ts_end = time.time() + timeout
+        while True:
+            if self.fd != None:
+                return _inotify_wait(self.fd, ts_end - time.time()) != None
+            mtime_ns = os.stat(self.dirname).st_mtime_ns
+            if mtime_ns != self.mtime_ns:
+                self.mtime_ns = mtime_ns
+                return True
+            remaining = ts_end - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(remaining, self.poll_period))
+
+    def close(self):
+        if self.fd != None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __del__(self):
+        # might be half initialized if __init__() failed
+        if getattr(self, "fd", None) != None:
+            try:
+                os.close(self.fd)
+            except OSError:	# interpreter might be going down
+                pass
+
+
 def file_iterator(filename, chunk_size = 4096):
     """
     Iterate over a file's contents
@@ -3190,6 +3445,136 @@ def file_iterator(filename, chunk_size = 4096):
             yield data
 
 
+def gzip_iterator(chunks, level = 6):
+    """
+    Gzip compress the data yielded by an iterator
+
+    Used to stream compressed HTTP responses without having to have
+    all the data in memory:
+
+    >>> return flask.Response(commonl.gzip_iterator(generator),
+    >>>                       headers = { 'Content-Encoding': 'gzip' })
+
+    :param chunks: iterator yielding :class:`bytes`
+    :param int level: (optional) compression level (1-9)
+    """
+    # wbits: 16 + N selects the gzip container instead of zlib's
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class json_stream_c:
+    """
+    Incrementally decode a JSON document as it is received
+
+    Large JSON objects (such as the inventory of a server) can be
+    decoded without having to have all the text in memory first,
+    eg:
+
+    >>> r = requests.get(URL, stream = True)
+    >>> stream = commonl.json_stream_c(r.iter_content(65536))
+    >>> for key in stream.object_iter():
+    >>>     value = stream.value()
+    >>>     ...
+
+    :meth:`object_iter` yields the keys of an object; for each, the
+    caller has to consume its value with :meth:`value` (to decode it
+    whole) or with a nested :meth:`object_iter` (to iterate it) before
+    asking for the next key.
+
+    :param chunks: iterator yielding :class:`bytes` (UTF-8) or
+      :class:`str`
+    :param object_pairs_hook: (optional) passed to
+      :class:`json.JSONDecoder` (eg: :class:`collections.OrderedDict`)
+    """
+    def __init__(self, chunks, object_pairs_hook = None):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder(object_pairs_hook = object_pairs_hook)
+        self.utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _read(self):
+        # read more data into the buffer; False if no more
+        if self.eof:
+            return False
+        # drop what we have consumed, so the buffer doesn't grow
+        # with the whole document
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        for chunk in self.chunks:
+            if isinstance(chunk, bytes):
+                chunk = self.utf8_decoder.decode(chunk)
+            if chunk:
+                self.buf += chunk
+                return True
+        self.eof = True
+        self.buf += self.utf8_decoder.decode(b"", final = True)
+        return False
+
+    def _peek(self):
+        # return the next non-whitespace character, not consuming it
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._read():
+                raise ValueError("JSON: unexpected end of data")
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c not in chars:
+            raise ValueError(
+                f"JSON: expected one of '{chars}', got '{c}'"
+                f" at offset {self.pos}")
+        self.pos += 1
+        return c
+
+    def value(self):
+        """
+        Decode the next value in full
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer might continue
+                # in the next chunk; only trust it if there is
+                # something after it
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._read()
+
+    def object_iter(self):
+        """
+        Iterate over the keys of the next value, which shall be an
+        object
+
+        After each key is yielded, the caller shall consume its value
+        with :meth:`value` or :meth:`object_iter`.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self._expect(":")
+            yield key
+            if self._expect(",}") == "}":
+                return
+
+
 def assert_list_of_strings(l, list_name, item_name):
     assert isinstance(l, ( tuple, list, set )), \
         "'%s' needs to be None or a list of strings (%s); got %s" % (
@@ -3863,18 +4248,274 @@ class fsdb_c(object):
         """
         raise NotImplementedError
 
+    # { id(FSDB): [ OPERATIONS ] } for the transactions open in each
+    # thread; see transaction()
+    _transactions = threading.local()
+
+    def _transaction_ops(self):
+        # list where to record the operations if this thread is in a
+        # transaction for this database, None otherwise
+        pending = getattr(self._transactions, "pending", None)
+        if pending == None:
+            return None
+        return pending.get(id(self), None)
+
+    def _transaction_record(self, key_list, force, nested_flat_keyspace):
+        # if in a transaction, record the operations and return True,
+        # otherwise False so the caller executes them
+        ops = self._transaction_ops()
+        if ops == None:
+            return False
+        # we can't tell now if the key will exist when committing
+        assert force == True, \
+            "force = False is not supported inside a transaction"
+        for key, value in key_list:
+            self._value_encode(value)	# fail now on bad types
+            ops.append(( key, value, force, nested_flat_keyspace ))
+        return True
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Batch multiple :meth:`set` and :meth:`set_keys` in a single commit
+
+        >>> with fsdb.transaction():
+        >>>     fsdb.set("owner", "someuser")
+        >>>     fsdb.set("_alloc.id", "1234")
+        >>>     fsdb.set("_alloc.queue.SOMEWAITER", None)
+
+        The *set* operations done by this thread inside the block
+        are recorded and when the block exits, committed all at once
+        in the same order. If an exception is raised inside the block,
+        they are discarded.
+
+        Note:
+
+        - reads inside the block do not see the values set inside it
+
+        - *force = False* is not supported inside the block (whether
+          the key exists can only be known when committing)
+
+        - nested transactions are folded into the outermost one
+
+        How atomic the commit is depends on the backend:
+
+        - :class:`fsdb_log_c` commits all the changes in a single
+          atomic write; readers in this or other processes see either
+          the old or the new values.
+
+        - :class:`fsdb_symlink_c` applies the changes one after
+          another, as :meth:`set_keys` does (sharing the key space
+          cleanup work), while holding a lock on the database's
+          directory; :meth:`keys`, :meth:`get_as_slist` and
+          :meth:`get_as_dict` in this or other processes wait for it
+          to be released, so they see either the old or the new
+          values. Separate :meth:`get` calls for different keys can
+          still see some of the changes applied and others not.
+        """
+        pending = getattr(self._transactions, "pending", None)
+        if pending == None:
+            pending = self._transactions.pending = {}
+        if id(self) in pending:
+            yield			# nested, the outermost commits
+            return
+        ops = pending[id(self)] = []
+        try:
+            yield
+        finally:
+            del pending[id(self)]
+        if ops:
+            self._transaction_commit(ops)
+
+    def _transaction_commit(self, ops):
+        # Commit a transaction's list of operations
+        # ( KEY, VALUE, FORCE, NESTED_FLAT_KEYSPACE ); backends do it
+        # better
+        for key, value, force, nested_flat_keyspace in ops:
+            self.set(key, value, force = force,
+                     nested_flat_keyspace = nested_flat_keyspace)
+
+    def generation(self):
+        """
+        Return the current generation of the database
+
+        The generation changes every time the database is modified by
+        this or any other process using :meth:`set` or
+        :meth:`set_keys`, so if it is the same it was the last time
+        we read, nothing changed and we can use what we read then.
+
+        :returns: generation (opaque, to be compared for equality);
+          *None* if the backend doesn't support generations (and thus
+          reads are not cached).
+        """
+        return None
+
+    #: Cache the results of reads in this process
+    #:
+    #: Reads are cached until the database's generation (see
+    #: :meth:`generation`) changes, so it costs checking the
+    #: generation instead of reading the database. Note only changes
+    #: done with this API change the generation.
+    cache_enabled = True
+
+    # ( GENERATION, { QUERY: RESULT } ); this class level one is only
+    # a placeholder, since the generation is never None, the first
+    # _cache_get() will replace it with an instance one
+    _cache = ( None, {} )
+    _cache_hits = 0
+    _cache_misses = 0
+    # for all the databases in this process
+    _cache_hits_total = 0
+    _cache_misses_total = 0
+    # protects the cache and stats of all the databases in this
+    # process; only held to look up / update, never while reading
+    _cache_lock = threading.Lock()
+
+    def _cache_get(self, query, fn, *args):
+        # Read-through cache: return the cached result of *query* or
+        # call fn(*args) to get it
+        #
+        # Note we get the generation *before* reading, so if someone
+        # modifies the database while we read, we cache the result
+        # under the old generation and it won't be used.
+        #
+        # Multiple threads might be doing this at the same time; we
+        # don't hold the lock while reading, so two threads missing at
+        # the same time will both read and cache the same thing.
+        if not self.cache_enabled:
+            return fn(*args)
+        generation = self.generation()
+        if generation == None:
+            return fn(*args)
+        with fsdb_c._cache_lock:
+            cache_generation, cache = self._cache
+            if cache_generation != generation:
+                cache = {}
+                self._cache = ( generation, cache )
+            elif query in cache:
+                self._cache_hits += 1
+                fsdb_c._cache_hits_total += 1
+                return cache[query]
+            self._cache_misses += 1
+            fsdb_c._cache_misses_total += 1
+        result = fn(*args)
+        with fsdb_c._cache_lock:
+            # if the generation changed meanwhile, this is a dict
+            # nobody will look at anymore
+            cache[query] = result
+        return result
+
+    def cache_stats(self):
+        """
+        Return statistics of the read cache
+
+        :returns dict: dictionary with *hits*, *misses* and *ratio*
+          (hits over total reads, *None* if there were no reads) for
+          this database and *hits_total*, *misses_total* and
+          *ratio_total* for all the databases in this process.
+        """
+        def _ratio(hits, misses):
+            if hits + misses == 0:
+                return None
+            return hits / (hits + misses)
+
+        return dict(
+            hits = self._cache_hits,
+            misses = self._cache_misses,
+            ratio = _ratio(self._cache_hits, self._cache_misses),
+            hits_total = fsdb_c._cache_hits_total,
+            misses_total = fsdb_c._cache_misses_total,
+            ratio_total = _ratio(fsdb_c._cache_hits_total,
+                                 fsdb_c._cache_misses_total),
+        )
+
     @staticmethod
-    def create(cache_dir):
+    def _value_encode(value):
+        # the storage is always a string, so encode what is not as
+        # string as T:REPR, where T is type (b boolean, n number,
+        # s string) and REPR is the textual repr, json valid
+        if value == None:
+            return None
+        if isinstance(value, bool):
+            # do first, otherwise it will test as int
+            # str first so we get True/False
+            return b"b:" + str(value).encode()
+        if isinstance(value, numbers.Integral):
+            # sadly, this looses precission in floats. A lot
+            return b"i:%d" % value
+        if isinstance(value, numbers.Real):
+            # sadly, this can loose precission in floats--FIXME:
+            # better solution needed
+            return b"f:%.10f" % value
+        if isinstance(value, str):
+            # take care of special strings that might look like
+            # our formatting, escape them
+            return b"s:" + value.encode()
+        if isinstance(value, bytes):
+            return b"x:" + value
+        raise ValueError("can't store value of type %s" % type(value))
+
+    def _value_decode(self, key, value):
+        # if the value was type encoded (see _value_encode()), decode
+        # it; otherwise, it is a string
+        if value.startswith(b"i:"):
+            return json.loads(value[2:])
+        if value.startswith(b"f:"):
+            return json.loads(value[2:])
+        if value.startswith(b"b:"):
+            val = value[2:]
+            if val == b"True":
+                return True
+            if val == b"False":
+                return False
+            raise ValueError("fsdb %s: key %s bad boolean '%s'"
+                             % (self.location, key, value))
+        if value.startswith(b"x:"):
+            # raw byes string
+            return value[2:]
+        if value.startswith(b"s:"):
+            # string that might start with s: or empty
+            return value[2:].decode()
+        return value.decode()	# other string
+
+    #: Default backend used by :meth:`create` when none is specified
+    #:
+    #: *None* picks the right one for the host OS (see
+    #: :meth:`create`); otherwise a name from :data:`backends`, eg:
+    #:
+    #: >>> commonl.fsdb_c.backend_default = "log"
+    backend_default = None
+
+    #: Backends :meth:`create` knows about, by name (filled in
+    #: after the classes are defined)
+    backends = {}
+
+    @staticmethod
+    def create(cache_dir, backend = None):
         """
         Create with the right type for the host OS
 
         Same params as :class:`fsdb_symlink_c`
 
+        :param str backend: (optional; default
+          :data:`backend_default`) name of the backend to use
+          (*symlink*, *file* or *log*); if *None*, pick the best for
+          the host OS.
+
         Note there are catchas for atomicity; read the docs for:
 
         - :class:`fsdb_symlink_c`
         - :class:`fsdb_file_c`
+        - :class:`fsdb_log_c`
         """
+        if backend == None:
+            backend = fsdb_c.backend_default
+        if backend != None:
+            if backend not in fsdb_c.backends:
+                raise ValueError(
+                    f"fsdb backend '{backend}': unknown; expected one of:"
+                    f" {', '.join(fsdb_c.backends)}")
+            return fsdb_c.backends[backend](cache_dir)
         if sys.platform in ( 'linux', 'macos' ):
             return fsdb_symlink_c(cache_dir)
         else:
@@ -3913,6 +4554,228 @@ class fsdb_symlink_c(fsdb_c):
             self.uuid = use_uuid
 
         self.location = dirname
+        # see _index_refresh()
+        self._index_lock = threading.Lock()
+        self._index = []
+        self._index_keys = []
+        self._index_mtime_ns = None
+        # see generation()
+        self._generation_deferral = threading.local()
+
+    #: Name of the symlink keeping the database's generation count
+    #:
+    #: Note this can't collide with any key, since the key names
+    #: are quoted to form a file name and a % would be followed by two
+    #: hex digits.
+    generation_filename = "%generation"
+
+    def _generation_read(self):
+        # The generation is a counter kept as the destination of a
+        # symlink, like the values, so reading it is a single
+        # readlink() and we need no file descriptors (we might have
+        # hundreds of databases open)
+        try:
+            return int(os.readlink(
+                os.path.join(self.location, self.generation_filename)))
+        except FileNotFoundError:
+            if not os.path.isdir(self.location):
+                return None		# database removed
+            return 0			# never bumped
+        except (OSError, ValueError):
+            # not a symlink or garbage; will be replaced on the next
+            # bump
+            return 0
+
+    def generation(self):
+        if fcntl == None:
+            return None
+        return self._generation_read()
+
+    def _dir_lock(self, operation):
+        # Open the database directory and flock() it with *operation*
+        # (fcntl.LOCK_SH or LOCK_EX); return the file descriptor,
+        # closing it releases the lock. None if the database was
+        # removed.
+        #
+        # Each open() is its own lock, so this serializes with other
+        # threads too; the file descriptor lives only while we need
+        # the lock.
+        try:
+            fd = os.open(self.location, os.O_RDONLY | os.O_DIRECTORY)
+        except FileNotFoundError:
+            return None
+        try:
+            fcntl.flock(fd, operation)
+        except:
+            os.close(fd)
+            raise
+        return fd
+
+    def _generation_bump(self):
+        # Always invalidate our cache right away; bump the shared
+        # generation only if not deferred (see _generation_deferred())
+        with fsdb_c._cache_lock:
+            self._cache = ( None, {} )
+        deferral = self._generation_deferral
+        if getattr(deferral, "depth", 0) > 0:
+            return
+        if getattr(deferral, "fd", None) == None:
+            return		# no fcntl or database removed
+        # we hold the directory lock (see _generation_deferred()),
+        # so nobody else is doing this
+        generation = self._generation_read()
+        if generation == None:
+            return
+        filename = os.path.join(self.location, self.generation_filename)
+        filename_tmp = "%s.%d.%d" % (filename, os.getpid(),
+                                     threading.get_ident())
+        rm_f(filename_tmp)		# leftover from a dead process?
+        os.symlink(str(generation + 1), filename_tmp)
+        os.rename(filename_tmp, filename)
+
+    @contextlib.contextmanager
+    def _generation_deferred(self):
+        # Bump the generation only once, when the outermost block
+        # exits, for all the sets done inside it by this thread
+        #
+        # The outermost block also holds the directory lock
+        # exclusively, so readers of multiple keys (see
+        # _read_consistent()) in this or other processes see either
+        # none or all of the changes done inside it (eg: a
+        # transaction()).
+        deferral = self._generation_deferral
+        depth = getattr(deferral, "depth", 0)
+        if depth == 0:
+            deferral.fd = None
+            if fcntl != None:
+                deferral.fd = self._dir_lock(fcntl.LOCK_EX)
+        deferral.depth = depth + 1
+        try:
+            yield
+        finally:
+            deferral.depth -= 1
+            if deferral.depth == 0:
+                try:
+                    self._generation_bump()
+                finally:
+                    if deferral.fd != None:
+                        os.close(deferral.fd)	# releases the lock
+                        deferral.fd = None
+
+    def _read_consistent(self, fn, *args):
+        # Call fn(*args) to read multiple keys, holding the directory
+        # lock shared so we don't see a half done set of changes (see
+        # _generation_deferred()); unless this thread is the one
+        # doing them (eg: reading the keys to clean up the key space),
+        # as it already has it exclusively.
+        if fcntl == None \
+           or getattr(self._generation_deferral, "depth", 0) > 0:
+            return fn(*args)
+        fd = self._dir_lock(fcntl.LOCK_SH)
+        try:
+            return fn(*args)
+        finally:
+            if fd != None:
+                os.close(fd)
+
+    #: Window (in seconds) after a directory modification in which we
+    #: don't trust its modification time to tell us if the key index
+    #: is still fresh
+    #:
+    #: The kernel updates the directory's modification time with a
+    #: coarse clock, so two changes done within the same tick leave
+    #: the same modification time. If we scanned the directory in
+    #: between, we'd miss the second. So if the directory was modified
+    #: too recently when we scanned it, we'll scan it again the next
+    #: time. Increase for filesystems with coarser timestamps.
+    index_mtime_racy = 0.05
+
+    def _index_refresh(self):
+        # Return a sorted list of ( KEY, KEY_RAW ) for all the keys
+        # in the database and the list of KEYs (for bisecting); KEY
+        # is the unquoted name of the key, KEY_RAW the filename
+        #
+        # We cache it and only re-scan the directory when its
+        # modification time changes, which happens every time a key
+        # is added, removed or replaced (since a set is a rename over
+        # the old one) by any process.
+        with self._index_lock:
+            index = []
+            try:
+                st = os.stat(self.location)
+                if st.st_mtime_ns == self._index_mtime_ns:
+                    return self._index, self._index_keys
+                with os.scandir(self.location) as entries:
+                    for entry in entries:
+                        # the generation and its temporary copies
+                        if entry.name.startswith(self.generation_filename):
+                            continue
+                        # DirEntry caches the type from readdir(), so
+                        # this is way cheaper than a lstat() per entry
+                        if self._raw_valid_entry(entry):
+                            index.append((
+                                urllib.parse.unquote(entry.name),
+                                entry.name ))
+            except FileNotFoundError:
+                # the database has been wiped (eg: an allocation
+                # being removed), so there is nothing
+                self._index = []
+                self._index_keys = []
+                self._index_mtime_ns = None
+                return self._index, self._index_keys
+            index.sort()
+            self._index = index
+            self._index_keys = [ key for key, _key_raw in index ]
+            # if a change happens after stat(), mtime will differ
+            # and we'll re-scan next time; but if it happens in the
+            # same clock tick as the last change, mtime won't change
+            # -- so don't trust recent mtimes
+            if time.time_ns() - st.st_mtime_ns \
+               < self.index_mtime_racy * 1000000000:
+                self._index_mtime_ns = None
+            else:
+                self._index_mtime_ns = st.st_mtime_ns
+            return self._index, self._index_keys
+
+    @staticmethod
+    def _pattern_prefix(pattern):
+        # return the literal prefix of an fnmatch pattern
+        for count, c in enumerate(pattern):
+            if c in "*?[":
+                return pattern[:count]
+        return pattern
+
+    def _index_get(self, patterns):
+        # Yield ( KEY, KEY_RAW ) in sorted order for the keys
+        # matching any of the fnmatch patterns (as
+        # commonl.field_needed() does)
+        #
+        # Any key matching a pattern (or being a subfield of it) has
+        # to start with the pattern's literal prefix; in the sorted
+        # key list, those are all together, so we bisect to the first
+        # one and walk until the prefix doesn't match, instead of
+        # fnmatching every key in the database.
+        index, index_keys = self._index_refresh()
+        if not patterns:
+            yield from index
+            return
+        prefixes = []
+        for prefix in sorted(set(self._pattern_prefix(pattern)
+                                 for pattern in patterns)):
+            # 'a.' covers 'a.b.', so don't walk the same keys twice
+            if prefixes and prefix.startswith(prefixes[-1]):
+                continue
+            prefixes.append(prefix)
+        for prefix in prefixes:
+            start = bisect.bisect_left(index_keys, prefix)
+            for key, key_raw in itertools.islice(index, start, None):
+                if not key.startswith(prefix):
+                    break
+                if field_needed(key, patterns):
+                    yield key, key_raw
+
+    def _raw_valid_entry(self, entry):
+        return entry.is_symlink()
 
     def _raw_valid(self, location):
         return os.path.islink(location)
@@ -3960,92 +4823,63 @@ class fsdb_symlink_c(fsdb_c):
         key_quoted = self._key_quote(key)
         return key_quoted, self._location_get_raw(key_quoted)
 
+    def _keys(self, pattern):
+        if pattern == None:
+            return [ key for key, _key_raw in self._index_get(None) ]
+        return [ key for key, _key_raw in self._index_get([ pattern ])
+                 # _index_get() also matches subfields; keys() doesn't
+                 if fnmatch.fnmatch(key, pattern) ]
+
     def keys(self, pattern = None):
-        l = []
-        for _rootname, _dirnames, filenames_raw in os.walk(self.location):
-            filenames = []
-            for filename_raw in filenames_raw:
-                # need to filter with the unquoted name...
-                filename = urllib.parse.unquote(filename_raw)
-                if pattern == None or fnmatch.fnmatch(filename, pattern):
-                    if self._raw_valid(os.path.join(self.location, filename_raw)):
-                        l.append(filename)
-        return l
+        return list(self._cache_get(( "keys", pattern ),
+                                    self._read_consistent,
+                                    self._keys, pattern))
 
-    def get_as_slist(self, *patterns):
+    def _get_as_slist(self, patterns):
         fl = []
-        for _rootname, _dirnames, filenames_raw in os.walk(self.location):
-            filenames = {}
-            for filename in filenames_raw:
-                filenames[urllib.parse.unquote(filename)] = filename
-            if patterns:	# that means no args given
-                use = {}
-                for filename, filename_raw in filenames.items():
-                    if field_needed(filename, patterns):
-                        use[filename] = filename_raw
-            else:
-                use = filenames
-            for filename, filename_raw in use.items():
-                if self._raw_valid(os.path.join(self.location, filename_raw)):
-                    bisect.insort(fl, ( filename, self._get_raw(filename_raw) ))
+        for key, key_raw in self._index_get(patterns):
+            value = self._get_raw(key_raw)
+            if value != None:		# removed since we scanned
+                fl.append(( key, value ))
         return fl
 
-    def get_as_dict(self, *patterns):
+    def get_as_slist(self, *patterns):
+        return list(self._cache_get(( "slist", patterns ),
+                                    self._read_consistent,
+                                    self._get_as_slist, patterns))
+
+    def _get_as_dict(self, patterns):
         d = {}
-        for _rootname, _dirnames, filenames_raw in os.walk(self.location):
-            filenames = {}
-            for filename in filenames_raw:
-                filenames[urllib.parse.unquote(filename)] = filename
-            if patterns:	# that means no args given
-                use = {}
-                for filename, filename_raw in filenames.items():
-                    if field_needed(filename, patterns):
-                        use[filename] = filename_raw
-            else:
-                use = filenames
-            for filename, filename_raw in use.items():
-                if self._raw_valid(os.path.join(self.location, filename_raw)):
-                    d[filename] = self._get_raw(filename_raw)
+        for key, key_raw in self._index_get(patterns):
+            value = self._get_raw(key_raw)
+            if value != None:		# removed since we scanned
+                d[key] = value
         return d
 
+    def get_as_dict(self, *patterns):
+        return dict(self._cache_get(( "dict", patterns ),
+                                    self._read_consistent,
+                                    self._get_as_dict, patterns))
+
 
     def set(self, key, value, force = True,
             nested_flat_keyspace: bool = True,
             _keys_index: dict = None):
+        if self._transaction_record([ ( key, value ) ], force,
+                                    nested_flat_keyspace):
+            return True
+        # the generation is bumped once, when done, even if we have
+        # to recurse to cleanup the keyspace
+        with self._generation_deferred():
+            return self._set(key, value, force, nested_flat_keyspace,
+                             _keys_index)
+
+    def _set(self, key, value, force, nested_flat_keyspace, _keys_index):
         # escape out slashes and other unsavory characters in a non
         # destructive way that won't work as a filename
         key_orig = key
         key, location = self._location_get(key)
-        if value != None:
-            # the storage is always a string, so encode what is not as
-            # string as T:REPR, where T is type (b boolean, n number,
-            # s string) and REPR is the textual repr, json valid
-            if isinstance(value, bool):
-                # do first, otherwise it will test as int
-                # str first so we get True/False
-                value = b"b:" + str(value).encode()
-            elif isinstance(value, numbers.Integral):
-                # sadly, this looses precission in floats. A lot
-                value = b"i:%d" % value
-            elif isinstance(value, numbers.Real):
-                # sadly, this can loose precission in floats--FIXME:
-                # better solution needed
-                value = b"f:%.10f" % value
-            elif isinstance(value, str):
-                # take care of special strings that might look like
-                # our formatting, escape them
-                if value.startswith("i:") \
-                   or value.startswith("f:") \
-                   or value.startswith("b:") \
-                   or value.startswith("s:") \
-                   or value == "":
-                    value = b"s:" + value.encode()
-                else:
-                    value = b"s:" + value.encode()
-            elif isinstance(value, bytes):
-                value = b"x:" + value
-            else:
-                raise ValueError("can't store value of type %s" % type(value))
+        value = self._value_encode(value)
         if value == None:
             # note that we are setting None (aka: removing the value)
             # we also need to remove any "subfield" -- KEY.a, KEY.b
@@ -4246,6 +5080,9 @@ class fsdb_symlink_c(fsdb_c):
 
         Note this version optimizes the cleaning up of key space
         """
+        if self._transaction_record(sorted(key_list, key = lambda t: t[0]),
+                                    force, nested_flat_keyspace):
+            return
 
         if nested_flat_keyspace:
             # because we'll set multiple fields, generate this index
@@ -4257,38 +5094,39 @@ class fsdb_symlink_c(fsdb_c):
 
         # We could paralellize, but some environments *flask* cough
         # when we use concurrent, etc...
-        for key, value in sorted(key_list, key = lambda t: t[0]):
-            self.set(key, value, force = force,
-                     nested_flat_keyspace = nested_flat_keyspace,
-                     _keys_index = all_keys_index)
+        #
+        # Bump the generation only once for all
+        with self._generation_deferred():
+            for key, value in sorted(key_list, key = lambda t: t[0]):
+                self.set(key, value, force = force,
+                         nested_flat_keyspace = nested_flat_keyspace,
+                         _keys_index = all_keys_index)
+
+
+
+    def _transaction_commit(self, ops):
+        # like set_keys(), build the key index only once for all the
+        # operations and bump the generation only once; however,
+        # since operations are applied in order and not sorted, later
+        # ones might be for subkeys of earlier ones, so add them to
+        # the index as we go
+        with self._generation_deferred():
+            all_keys_index = self._mkindex(set(self.keys()))
+            for key, value, force, nested_flat_keyspace in ops:
+                self.set(key, value, force = force,
+                         nested_flat_keyspace = nested_flat_keyspace,
+                         _keys_index = all_keys_index)
+                if value != None:
+                    d_itr = all_keys_index
+                    for part in key.split("."):
+                        d_itr = d_itr.setdefault(part, {})
 
 
 
     def _get_raw(self, key, default = None):
         location = self._location_get_raw(key)
         try:
-            value = self._raw_read(location)
-            # if the value was type encoded (see set()), decode it;
-            # otherwise, it is a string
-            if value.startswith(b"i:"):
-                return json.loads(value[2:])
-            if value.startswith(b"f:"):
-                return json.loads(value[2:])
-            if value.startswith(b"b:"):
-                val = value[2:]
-                if val == b"True":
-                    return True
-                if val == b"False":
-                    return False
-                raise ValueError("fsdb %s: key %s bad boolean '%s'"
-                                 % (self.location, key, value))
-            if value.startswith(b"x:"):
-                # raw byes string
-                return value[2:]
-            if value.startswith(b"s:"):
-                # string that might start with s: or empty
-                return value[2:].decode()
-            return value.decode()	# other string
+            return self._value_decode(key, self._raw_read(location))
         except OSError as e:
             if e.errno == errno.ENOENT:
                 return default
@@ -4298,7 +5136,11 @@ class fsdb_symlink_c(fsdb_c):
     def get(self, key, default = None):
         # escape out slashes and other unsavory characters in a non
         # destructive way that won't work as a filename
-        return self._get_raw(self._key_quote(key), default = default)
+        value = self._cache_get(( "get", key ), self._get_raw,
+                                self._key_quote(key))
+        if value == None:
+            return default
+        return value
 
 
 class fsdb_file_c(fsdb_symlink_c):
@@ -4319,6 +5161,9 @@ class fsdb_file_c(fsdb_symlink_c):
     # note the data is written as a string, since that's what we do
     # with symlinks, so we can just open in default, text mode
 
+    def _raw_valid_entry(self, entry):
+        return entry.is_file()
+
     def _raw_valid(self, location):
         return os.path.isfile(location)
 
@@ -4337,6 +5182,504 @@ class fsdb_file_c(fsdb_symlink_c):
         os.replace(location_new, location)
 
 
+class fsdb_log_c(fsdb_c):
+    """
+    Database stored in a single, memory-mapped, append-only log file
+
+    Instead of one symlink per key (see :class:`fsdb_symlink_c`), all
+    the keys live in a single file (*DIRNAME/fsdb.log*) which is made
+    of a header and a sequence of records::
+
+      HEADER:  MAGIC[8] END[8] COMPACTIONS[8]
+      RECORD:  KEYLEN[2] VALUELEN[4] KEY[KEYLEN] VALUE[VALUELEN]
+
+    (little endian); a record with *VALUELEN* zero marks the key as
+    deleted (values are never empty, since they always carry a type
+    prefix, see :meth:`fsdb_c._value_encode`).
+
+    - *END* is the offset where the committed data ends; writers
+      append records past it, flush them to disk (see :data:`sync`)
+      and only then update *END*. Readers only look at records before
+      *END*, so a set is atomic with regards to readers in this or
+      other processes: they see either the old or the new values,
+      never half. After a crash, *END* might miss the last commits,
+      but never points past data that didn't make it to disk.
+
+    - writers serialize with a :func:`fcntl.flock` on the file, so
+      multiple processes (eg: gunicorn workers) can update the same
+      database.
+
+    - the record headers are the index: each process maps the file
+      and keeps an in-memory index of *KEY -> (OFFSET, LENGTH)*
+      which it updates incrementally by hopping over the records
+      appended since its last look (no values are read). Thus a read
+      costs a :func:`os.stat` (to detect compactions) and a memory
+      access to *END*, instead of a *readlink()* per key.
+
+    - when the log has grown past :data:`compact_size_min` and less
+      than half of it is live data, it is rewritten with only the
+      live records, sorted by key, and atomically renamed over the
+      old one; other processes detect it on their next access
+      because the file's inode changed.
+
+    Databases in the symlink format can be converted with
+    :meth:`migrate_from_symlink` (or the *ttbd-fsdb-migrate* tool).
+    """
+    class invalid_e(fsdb_c.exception):
+        pass
+
+    #: Name of the log file inside the database directory
+    filename = "fsdb.log"
+
+    #: Minimum size of the log file (in bytes) before we consider
+    #: compacting it
+    compact_size_min = 256 * 1024
+
+    #: Flush the records to disk before committing them
+    #:
+    #: If *False*, a commit doesn't wait for the disk, which is much
+    #: faster but after a crash *END* might point past records that
+    #: were not written.
+    sync = True
+
+    #: Maximum length of a key (in bytes, encoded as UTF-8)
+    key_len_max = 0xffff
+
+    #: Maximum length of a value (in bytes, encoded)
+    value_len_max = 0xffffffff
+
+    _magic = b"TCFFSDB1"
+    _header_fmt = "<8sQQ"
+    _header_size = struct.calcsize(_header_fmt)
+    _end_fmt = "<Q"
+    _end_offset = 8
+    _record_fmt = "<HI"
+    _record_size = struct.calcsize(_record_fmt)
+
+    def __init__(self, dirname, concept = "directory"):
+        if fcntl == None:
+            raise self.invalid_e(
+                "%s: log backend needs fcntl, not available in this platform"
+                % os.path.basename(dirname))
+        if not os.path.isdir(dirname):
+            raise self.invalid_e("%s: invalid %s"
+                                 % (os.path.basename(dirname), concept))
+        if not os.access(dirname, os.R_OK | os.W_OK | os.X_OK):
+            raise self.invalid_e("%s: cannot access %s"
+                                 % (os.path.basename(dirname), concept))
+        self.location = dirname
+        self.path = os.path.join(dirname, self.filename)
+        # protects the file descriptor, map and index from other
+        # threads in this process; other processes are kept at bay
+        # with flock()
+        self._lock = threading.RLock()
+        self._fd = None
+        self._mm = None
+        self._ino = None
+        self._index = {}
+        self._scanned = self._header_size
+        self._live = 0
+        with self._lock:
+            self._open()
+
+    def __del__(self):
+        try:
+            self._close()
+        except Exception:	# interpreter might be going down
+            pass
+
+    def _close(self):
+        if self._mm != None:
+            self._mm.close()
+            self._mm = None
+        if self._fd != None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _open(self):
+        # (re)open the log file, creating it if needed, and start with
+        # an empty index; the next _refresh() will load it
+        self._close()
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o660)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                st = os.fstat(fd)
+                if st.st_size < self._header_size:
+                    # new file, initialize it
+                    os.pwrite(fd, struct.pack(self._header_fmt, self._magic,
+                                              self._header_size, 0), 0)
+                else:
+                    header = os.pread(fd, self._header_size, 0)
+                    magic, _end, _compactions = \
+                        struct.unpack(self._header_fmt, header)
+                    if magic != self._magic:
+                        raise self.invalid_e(
+                            f"{self.path}: not an fsdb log file"
+                            f" (bad magic {magic})")
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            self._ino = os.fstat(fd).st_ino
+        except:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self._mm = mmap.mmap(fd, 0, access = mmap.ACCESS_READ)
+        self._index = {}
+        self._scanned = self._header_size
+        self._live = 0
+
+    def _end_get(self):
+        return struct.unpack_from(self._end_fmt, self._mm, self._end_offset)[0]
+
+    def _scan(self, end):
+        # update the index with the records between what we scanned
+        # last and END; only the headers are read
+        if end > len(self._mm):
+            # the file grew past our map, remap it
+            self._mm.close()
+            self._mm = mmap.mmap(self._fd, 0, access = mmap.ACCESS_READ)
+        mm = self._mm
+        index = self._index
+        offset = self._scanned
+        while offset < end:
+            key_len, value_len = struct.unpack_from(self._record_fmt, mm, offset)
+            offset += self._record_size
+            key = mm[offset:offset + key_len].decode('utf-8')
+            offset += key_len
+            entry = index.pop(key, None)
+            if entry != None:
+                self._live -= self._record_size + entry[2] + entry[1]
+            if value_len:
+                index[key] = ( offset, value_len, key_len )
+                self._live += self._record_size + key_len + value_len
+            offset += value_len
+        self._scanned = end
+
+    def _refresh(self):
+        # bring the index up to date with what is in disk; must be
+        # called with self._lock held
+        try:
+            if os.stat(self.path).st_ino != self._ino:
+                # compacted by someone else, start over
+                self._open()
+        except FileNotFoundError:
+            # the database has been wiped (eg: an allocation being
+            # removed), so there is nothing; forget what we scanned,
+            # if the file is created again it has to be read again
+            self._close()
+            self._ino = None
+            self._index = {}
+            self._scanned = self._header_size
+            self._live = 0
+            return
+        end = self._end_get()
+        if end > self._scanned:
+            self._scan(end)
+
+    def _value_get(self, key):
+        entry = self._index.get(key, None)
+        if entry == None:
+            return None
+        offset, value_len, _ = entry
+        return self._mm[offset:offset + value_len]
+
+    @classmethod
+    def _key_check(cls, key):
+        # the length of the key has to fit in the record's header
+        if len(key.encode('utf-8')) > cls.key_len_max:
+            raise ValueError(
+                f"{key[:32]}...: key too long ({len(key.encode('utf-8'))}"
+                f" bytes, maximum {cls.key_len_max})")
+
+    @staticmethod
+    def _record_pack(key, value):
+        key_bytes = key.encode('utf-8')
+        if value == None:
+            value = b""
+        return struct.pack(fsdb_log_c._record_fmt,
+                           len(key_bytes), len(value)) + key_bytes + value
+
+    @staticmethod
+    def _keys_cleanup_list(keys_sorted, key):
+        # Return the list of keys that have to be removed when *key*
+        # is set to keep the nested flat keyspace congruent (see
+        # fsdb_symlink_c._keys_cleanup(), same thing)
+        #
+        # - the super keys (for a.b.c: a and a.b) if they are scalars
+        # - the subkeys (a.b.c.*), since a.b.c is now a scalar
+        #
+        # keys_sorted is a sorted list of the existing keys, so we
+        # can bisect instead of walking all of them
+        l = []
+        parts = key.split(".")
+        for count in range(1, len(parts)):
+            superkey = ".".join(parts[:count])
+            idx = bisect.bisect_left(keys_sorted, superkey)
+            if idx < len(keys_sorted) and keys_sorted[idx] == superkey:
+                l.append(superkey)
+        prefix = key + "."
+        idx = bisect.bisect_left(keys_sorted, prefix)
+        while idx < len(keys_sorted) and keys_sorted[idx].startswith(prefix):
+            l.append(keys_sorted[idx])
+            idx += 1
+        return l
+
+    def _commit(self, records_fn):
+        # Append records to the log atomically
+        #
+        # records_fn is called with the database locked (and the
+        # index fresh) and returns ( RECORDS, RESULT ), RECORDS being
+        # a list of ( KEY, ENCODEDVALUE ) to append (ENCODEDVALUE
+        # None to remove) and RESULT what we have to return.
+        with self._lock:
+            while True:
+                if self._fd == None:
+                    # the file was removed, (re)create it
+                    try:
+                        self._open()
+                    except FileNotFoundError as e:
+                        raise self.invalid_e(
+                            f"{self.location}: database removed") from e
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+                try:
+                    # if the file was compacted (or removed) while we
+                    # waited for the lock, we'll reopen and retry
+                    try:
+                        ino = os.stat(self.path).st_ino
+                    except FileNotFoundError:
+                        ino = None
+                    if ino == self._ino:
+                        end = self._end_get()
+                        if end > self._scanned:
+                            self._scan(end)
+                        records, result = records_fn()
+                        if not records:
+                            return result
+                        data = b"".join(self._record_pack(key, value)
+                                        for key, value in records)
+                        os.pwrite(self._fd, data, end)
+                        # the data has to be in disk before the
+                        # header points to it, or after a crash END
+                        # could be past data never written
+                        if self.sync:
+                            os.fdatasync(self._fd)
+                        # this is the commit point: readers only look
+                        # until the end recorded in the header
+                        end += len(data)
+                        os.pwrite(self._fd, struct.pack(self._end_fmt, end),
+                                  self._end_offset)
+                        self._scan(end)
+                        if end > self.compact_size_min \
+                           and self._live * 2 < end:
+                            self._compact_locked()
+                        return result
+                finally:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+                try:
+                    self._open()
+                except FileNotFoundError as e:
+                    raise self.invalid_e(
+                        f"{self.location}: database removed") from e
+
+    def _compact_locked(self):
+        # rewrite the log with only the live records, sorted by key
+        #
+        # Called from _commit() with the old file locked; anyone
+        # waiting for the lock on the old file will notice the inode
+        # changed and retry on the new file.
+        header_size = self._header_size
+        compactions = struct.unpack_from(self._header_fmt, self._mm, 0)[2]
+        data = b"".join(
+            self._record_pack(key, self._value_get(key))
+            for key in sorted(self._index))
+        path_new = self.path + "-" + str(os.getpid()) \
+            + "-" + str(threading.get_ident())
+        fd = os.open(path_new, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o660)
+        try:
+            os.pwrite(fd, struct.pack(self._header_fmt, self._magic,
+                                      header_size + len(data),
+                                      compactions + 1), 0)
+            os.pwrite(fd, data, header_size)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(path_new, self.path)
+
+    def generation(self):
+        # the log is already read into memory, so reads are not
+        # cached (see fsdb_c._cache_get()), but others (eg:
+        # ttbl.test_target.to_dict()) might want to know if there
+        # were changes; the end of the log moves forward with each
+        # commit and the compaction count changes if it moves back
+        with self._lock:
+            self._refresh()
+            if self._mm == None:
+                return None
+            _magic, end, compactions = \
+                struct.unpack_from(self._header_fmt, self._mm, 0)
+            return ( compactions, end )
+
+    def keys(self, pattern = None):
+        with self._lock:
+            self._refresh()
+            if pattern == None:
+                return list(self._index)
+            return [ key for key in self._index
+                     if fnmatch.fnmatch(key, pattern) ]
+
+    def get_as_slist(self, *patterns):
+        with self._lock:
+            self._refresh()
+            fl = []
+            for key in sorted(self._index):
+                if patterns and not field_needed(key, patterns):
+                    continue
+                fl.append(( key, self._value_decode(
+                    key, self._value_get(key)) ))
+            return fl
+
+    def get_as_dict(self, *patterns):
+        with self._lock:
+            self._refresh()
+            d = {}
+            for key in self._index:
+                if patterns and not field_needed(key, patterns):
+                    continue
+                d[key] = self._value_decode(key, self._value_get(key))
+            return d
+
+    def get(self, key, default = None):
+        with self._lock:
+            self._refresh()
+            value = self._value_get(key)
+            if value == None:
+                return default
+            return self._value_decode(key, value)
+
+    def _records_make(self, ops):
+        # compute the records needed to do all the operations ( KEY,
+        # VALUE, FORCE, NESTED_FLAT_KEYSPACE ) in ops, tracking what
+        # the keyspace will look like after each
+        keys_sorted = sorted(self._index)
+        records = []
+        result = True
+        for key, value, force, nested_flat_keyspace in ops:
+            value = self._value_encode(value)
+            if value != None and len(value) > self.value_len_max:
+                raise ValueError(
+                    f"{key}: value too long ({len(value)} bytes,"
+                    f" maximum {self.value_len_max})")
+            idx = bisect.bisect_left(keys_sorted, key)
+            exists = idx < len(keys_sorted) and keys_sorted[idx] == key
+            if value != None and exists and force == False:
+                result = False		# exists, not overriding
+                continue
+            if nested_flat_keyspace:
+                for key_cleanup in self._keys_cleanup_list(keys_sorted, key):
+                    records.append(( key_cleanup, None ))
+                    keys_sorted.remove(key_cleanup)
+                # indexes might have shifted
+                idx = bisect.bisect_left(keys_sorted, key)
+            if value == None:
+                if exists:
+                    records.append(( key, None ))
+                    keys_sorted.pop(idx)
+                continue
+            records.append(( key, value ))
+            if not exists:
+                keys_sorted.insert(idx, key)
+        return records, result
+
+    def set(self, key, value, force = True,
+            nested_flat_keyspace: bool = True,
+            _keys_index: dict = None):
+        self._key_check(key)
+        if self._transaction_record([ ( key, value ) ], force,
+                                    nested_flat_keyspace):
+            return True
+        return self._commit(lambda: self._records_make(
+            [ ( key, value, force, nested_flat_keyspace ) ]))
+
+    def set_keys(self, key_list, force = True,
+                 nested_flat_keyspace: bool = True):
+        """
+        Set multiple keys/values
+
+        Same as :meth:`fsdb_symlink_c.set_keys`, but all the keys are
+        set in a single atomic commit.
+        """
+        key_list = sorted(key_list, key = lambda t: t[0])
+        for key, _value in key_list:
+            self._key_check(key)
+        if self._transaction_record(key_list, force, nested_flat_keyspace):
+            return
+        self._commit(lambda: self._records_make(
+            [ ( key, value, force, nested_flat_keyspace )
+              for key, value in key_list ]))
+
+    def _transaction_commit(self, ops):
+        # all in a single atomic commit
+        self._commit(lambda: self._records_make(ops))
+
+    @classmethod
+    def migrate_from_symlink(cls, dirname, remove = True, exclude = None):
+        """
+        Convert a database in the symlink format to a log file
+
+        All the keys in *dirname* stored as symlinks (per
+        :class:`fsdb_symlink_c`) are copied verbatim to a log file in
+        the same directory, in a single commit.
+
+        :param str dirname: directory containing the database
+
+        :param bool remove: (optional; default *True*) remove the
+          symlinks once the log file is written
+
+        :param list(str) exclude: (optional) list of :mod:`fnmatch`
+          patterns of key names to leave alone (eg: symlinks in the
+          same directory used for other purposes, such as
+          :class:`ttbl.symlink_acquirer_c`'s *mutex*).
+
+        :returns fsdb_log_c: database object for the converted
+          database
+
+        This shall be done when no other process is using the
+        database (eg: with the daemon stopped), as those would still
+        be accessing the symlinks.
+        """
+        fsdb_symlink = fsdb_symlink_c(dirname)
+        fsdb_log = cls(dirname)
+        records = []
+        filenames_raw = []
+        for filename_raw in os.listdir(dirname):
+            location = os.path.join(dirname, filename_raw)
+            if filename_raw.startswith(fsdb_symlink_c.generation_filename):
+                continue
+            if not fsdb_symlink._raw_valid(location):
+                continue
+            key = urllib.parse.unquote(filename_raw)
+            if exclude and any(fnmatch.fnmatch(key, pattern)
+                               for pattern in exclude):
+                continue
+            records.append(( key, fsdb_symlink._raw_read(location) ))
+            filenames_raw.append(filename_raw)
+        records.sort()
+        fsdb_log._commit(lambda: ( records, None ))
+        if remove:
+            for filename_raw in filenames_raw:
+                rm_f(os.path.join(dirname, filename_raw))
+            rm_f(os.path.join(dirname, fsdb_symlink_c.generation_filename))
+        return fsdb_log
+
+
+fsdb_c.backends.update({
+    "file": fsdb_file_c,
+    "log": fsdb_log_c,
+    "symlink": fsdb_symlink_c,
+})
+
+
 def retry_cb_tries(ExceptionToCheck,
                    tries: int = 4, delay: float = 3, backoff: float = 1,
                    header: str = None,
@@ -26,6 +26,7 @@ Debug support
 """
 import collections
 import concurrent.futures
+import copy
 import datetime
 import errno
 import inspect
@@ -1078,6 +1079,16 @@ class server_c:
         self.cache_lockfile = None
         self.fsdb = None
         self.log = logger.getChild(self.url_safe)
+        # warm copy of the inventory, so we can ask the server only
+        # for what changed; see targets_get()
+        #
+        # { PROJECTIONS: ( GENERATION, ETAG, { TARGETID: RT } ) }
+        self._inventory = {}
+        # last data we got for single targets
+        #
+        # { ( TARGETID, PROJECTIONS ): ( ETAG, TEXT ) }
+        self._inventory_etags = {}
+        self._inventory_lock = threading.Lock()
 
         # Sets up any other internal data structure that are no strictly
         # needed until operating seconday parts of the API (eg: file paths)
@@ -1871,7 +1882,7 @@ class server_c:
                      stream = False, raw = False,
                      timeout = 160, timeout_extra = None,
                      retry_timeout = 0, retry_backoff = 0.5,
-                     skip_prefix = False):
+                     skip_prefix = False, headers = None):
         """
         Send a request to the server
 
@@ -1882,6 +1893,7 @@ class server_c:
 
         :param str url: url to request
         :param dict data: args to send in the request. default None
+        :param dict headers: (optional) extra HTTP headers to send
         :param str method: method used to request GET, POST and
           PUT. Defaults to PUT.
         :param bool raise_error: if true, raise an error if something goes
@@ -1954,23 +1966,28 @@ class server_c:
             try:
                 if method == 'GET':
                     r = session.get(url_request, cookies = cookies, json = json,
+                                    headers = headers,
                                     data = data, verify = self.ssl_verify,
                                     stream = stream, timeout = (timeout, timeout))
                 elif method == 'PATCH':
                     r = session.patch(url_request, cookies = cookies, json = json,
+                                      headers = headers,
                                       data = data, verify = self.ssl_verify,
                                       stream = stream, timeout = ( timeout, timeout ))
                 elif method == 'POST':
                     r = session.post(url_request, cookies = cookies, json = json,
+                                     headers = headers,
                                      data = data, files = files,
                                      verify = self.ssl_verify,
                                      stream = stream, timeout = ( timeout, timeout ))
                 elif method == 'PUT':
                     r = session.put(url_request, cookies = cookies, json = json,
+                                    headers = headers,
                                     data = data, verify = self.ssl_verify,
                                     stream = stream, timeout = ( timeout, timeout ))
                 elif method == 'DELETE':
                     r = session.delete(url_request, cookies = cookies, json = json,
+                                       headers = headers,
                                        data = data, verify = self.ssl_verify,
                                        stream = stream, timeout = ( timeout, timeout ))
                 else:
@@ -2187,6 +2204,109 @@ class server_c:
 
 
 
+    def _inventory_get(self, data, projections):
+        # Get the inventory of all the targets, asking only for what
+        # changed since the last time
+        #
+        # We send since=GENERATION (0 if we have nothing); servers
+        # that support deltas reply with header X-Inventory-Generation
+        # and:
+        #
+        ## { "generation": GEN, "full": BOOL,
+        ##   "targets": { TARGETID1: { FIELD: VALUE, ... }, ... },
+        ##   "removed": [ TARGETID, ... ] }
+        #
+        # older servers ignore since and give us
+        #
+        ## { TARGETID1: { FIELD: VALUE, ... }, TARGETID2: ... }
+        #
+        # The inventory can be big, so we decode it as we receive it
+        # (commonl.json_stream_c), without having all the text in
+        # memory.
+        #
+        # Keep the order -- even if json spec doesn't contemplate it, we
+        # use it so the client can tell (if they want) the order in which
+        # for example, power rail components are defined in interfaces.power
+        #
+        # If nothing changed since the last time, the server replies
+        # 304 to our If-None-Match and we just use the warm copy.
+        projections_key = tuple(sorted(projections)) if projections else ()
+        with self._inventory_lock:
+            generation, etag, rts = self._inventory.get(projections_key,
+                                                        ( 0, None, None ))
+        if data == None:
+            data = {}
+        data['since'] = json.dumps(generation)
+        if etag:
+            headers = { 'If-None-Match': etag }
+        else:
+            headers = None
+        r = self.send_request("GET", "targets/", headers = headers,
+                              data = data, raw = True, stream = True,
+                              timeout = 10)
+        with r:
+            if r.status_code == 304:
+                self.log.debug("inventory: generation %s: not modified",
+                               generation)
+                return rts
+            server_generation = r.headers.get('X-Inventory-Generation', None)
+            stream = commonl.json_stream_c(
+                r.iter_content(64 * 1024),
+                object_pairs_hook = collections.OrderedDict)
+            if server_generation == None:
+                # server doesn't support deltas
+                d = collections.OrderedDict()
+                for target_id in stream.object_iter():
+                    d[target_id] = stream.value()
+                return d
+            d = {}
+            for key in stream.object_iter():
+                if key == "targets":
+                    d[key] = collections.OrderedDict()
+                    for target_id in stream.object_iter():
+                        d[key][target_id] = stream.value()
+                else:
+                    d[key] = stream.value()
+        if d['full'] or rts == None:
+            rts = collections.OrderedDict()
+        else:
+            rts = collections.OrderedDict(rts)
+        for target_id in d['removed']:
+            rts.pop(target_id, None)
+        rts.update(d['targets'])
+        self.log.debug("inventory: generation %s -> %s (%s): %d targets"
+                       " updated, %d removed",
+                       generation, d['generation'],
+                       "full" if d['full'] else "delta",
+                       len(d['targets']), len(d['removed']))
+        with self._inventory_lock:
+            self._inventory[projections_key] = (
+                d['generation'], r.headers.get('ETag', None), rts )
+        return rts
+
+
+    def _target_get(self, target_id, data, projections):
+        # Get the inventory of a single target, reusing what we got
+        # last time if the server tells us it didn't change
+        key = ( target_id, tuple(sorted(projections)) if projections else () )
+        with self._inventory_lock:
+            etag, text = self._inventory_etags.get(key, ( None, None ))
+        if etag:
+            headers = { 'If-None-Match': etag }
+        else:
+            headers = None
+        r = self.send_request("GET", "targets/" + target_id,
+                              headers = headers,
+                              data = data, raw = True, timeout = 10)
+        if r.status_code == 304:
+            return text
+        etag = r.headers.get('ETag', None)
+        if etag:
+            with self._inventory_lock:
+                self._inventory_etags[key] = ( etag, r.text )
+        return r.text
+
+
     def targets_get(self, target_id = None, projections = None):
         commonl.assert_none_or_list_of_strings(projections, "projections",
                                                "field name")
@@ -2236,8 +2356,7 @@ class server_c:
             # we do a short timeout here, so dead servers don't hold
             # us too long
             if target_id:
-                r = self.send_request("GET", "targets/" + target_id,
-                                      data = data, raw = True, timeout = 10)
+                text = self._target_get(target_id, data, projections)
                 # when we are asking for a single target, we get
                 #
                 ## { FIELD: VALUE, ... }
@@ -2245,21 +2364,13 @@ class server_c:
                 # Keep the order -- even if json spec doesn't contemplate it, we
                 # use it so the client can tell (if they want) the order in which
                 # for example, power rail components are defined in interfaces.power
-                rt = json.loads(r.text, object_pairs_hook = collections.OrderedDict)
+                rt = json.loads(text, object_pairs_hook = collections.OrderedDict)
                 _rt_handle(target_id, rt)
             else:
-                r = self.send_request("GET", "targets/",
-                                      data = data, raw = True, timeout = 10)
-                # When asking for multiple targets, we get
-                #
-                ## { TARGETID1: { FIELD: VALUE, ... }, TARGETID2: ... }
-                #
-                # Keep the order -- even if json spec doesn't contemplate it, we
-                # use it so the client can tell (if they want) the order in which
-                # for example, power rail components are defined in interfaces.power
-                r = json.loads(r.text, object_pairs_hook = collections.OrderedDict)
-                for target_id, rt in r.items():
-                    _rt_handle(target_id, rt)
+                for target_id, rt in self._inventory_get(data, projections).items():
+                    # _rt_handle() modifies it, and we keep the
+                    # original for applying the next delta
+                    _rt_handle(target_id, copy.deepcopy(rt))
             # for this server, collect how many different keys and
             # values we have; server_rts_flat is keyed by target name;
             # each contains a dict of inventory key and value
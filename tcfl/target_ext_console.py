@@ -916,7 +916,7 @@ class extension(tc.target_extension_c):
 
 
     def _read(self, console = None, offset = 0, _max_size = 0, fd = None,
-              newline = None,
+              newline = None, wait = 0, follow = 0, generation = None,
               **ttbd_iface_call_kwargs):
         """
         Read data received on the target's console
@@ -925,6 +925,14 @@ class extension(tc.target_extension_c):
         :param int offset: (optional) offset to read from (defaults to zero)
         :param int fd: (optional) file descriptor to which to write
           the output (in which case, it returns the bytes read).
+        :param float wait: (optional) if no data is available, wait
+          for up to this many seconds for some (see
+          :meth:`ttbl.console.interface.get_read`)
+        :param float follow: (optional) keep receiving data for up to
+          this many seconds
+        :param generation: (optional) generation the *offset*
+          refers to; waiting/following stops if the console's
+          generation is not this one.
         :returns: tuple consisting of:
           - stream generation
           - stream size after reading
@@ -939,6 +947,17 @@ class extension(tc.target_extension_c):
 
         target = self.target
         console = self._console_get(console)
+        # only send them if used, so we keep working with older servers
+        if wait:
+            ttbd_iface_call_kwargs['wait'] = wait
+        if follow:
+            ttbd_iface_call_kwargs['follow'] = follow
+        if ( wait or follow ) and generation != None:
+            ttbd_iface_call_kwargs['generation'] = generation
+        if wait or follow:
+            # the server might take that long to reply
+            ttbd_iface_call_kwargs['timeout'] = \
+                ttbd_iface_call_kwargs.get('timeout', 160) + wait + follow
         # NOTE! if the content is encoded with chunks, we can't read
         # r.content more than once, so ensure we gather content-length
         # early!
@@ -956,7 +975,11 @@ class extension(tc.target_extension_c):
                 # when doing raw streaming, the call returns
                 # bytes--it's up to the customer to pass the right
                 # file descriptor
-                chunk_size = 1024
+                if follow:
+                    # give us data as soon as it comes
+                    chunk_size = None
+                else:
+                    chunk_size = 1024
                 content_length = 0
                 total = 0
                 for chunk in r.iter_content(chunk_size):
@@ -1001,7 +1024,7 @@ class extension(tc.target_extension_c):
 
 
     def read(self, console = None, offset = 0, max_size = 0, fd = None,
-             newline = None,
+             newline = None, wait = 0, follow = 0, generation = None,
              # when reading, we are ok with retrying a lot, since
              # this is an idempotent operation
              retry_timeout = 60, retry_backoff = 0.1,
@@ -1036,6 +1059,20 @@ class extension(tc.target_extension_c):
           - a regular expresion: whatever matches the regular
             expression is replaced with a *\\n*.
 
+        :param float wait: (optional, default *0*) if there is no
+          data past *offset*, wait for up to this many seconds for
+          some to arrive, instead of returning right away. Older
+          servers ignore this and return right away.
+
+        :param float follow: (optional, default *0*) keep receiving
+          data as it arrives for up to this many seconds; mostly
+          useful with *fd*.
+
+        :param generation: (optional) stream generation *offset*
+          refers to (as returned by :meth:`read_full`); if the
+          console's generation changes (eg: power cycle) while
+          waiting or following, stop.
+
         Retry parameters as to :meth:`tcfl.tc.target_c.ttbd_iface_call`.
 
         :returns: data read (or if written to a file descriptor,
@@ -1043,13 +1080,15 @@ class extension(tc.target_extension_c):
         """
         return self._read(console = console, offset = offset,
                           fd = fd, newline = newline,
+                          wait = wait, follow = follow,
+                          generation = generation,
                           retry_timeout = retry_timeout,
                           retry_backoff = retry_backoff,
                           **ttbd_iface_call_kwargs)[2]
 
 
     def read_full(self, console = None, offset = 0, max_size = 0, fd = None,
-                  newline = None,
+                  newline = None, wait = 0, follow = 0, generation = None,
                   # when reading, we are ok with retrying a lot, since
                   # this is an idempotent operation
                   retry_timeout = 60, retry_backoff = 0.1,
@@ -1089,6 +1128,12 @@ class extension(tc.target_extension_c):
           - a regular expresion: whatever matches the regular
             expression is replaced with a *\\n*.
 
+        :param float wait: (optional) see :meth:`read`
+
+        :param float follow: (optional) see :meth:`read`
+
+        :param generation: (optional) see :meth:`read`
+
         Retry parameters as to :meth:`tcfl.tc.target_c.ttbd_iface_call`.
 
         :returns: tuple consisting of:
@@ -1103,6 +1148,8 @@ class extension(tc.target_extension_c):
         """
         return self._read(console = console, offset = offset,
                           fd = fd, newline = newline,
+                          wait = wait, follow = follow,
+                          generation = generation,
                           retry_timeout = retry_timeout,
                           retry_backoff = retry_backoff,
                           **ttbd_iface_call_kwargs)
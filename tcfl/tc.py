@@ -2348,6 +2348,24 @@ class target_c(reporter_c):
         return s
 
 
+    def _ttbd_iface_args(self, component, kwargs):
+        # encode the arguments of a call to an interface, see
+        # ttbd_iface_call()
+        for k, v in kwargs.items():
+            # We need None  passed verbatim so it is not really
+            # passed, so we don't encode it as JSON here--this needs
+            # some cleanup, is quite confusing, to be fair.
+            if v == None: # or isinstance(v, str):
+                continue
+            kwargs[k] = json.dumps(v)
+
+        if component:
+            kwargs['component'] = json.dumps(component)
+
+        kwargs['ticket'] = self.mkticket_for_call()
+        return kwargs
+
+
     def ttbd_iface_call(self, interface, call, method = "PUT",
                         component = None, stream = False, raw = False,
                         files = None, timeout = 160,
@@ -2414,18 +2432,7 @@ class target_c(reporter_c):
                 f"retry_backoff {retry_backoff} has to be" \
                 f" smaller than retry_timeout {retry_timeout}"
 
-        for k, v in kwargs.items():
-            # We need None  passed verbatim so it is not really
-            # passed, so we don't encode it as JSON here--this needs
-            # some cleanup, is quite confusing, to be fair.
-            if v == None: # or isinstance(v, str):
-                continue
-            kwargs[k] = json.dumps(v)
-
-        if component:
-            kwargs['component'] = json.dumps(component)
-
-        kwargs['ticket'] = self.mkticket_for_call()
+        kwargs = self._ttbd_iface_args(component, kwargs)
 
         # This looks really complex, but it is just the
         # server.send_request() below call
@@ -2495,6 +2502,128 @@ class target_c(reporter_c):
                               )) from e
 
 
+    def ttbd_iface_call_batch(self, calls, parallel = False,
+                              timeout = 160, raise_error = True):
+        """
+        Execute multiple interface calls to TTBD in a single request
+
+        Each call is executed as :meth:`ttbd_iface_call` would, but
+        they are all sent to the server at once, saving the round
+        trips (and the authentication, auditing, etc that the server
+        does for each request); this is useful for steps that do
+        many short calls in a row (eg: check the power, console and
+        storage of all the targets in a group):
+
+        >>> r = target.ttbd_iface_call_batch([
+        >>>     ( None, "power", "get", "GET" ),
+        >>>     ( target1, "console", "size", "GET",
+        >>>       dict(component = "serial0") ),
+        >>> ], parallel = True)
+
+        :param list calls: list of calls, each a tuple *( TARGET,
+          INTERFACE, CALL[, METHOD[, KWARGS]] )*:
+
+          - *TARGET*: :class:`target_c` where to execute the call
+            (*None* for this target); it must be in the same server
+            as this target
+
+          - *INTERFACE*, *CALL*, *METHOD* (defaults to *PUT*): as
+            for :meth:`ttbd_iface_call`
+
+          - *KWARGS*: (optional) dictionary of arguments to the call,
+            as the keyword arguments to :meth:`ttbd_iface_call`
+            (including *component*)
+
+          Calls that stream data or upload files are not supported.
+
+        :param bool parallel: (optional, default *False*) calls are
+          executed in order; if *True*, calls for different targets
+          are executed in parallel (calls for the same target are
+          still executed in order).
+
+        :param float timeout: (optional) seconds to wait for the
+          whole batch to complete
+
+        :param bool raise_error: (optional, default *True*) once all
+          the calls are completed, raise :class:`error_e` for the
+          first that failed; if *False*, the exception is returned in
+          place of said call's result.
+
+        :returns list: list with the result of each call (as
+          :meth:`ttbd_iface_call` would return), in the same order
+        """
+        assert isinstance(calls, list)
+        assert isinstance(parallel, bool)
+        call_specs = []
+        for call_spec in calls:
+            assert isinstance(call_spec, tuple) and 3 <= len(call_spec) <= 5, \
+                "calls: expected tuple ( TARGET, INTERFACE, CALL[, METHOD" \
+                f"[, KWARGS]] ); got {call_spec}"
+            target = call_spec[0]
+            interface = call_spec[1]
+            call = call_spec[2]
+            method = call_spec[3] if len(call_spec) > 3 else "PUT"
+            kwargs = dict(call_spec[4]) if len(call_spec) > 4 else {}
+            if target == None:
+                target = self
+            assert isinstance(target, target_c), \
+                f"calls: TARGET: expected target_c; got {type(target)}"
+            assert target.server == self.server, \
+                f"calls: {target.id}: not in the same server" \
+                f" as {self.id} ({self.server.url_safe})"
+            assert isinstance(interface, str)
+            assert isinstance(call, str)
+            assert method.upper() in ( "PUT", "GET", "DELETE", "POST" ), \
+                "method must be PUT|GET|DELETE|POST; got %s" % method
+            component = kwargs.pop('component', None)
+            assert component == None or isinstance(component, str)
+            call_specs.append(dict(
+                target = target.id, interface = interface, call = call,
+                method = method.upper(),
+                args = {
+                    k: v
+                    for k, v in target._ttbd_iface_args(component,
+                                                        kwargs).items()
+                    if v != None
+                }
+            ))
+
+        try:
+            r = self.server.send_request(
+                "PUT", "batch", timeout = timeout, timeout_extra = None,
+                json = dict(calls = call_specs, parallel = parallel))
+        except requests.RequestException as e:
+            raise error_e(f"{self.id}: batch of {len(calls)} calls:"
+                          f" remote call failed: {e}",
+                          dict(targetid = self.fullid,
+                               server = str(self.server.url_safe),
+                               error = str(e))) from e
+
+        results = []
+        first_error = None
+        for call_spec, r_call in zip(call_specs, r['results']):
+            name = f"{call_spec['target']}: {call_spec['interface']}" \
+                f"/{call_spec['call']}"
+            if r_call.get('status', 400) != 200:
+                e = error_e(f"{name}: remote call failed:"
+                            f" {r_call.get('status', 400)}:"
+                            f" {r_call.get('_message', 'no specific error text available')}",
+                            dict(targetid = call_spec['target'],
+                                 server = str(self.server.url_safe)))
+                if first_error == None:
+                    first_error = e
+                results.append(e)
+                continue
+            result = r_call['result']
+            if '_diagnostics' in result:
+                for line in result.pop('_diagnostics').split("\n"):
+                    logger.warning(f"{name}: diagnostics: " + line)
+            results.append(result)
+        if raise_error and first_error:
+            raise first_error
+        return results
+
+
     def instrument_name_get(self, interface_name, component = None):
         """
         Given a component in an interface, return the name of the
@@ -129,6 +129,12 @@ class _console_reader_c:
          - do not process EOLs (convert CRLF to LF, etc)
          - do not report generation changes (power cycles) to stderr
     """
+
+    #: Seconds we ask the server to wait for new data before
+    #: replying empty (long-poll); servers that don't support it
+    #: reply right away and we back off between reads.
+    wait = 5
+
     def __init__(self, target, console, fd, offset,
                  backoff_wait_max, server_connection_errors_max,
                  timestamp = None, rawmode: bool = False):
@@ -150,6 +156,7 @@ class _console_reader_c:
         """
         data_len = 0
 
+        ts0 = time.time()
         if self.rawmode:
 
             generation, self.offset, data_len = \
@@ -158,8 +165,10 @@ class _console_reader_c:
                     # when reading, we are ok with retrying a lot, since
                     # this is an idempotent operation
                     fd = self.fd,
+                    wait = self.wait, generation = self.generation_prev,
                     retry_backoff = self.backoff_wait,
                     retry_timeout = 60)
+            self.generation_prev = generation
         else:
             # Instead of reading and sending directy to the
             # stdout, we need to break it up in chunks; the
@@ -176,6 +185,7 @@ class _console_reader_c:
                     self.console, self.offset,
                     # when reading, we are ok with retrying a lot, since
                     # this is an idempotent operation
+                    wait = self.wait, generation = self.generation_prev,
                     retry_backoff = self.backoff_wait,
                     retry_timeout = 60)
             logging.info(
@@ -214,6 +224,14 @@ class _console_reader_c:
                               " some data might be missing")
             data_len = len(data)
 
+        if data_len > 0 or time.time() - ts0 >= self.wait / 2:
+            # the server waited for data for us (or we got some), so
+            # we can ask again right away
+            self.backoff_wait = 0.1
+            if self.server_connection_errors > 0:
+                self.server_connection_errors = 0
+            return data_len
+
         if data_len == 0:
             self.backoff_wait *= 2
             logging.info(
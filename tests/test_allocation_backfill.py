@@ -0,0 +1,131 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check backfill (:data:`ttbl.allocation.backfill`) gives a target
+waited for by a group to a lower priority allocation only when it is
+expected to be done before the group can start
+"""
+
+import os
+import time
+
+import tcfl.tc
+import ttbl
+import ttbl.allocation
+import ttbl.config
+import ttbl.power
+import ttbl.user_control
+import utl
+
+class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+    """
+    Exercise :func:`ttbl.allocation._backfill_pick`, without a server
+    """
+
+    @staticmethod
+    def _endtime(seconds):
+        return time.strftime("%Y%m%d%H%M%S",
+                             time.gmtime(time.time() + seconds))
+
+    def _request(self, targets, endtime = None, priority = None):
+        r = ttbl.allocation.request(
+            { "group": targets }, self.user, self.user.get_id(), [],
+            queue = True, endtime = endtime, priority = priority)
+        self.allocids.append(r['allocid'])
+        return r['allocid']
+
+    def _scenario(self, candidate_endtime):
+        # b is busy for an hour; the group a+b waits for a, which is
+        # held by another allocation; once that releases a, who gets
+        # it? the group or the candidate queued after it?
+        for allocid in self.allocids:
+            try:
+                ttbl.allocation.delete(allocid, self.user)
+            except ttbl.allocation.allocation_c.invalid_e:
+                pass		# already deleted
+        self.allocids = []
+        self._request([ "b" ], endtime = self._endtime(3600))
+        allocid_a = self._request([ "a" ])
+        allocid_group = self._request([ "a", "b" ])
+        # lower priority, so it is always after the group in the queue
+        allocid_candidate = self._request(
+            [ "a" ], endtime = self._endtime(candidate_endtime),
+            priority = 60)
+        ttbl.allocation.delete(allocid_a, self.user)
+        return allocid_group, allocid_candidate, \
+            ttbl.config.targets['a'].allocid_get_bare()
+
+    @tcfl.tc.subcase()
+    def eval_00_create(self):
+        ttbl.test_target.state_path = os.path.join(self.tmpdir, "targets")
+        ttbl.allocation.path = os.path.join(self.tmpdir, "allocations")
+        ttbl.allocation.init(self.tmpdir)
+        ttbl.user_control.User.state_dir = os.path.join(self.tmpdir, "users")
+        ttbl.user_control.User.state_dir_secondary = \
+            ttbl.user_control.User.state_dir
+        self.user = ttbl.user_control.User("user1")
+        self.allocids = []
+        ttbl.config.targets.clear()
+        for name in [ "a", "b" ]:
+            target = ttbl.test_target(name)
+            target.acquirer = ttbl.symlink_acquirer_c(target)
+            target.interface_add(
+                "power", ttbl.power.interface(ttbl.power.fake_c()))
+            ttbl.config.targets[name] = target
+
+
+    @tcfl.tc.subcase()
+    def eval_10_backfill(self):
+        try:
+            ttbl.allocation.backfill = True
+            _allocid_group, allocid_candidate, owner = self._scenario(600)
+        finally:
+            ttbl.allocation.backfill = False
+        if owner != allocid_candidate:
+            raise tcfl.tc.failed_e(
+                f"a given to {owner}, expected the short allocation"
+                f" {allocid_candidate}")
+        self.report_pass("short allocation backfilled the group's target")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_too_long(self):
+        try:
+            ttbl.allocation.backfill = True
+            allocid_group, _allocid_candidate, owner = self._scenario(7200)
+        finally:
+            ttbl.allocation.backfill = False
+        if owner != allocid_group:
+            raise tcfl.tc.failed_e(
+                f"a given to {owner}, expected the group {allocid_group}"
+                " since the other allocation would delay it")
+        self.report_pass("long allocation didn't delay the group")
+
+
+    @tcfl.tc.subcase()
+    def eval_30_disabled(self):
+        allocid_group, _allocid_candidate, owner = self._scenario(600)
+        if owner != allocid_group:
+            raise tcfl.tc.failed_e(
+                f"a given to {owner}, expected the group {allocid_group}"
+                " with backfill disabled")
+        self.report_pass("no backfill when disabled")
+
+
+    @tcfl.tc.subcase()
+    def eval_40_durations(self):
+        ttbl.allocation._duration_record("someuser", 100)
+        ttbl.allocation._duration_record("someuser", 200)
+        expected = 100 + ttbl.allocation.backfill_duration_weight * 100
+        estimate = ttbl.allocation._duration_estimate("someuser")
+        if abs(estimate - expected) > 0.001:
+            raise tcfl.tc.failed_e(
+                f"average duration {estimate}, expected {expected}")
+        if ttbl.allocation._duration_estimate("otheruser") != None:
+            raise tcfl.tc.failed_e("unknown user has a duration estimate")
+        self.report_pass("durations averaged per user")
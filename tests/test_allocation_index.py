@@ -0,0 +1,175 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check :func:`ttbl.allocation.query` uses the per-user and per-state
+allocation indexes and returns the same as a full scan would
+"""
+
+import os
+
+import tcfl.tc
+import ttbl
+import ttbl.allocation
+import ttbl.config
+import ttbl.power
+import ttbl.user_control
+import utl
+
+class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+    """
+    Exercise the allocation indexes, without a server
+    """
+
+    def _request(self, user, target_name, obo_user = None, guests = None):
+        r = ttbl.allocation.request(
+            { "group": [ target_name ] }, user,
+            obo_user if obo_user else user.get_id(),
+            guests if guests else [], queue = True)
+        return r['allocid']
+
+    @staticmethod
+    def _query_full(user):
+        # what query() returned when walking all the allocations
+        result = {}
+        for allocid in os.listdir(ttbl.allocation.path):
+            allocdb = ttbl.allocation.get_from_cache(allocid)
+            if allocdb.check_query_permission(user):
+                result[allocid] = allocdb.to_dict()
+        return result
+
+    @tcfl.tc.subcase()
+    def eval_00_create(self):
+        ttbl.test_target.state_path = os.path.join(self.tmpdir, "targets")
+        ttbl.allocation.path = os.path.join(self.tmpdir, "allocations")
+        ttbl.allocation.init(self.tmpdir)
+        ttbl.user_control.User.state_dir = os.path.join(self.tmpdir, "users")
+        ttbl.user_control.User.state_dir_secondary = \
+            ttbl.user_control.User.state_dir
+        self.users = {}
+        for userid in [ "user1", "user2", "user3@domain.com", "admin" ]:
+            self.users[userid] = ttbl.user_control.User(userid)
+        self.users['admin'].role_add("admin")
+        ttbl.config.targets.clear()
+        for name in [ "t0", "t1" ]:
+            target = ttbl.test_target(name)
+            target.acquirer = ttbl.symlink_acquirer_c(target)
+            target.interface_add(
+                "power", ttbl.power.interface(ttbl.power.fake_c()))
+            ttbl.config.targets[name] = target
+
+        user1 = self.users['user1']
+        user2 = self.users['user2']
+        self.allocid_active = self._request(user1, "t0")
+        self.allocid_queued = self._request(user1, "t0",
+                                            guests = [ "user3@domain.com" ])
+        self.allocid_obo = self._request(self.users['admin'], "t1",
+                                         obo_user = "user2")
+        self.allocid_user2 = self._request(user2, "t1")
+
+
+    @tcfl.tc.subcase()
+    def eval_10_query(self):
+        for userid, user in self.users.items():
+            result = ttbl.allocation.query(user)
+            expected = self._query_full(user)
+            if result != expected:
+                raise tcfl.tc.failed_e(
+                    f"{userid}: query() differs from a full scan",
+                    dict(result = result, expected = expected))
+        allocids = set(ttbl.allocation.query(self.users['user2']))
+        if allocids != { self.allocid_obo, self.allocid_user2 }:
+            raise tcfl.tc.failed_e("user2: unexpected allocations",
+                                   dict(allocids = allocids))
+        self.report_pass("query() matches a full scan for all users")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_state(self):
+        for userid in [ "user1", "admin" ]:
+            result = ttbl.allocation.query(self.users[userid],
+                                           state = "queued")
+            expected = dict(
+                ( allocid, d )
+                for allocid, d in self._query_full(self.users[userid]).items()
+                if d['state'] == "queued")
+            if result != expected or not result:
+                raise tcfl.tc.failed_e(
+                    f"{userid}: query(state = queued) unexpected",
+                    dict(result = result, expected = expected))
+        self.report_pass("query() by state")
+
+
+    @tcfl.tc.subcase()
+    def eval_30_updates(self):
+        user1 = self.users['user1']
+        user3 = self.users['user3@domain.com']
+        if list(ttbl.allocation.query(user3)) != [ self.allocid_queued ]:
+            raise tcfl.tc.failed_e("guest can't see the allocation")
+        ttbl.allocation.delete(self.allocid_active, user1)
+        # the queued one got the target
+        result = ttbl.allocation.query(user1, state = "active")
+        if list(result) != [ self.allocid_queued ]:
+            raise tcfl.tc.failed_e("state change not indexed",
+                                   dict(result = result))
+        ttbl.allocation.guest_remove(self.allocid_queued, user1,
+                                     "user3@domain.com")
+        if ttbl.allocation.query(user3):
+            raise tcfl.tc.failed_e("removed guest still sees the allocation")
+        self.report_pass("index updated on delete, state change and"
+                         " guest removal")
+
+
+    @tcfl.tc.subcase()
+    def eval_40_rebuild(self):
+        # as if upgrading from a version with no indexes
+        ttbl.allocation._index_remove("user", "user2", self.allocid_user2)
+        os.unlink(os.path.join(ttbl.allocation.index_path, "complete"))
+        ttbl.allocation.init(self.tmpdir)
+        if self.allocid_user2 not in ttbl.allocation.query(self.users['user2']):
+            raise tcfl.tc.failed_e("index not rebuilt")
+        self.report_pass("index rebuilt")
+
+
+    @tcfl.tc.subcase()
+    def eval_50_invalid(self):
+        allocid = self._request(self.users['user2'], "t1")
+        target_info_reload = ttbl.allocation.allocation_c.target_info_reload
+
+        def _target_info_reload(allocdb):
+            if allocdb.allocid == allocid:
+                raise allocdb.invalid_e(f"{allocid}: database broken")
+            target_info_reload(allocdb)
+
+        try:
+            ttbl.allocation.allocation_c.target_info_reload = \
+                _target_info_reload
+            ttbl.allocation.lru_aged_cache_allocation_c.invalidate()
+            # as the scheduler does when it starts, looking at all the
+            # allocations
+            ttbl.allocation.scheduler_c(self.users['admin']).init()
+            for userid in [ "user1", "user3@domain.com", "admin" ]:
+                result = ttbl.allocation.query(self.users[userid])
+                if result.get(allocid, None) != { "state": "invalid" }:
+                    raise tcfl.tc.failed_e(
+                        f"{userid}: invalid allocation not listed",
+                        dict(result = result))
+            result = ttbl.allocation.query(self.users['admin'],
+                                           state = "invalid")
+            if list(result) != [ allocid ]:
+                raise tcfl.tc.failed_e(
+                    "admin: query(state = invalid) unexpected",
+                    dict(result = result))
+        finally:
+            ttbl.allocation.allocation_c.target_info_reload = \
+                target_info_reload
+            ttbl.allocation.lru_aged_cache_allocation_c.invalidate()
+        if allocid in ttbl.allocation.query(self.users['user1']):
+            raise tcfl.tc.failed_e(
+                "user1: sees user2's allocation once valid again")
+        self.report_pass("allocations with an invalid database are"
+                         " listed to everyone")
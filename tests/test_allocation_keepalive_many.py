@@ -0,0 +1,88 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check keepalives for many allocations processed in a batch
+(:func:`ttbl.allocation.keepalive_many`) return the same as one by
+one (:func:`ttbl.allocation.keepalive`)
+"""
+
+import os
+
+import commonl
+import tcfl.tc
+import ttbl
+import ttbl.allocation
+import ttbl.user_control
+import utl
+
+class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+    """
+    Exercise :func:`ttbl.allocation.keepalive_many`, without a server
+    """
+
+    def _allocation_make(self, allocid, user, state):
+        dirname = os.path.join(ttbl.allocation.path, allocid)
+        commonl.makedirs_p(dirname)
+        fsdb = commonl.fsdb_symlink_c(dirname)
+        fsdb.set_keys([
+            ( "user", user ),
+            ( "creator", user ),
+            ( "state", state ),
+            ( "group_allocated", "t0,t1" ),
+        ])
+
+    @tcfl.tc.subcase()
+    def eval_00_create(self):
+        ttbl.test_target.state_path = os.path.join(self.tmpdir, "targets")
+        ttbl.allocation.path = os.path.join(self.tmpdir, "allocations")
+        ttbl.allocation.init(self.tmpdir)
+        ttbl.user_control.User.state_dir = os.path.join(self.tmpdir, "users")
+        ttbl.user_control.User.state_dir_secondary = \
+            ttbl.user_control.User.state_dir
+        self.user = ttbl.user_control.User("user1")
+        self.expected = {}
+        for count in range(20):
+            allocid = "ka%02d" % count
+            state = "active" if count % 2 else "queued"
+            self._allocation_make(allocid, "user1", state)
+            self.expected[allocid] = state
+        self._allocation_make("kaother", "user2", "active")
+        self.expected["kaother"] = "active"
+        self.expected["kainvalid"] = "active"
+
+
+    @tcfl.tc.subcase()
+    def eval_10_compare(self):
+        serial = {}
+        # expect all queued, so the active ones report the group
+        expected = dict((allocid, "queued") for allocid in self.expected)
+        for allocid in expected:
+            serial[allocid] = ttbl.allocation.keepalive(
+                allocid, "queued", 0, self.user)
+        batch = ttbl.allocation.keepalive_many(expected, 0, self.user)
+        if batch != serial:
+            raise tcfl.tc.failed_e(
+                "keepalive_many() doesn't match keepalive()",
+                dict(batch = batch, serial = serial))
+        if batch['kaother']['state'] != "rejected" \
+           or batch['kainvalid']['state'] != "invalid" \
+           or batch['ka01'].get('group_allocated', None) != "t0,t1":
+            raise tcfl.tc.failed_e("unexpected keepalive results",
+                                   dict(batch = batch))
+        self.report_pass("keepalive_many() matches keepalive()")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_timestamp(self):
+        allocdb = ttbl.allocation.get_from_cache("ka00")
+        allocdb.set("timestamp", "19700101000000")
+        ttbl.allocation.keepalive_many(dict(ka00 = "queued", ka01 = "active"),
+                                       0, self.user)
+        if allocdb.timestamp_get() == "19700101000000":
+            raise tcfl.tc.failed_e("allocation timestamp not refreshed")
+        self.report_pass("keepalive_many() refreshes the timestamp")
@@ -0,0 +1,169 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check target maintenance (:func:`ttbl.allocation.maintenance`) runs
+in parallel and a target whose maintenance hangs doesn't block the
+rest
+"""
+
+import datetime
+import logging
+import os
+import threading
+import time
+
+import tcfl.tc
+import ttbl
+import ttbl.allocation
+import ttbl.config
+import ttbl.power
+import ttbl.user_control
+import utl
+
+class _hung_c(ttbl.power.fake_c):
+    # fake power component whose get() blocks until released
+    def __init__(self, **kwargs):
+        ttbl.power.fake_c.__init__(self, **kwargs)
+        self.release = threading.Event()
+
+    def get(self, target, component):
+        self.release.wait(30)
+        return ttbl.power.fake_c.get(self, target, component)
+
+
+class _log_catcher_c(logging.Handler):
+    # keep the messages logged
+    def __init__(self):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+    """
+    Exercise :func:`ttbl.allocation.maintenance` with a hung target,
+    without a server
+    """
+
+    @tcfl.tc.subcase()
+    def eval_00_create(self):
+        ttbl.test_target.state_path = os.path.join(self.tmpdir, "targets")
+        ttbl.allocation.path = os.path.join(self.tmpdir, "allocations")
+        ttbl.allocation.init(self.tmpdir)
+        ttbl.user_control.User.state_dir = os.path.join(self.tmpdir, "users")
+        ttbl.user_control.User.state_dir_secondary = \
+            ttbl.user_control.User.state_dir
+        self.user = ttbl.user_control.User("user1")
+        self.hung = _hung_c()
+        ttbl.config.targets.clear()
+        for index in range(6):
+            target = ttbl.test_target(f"t{index}")
+            target.acquirer = ttbl.symlink_acquirer_c(target)
+            if index == 0:
+                impl = self.hung
+            else:
+                impl = ttbl.power.fake_c()
+            target.interface_add("power", ttbl.power.interface(main = impl))
+            # powered on, so it has to be powered off for being idle
+            target.fsdb.set("interfaces.power.main.fake-state", True)
+            ttbl.config.targets[target.id] = target
+
+
+    def _powered(self):
+        return [
+            target.id for target in ttbl.config.targets.values()
+            if target.fsdb.get("interfaces.power.main.fake-state") == True
+        ]
+
+
+    @tcfl.tc.subcase()
+    def eval_10_hung(self):
+        budget = ttbl.allocation.maintenance_target_budget
+        target_max_idle = ttbl.config.target_max_idle
+        keepalives = []
+        log_catcher = _log_catcher_c()
+        logging.getLogger().addHandler(log_catcher)
+        # the completion of over-budget targets is logged as a warning
+        log_level = logging.getLogger().level
+        logging.getLogger().setLevel(logging.WARNING)
+        try:
+            ttbl.allocation.maintenance_target_budget = 1
+            ttbl.config.target_max_idle = 1
+            ts0 = time.time()
+            stats = ttbl.allocation.maintenance(
+                datetime.datetime.now(), self.user,
+                lambda: keepalives.append(time.time()))
+            elapsed = time.time() - ts0
+            powered = self._powered()
+            if powered != [ "t0" ]:
+                raise tcfl.tc.failed_e(
+                    "expected only the hung target powered on",
+                    dict(powered = powered, stats = stats))
+            if stats.get('overbudget', 0) != 1 or stats['done'] != 5 \
+               or 'duration' not in stats:
+                raise tcfl.tc.failed_e("unexpected maintenance stats",
+                                       dict(stats = stats))
+            if elapsed > 10:
+                raise tcfl.tc.failed_e(
+                    f"maintenance pass took {elapsed:.2f}s, blocked by"
+                    " the hung target", dict(stats = stats))
+            if not keepalives:
+                raise tcfl.tc.failed_e(
+                    "no keepalives while waiting for the targets")
+            self.report_pass(
+                f"hung target didn't block the rest (pass took"
+                f" {stats['duration']:.2f}s)", dict(stats = stats))
+
+            # still hung, it is skipped
+            stats = ttbl.allocation.maintenance(datetime.datetime.now(),
+                                                self.user)
+            if stats.get('skipped', 0) != 1:
+                raise tcfl.tc.failed_e(
+                    "hung target not skipped by the next pass",
+                    dict(stats = stats))
+            self.report_pass("hung target skipped by the next pass")
+
+            # unblock it, let it finish in the background
+            self.hung.release.set()
+            ts0 = time.time()
+            while ttbl.allocation._maintenance_in_flight \
+                  and time.time() - ts0 < 10:
+                time.sleep(0.1)
+            powered = self._powered()
+            if powered:
+                raise tcfl.tc.failed_e(
+                    "hung target not powered off once unblocked",
+                    dict(powered = powered))
+            ts0 = time.time()
+            while time.time() - ts0 < 5:
+                if any(message.startswith("t0: maintenance left running"
+                                          " in the background finished")
+                       for message in log_catcher.messages):
+                    break
+                time.sleep(0.1)
+            else:
+                raise tcfl.tc.failed_e(
+                    "completion of the hung target's maintenance not"
+                    " logged", dict(messages = log_catcher.messages))
+            self.report_pass("completion of the hung target's maintenance"
+                             " logged")
+            stats = ttbl.allocation.maintenance(datetime.datetime.now(),
+                                                self.user)
+            if stats.get('skipped', 0) or stats.get('overbudget', 0):
+                raise tcfl.tc.failed_e(
+                    "unexpected maintenance stats once unblocked",
+                    dict(stats = stats))
+            self.report_pass("hung target maintained once unblocked")
+        finally:
+            logging.getLogger().setLevel(log_level)
+            logging.getLogger().removeHandler(log_catcher)
+            self.hung.release.set()
+            ttbl.allocation.maintenance_target_budget = budget
+            ttbl.config.target_max_idle = target_max_idle
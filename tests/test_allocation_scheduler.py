@@ -0,0 +1,153 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check the event driven allocation scheduler
+(:class:`ttbl.allocation.scheduler_c`) acts on events and deadlines
+and that the work it does doesn't depend on how many idle targets
+there are
+"""
+
+import datetime
+import os
+
+import tcfl.tc
+import ttbl
+import ttbl.allocation
+import ttbl.config
+import ttbl.power
+import ttbl.user_control
+import utl
+
+class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+    """
+    Exercise :class:`ttbl.allocation.scheduler_c`, without a server
+    """
+
+    def _fleet_make(self, prefix, count):
+        ttbl.config.targets.clear()
+        for index in range(count):
+            target = ttbl.test_target(f"{prefix}{index}")
+            target.acquirer = ttbl.symlink_acquirer_c(target)
+            target.interface_add(
+                "power", ttbl.power.interface(ttbl.power.fake_c()))
+            ttbl.config.targets[target.id] = target
+        return ttbl.config.targets[f"{prefix}0"]
+
+    def _request(self, target):
+        r = ttbl.allocation.request(
+            { "group": [ target.id ] }, self.user, self.user.get_id(), [],
+            queue = True)
+        return r['allocid'], r['state']
+
+    def _cycle(self, prefix, count):
+        # with a fleet of *count* targets, allocate one, queue another
+        # allocation on it and release it; return the work each tick
+        # did
+        target = self._fleet_make(prefix, count)
+        scheduler = ttbl.allocation.scheduler_c(self.user)
+        scheduler.init()
+        # the new targets have never been used, so they are checked
+        # for power off right away; that's proportional to the fleet
+        # size, but done only once
+        scheduler.tick(0)
+        work = []
+        allocid0, state0 = self._request(target)
+        allocid1, state1 = self._request(target)
+        if ( state0, state1 ) != ( "active", "queued" ):
+            raise tcfl.tc.error_e(
+                f"expected allocations active/queued; got {state0}/{state1}")
+        work.append(dict(scheduler.tick(0)))
+        target.release(self.user, False)
+        work.append(dict(scheduler.tick(0)))
+        state1 = ttbl.allocation.get_from_cache(allocid1).state_get()
+        if state1 != "active":
+            raise tcfl.tc.failed_e(
+                f"{prefix}: queued allocation didn't get the target once"
+                f" released; state is {state1}", dict(work = work))
+        ttbl.allocation.delete(allocid0, self.user)
+        ttbl.allocation.delete(allocid1, self.user)
+        work.append(dict(scheduler.tick(0)))
+        return scheduler, work
+
+    @tcfl.tc.subcase()
+    def eval_00_create(self):
+        ttbl.test_target.state_path = os.path.join(self.tmpdir, "targets")
+        ttbl.allocation.path = os.path.join(self.tmpdir, "allocations")
+        ttbl.allocation.init(self.tmpdir)
+        ttbl.user_control.User.state_dir = os.path.join(self.tmpdir, "users")
+        ttbl.user_control.User.state_dir_secondary = \
+            ttbl.user_control.User.state_dir
+        self.user = ttbl.user_control.User("user1")
+
+
+    @tcfl.tc.subcase()
+    def eval_10_fleet_size(self):
+        _, work_small = self._cycle("small", 4)
+        _, work_big = self._cycle("big", 40)
+        if work_small != work_big:
+            raise tcfl.tc.failed_e(
+                "work done per tick depends on the number of idle targets",
+                dict(work_small = work_small, work_big = work_big))
+        self.report_pass("work done per tick doesn't depend on the"
+                         " number of idle targets",
+                         dict(work = work_small))
+
+
+    @tcfl.tc.subcase()
+    def eval_20_timeout(self):
+        target_max_idle = ttbl.config.target_max_idle
+        try:
+            ttbl.config.target_max_idle = 1
+            target = self._fleet_make("idle", 2)
+            for target_idle in ttbl.config.targets.values():
+                # don't power off, we only care for the allocation
+                target_idle.property_set("skip_cleanup", True)
+            scheduler = ttbl.allocation.scheduler_c(self.user)
+            scheduler.init()
+            allocid, _state = self._request(target)
+            scheduler.tick(0)
+            # no keepalives, it has to be timed out and the target
+            # released
+            scheduler.tick(5)
+            scheduler.tick(0)
+            try:
+                ttbl.allocation.get_from_cache(allocid)
+                raise tcfl.tc.failed_e("idle allocation not timed out")
+            except ttbl.allocation.allocation_c.invalid_e:
+                pass
+            if target.owner_get():
+                raise tcfl.tc.failed_e("target not released")
+            self.report_pass("idle allocation timed out on its deadline")
+        finally:
+            ttbl.config.target_max_idle = target_max_idle
+
+
+    @tcfl.tc.subcase()
+    def eval_30_ttl(self):
+        _time = ttbl.allocation._time
+        try:
+            # a clock that is not the system's (eg: the simulator's)
+            ttbl.allocation._time = lambda: 1000.0
+            target = self._fleet_make("ttl", 1)
+            allocid, _state = self._request(target)
+            allocdb = ttbl.allocation.get_from_cache(allocid)
+            allocdb.set("ttl", 100)
+            allocdb.maintenance(datetime.datetime.now())
+            if allocdb.state_get() != "active":
+                raise tcfl.tc.failed_e(
+                    "allocation deleted before its TTL on the same clock")
+            ttbl.allocation._time = lambda: 1200.0
+            allocdb.maintenance(datetime.datetime.now())
+            try:
+                ttbl.allocation.get_from_cache(allocid)
+                raise tcfl.tc.failed_e("allocation past its TTL not deleted")
+            except ttbl.allocation.allocation_c.invalid_e:
+                pass
+            self.report_pass("TTL checked against the allocation clock")
+        finally:
+            ttbl.allocation._time = _time
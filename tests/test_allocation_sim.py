@@ -0,0 +1,86 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check the allocation simulator (:mod:`ttbl.allocation_sim`) replays
+traces against the allocator and reports consistent metrics
+"""
+
+import os
+
+import tcfl.tc
+import ttbl.allocation_sim
+import utl
+
+class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+    """
+    Replay small synthetic and hand made traces
+    """
+
+    @tcfl.tc.subcase()
+    def eval_00_synthetic(self):
+        target_names = [ f"s{i}" for i in range(5) ]
+        sim = ttbl.allocation_sim.simulator_c(
+            target_names, os.path.join(self.tmpdir, "synthetic"))
+        trace = ttbl.allocation_sim.trace_synthetic(
+            target_names, 50, arrival_rate = 1, duration_mean = 10)
+        trace_file = os.path.join(self.tmpdir, "trace.jsonl")
+        ttbl.allocation_sim.trace_save(trace_file, trace)
+        if ttbl.allocation_sim.trace_load(trace_file) != trace:
+            raise tcfl.tc.failed_e("trace doesn't load back as saved")
+        metrics = sim.run(trace)
+        # single target requests can't deadlock, all must get it
+        if metrics['requests'] != 50 or metrics['pending'] \
+           or metrics['queue_wait']['count'] != 50 \
+           or metrics['latency']['request']['count'] != 50 \
+           or metrics['latency']['release']['count'] != 50:
+            raise tcfl.tc.failed_e("unexpected metrics",
+                                   dict(metrics = metrics))
+        if not 0 < metrics['utilisation'] <= 1:
+            raise tcfl.tc.failed_e(
+                f"utilisation {metrics['utilisation']} out of range")
+        if not metrics['locks'].get('target.hold', None) \
+           or not metrics['locks'].get('allocation.hold', None):
+            raise tcfl.tc.failed_e("lock hold times not measured",
+                                   dict(metrics = metrics))
+        self.report_pass("synthetic trace replayed",
+                         dict(metrics = ttbl.allocation_sim.metrics_format(
+                             metrics)))
+
+
+    @tcfl.tc.subcase()
+    def eval_10_trace(self):
+        sim = ttbl.allocation_sim.simulator_c(
+            [ "a", "b" ], os.path.join(self.tmpdir, "trace"))
+        trace = [
+            dict(time = 0, op = "request", name = "r0",
+                 groups = { "g": [ "a", "b" ] }, duration = 10),
+            dict(time = 1, op = "request", name = "r1",
+                 groups = { "g": [ "a" ] }, duration = 10),
+            dict(time = 2, op = "request", name = "r2",
+                 groups = { "g": [ "b" ] }, patience = 5),
+            dict(time = 3, op = "keepalive"),
+            dict(time = 4, op = "request", name = "r3",
+                 groups = { "g": [ "nonexistent" ] }),
+        ]
+        metrics = sim.run(trace)
+        # r0 holds both for 10s, r1 waits 9s and holds a for 10s; r2
+        # gives up at 7s
+        expected = dict(rejected = 1, given_up = 1, pending = 0)
+        for key, value in expected.items():
+            if metrics[key] != value:
+                raise tcfl.tc.failed_e(
+                    f"{key}: expected {value}, got {metrics[key]}",
+                    dict(metrics = metrics))
+        if metrics['queue_wait']['max'] != 9:
+            raise tcfl.tc.failed_e("r1 should have waited 9s",
+                                   dict(metrics = metrics))
+        # 2 targets * 10s + 1 target * 10s over 2 targets * 20s
+        if metrics['utilisation'] != 0.75:
+            raise tcfl.tc.failed_e(
+                f"utilisation: expected 0.75, got {metrics['utilisation']}")
+        self.report_pass("hand made trace replayed with expected metrics")
@@ -0,0 +1,174 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check the per-target waiter queues (:class:`ttbl.allocation._waiter_queue_c`)
+keep priority order, are shared across instances through the journal,
+survive a restart and compact the journal
+"""
+
+import os
+
+import tcfl.tc
+import ttbl
+import ttbl.allocation
+import ttbl.config
+import utl
+
+class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+    """
+    Exercise :class:`ttbl.allocation._waiter_queue_c`, without a server
+    """
+
+    @staticmethod
+    def _allocids(queue):
+        waiters, _preempt = queue.load()
+        return [ waiter[3] for waiter in waiters ]
+
+    @tcfl.tc.subcase()
+    def eval_00_create(self):
+        ttbl.test_target.state_path = os.path.join(self.tmpdir, "targets")
+        ttbl.allocation.path = os.path.join(self.tmpdir, "allocations")
+        ttbl.allocation.init(self.tmpdir)
+        ttbl.config.targets.clear()
+        self.target = ttbl.test_target("t0")
+        ttbl.config.targets[self.target.id] = self.target
+
+
+    @tcfl.tc.subcase()
+    def eval_10_order(self):
+        queue = ttbl.allocation._waiter_queue_get(self.target)
+        queue.add(500000, "20240101000002", "NE", "aaaaaaa2")
+        queue.add(500000, "20240101000001", "NE", "aaaaaaa1")
+        queue.add(100000, "20240101000003", "NE", "aaaaaaa3")
+        queue.add(900000, "20240101000000", "PE", "aaaaaaa0")
+        queue.remove("aaaaaaa2")
+        allocids = self._allocids(queue)
+        expected = [ "aaaaaaa3", "aaaaaaa1", "aaaaaaa0" ]
+        if allocids != expected:
+            raise tcfl.tc.failed_e("waiters not sorted by priority/timestamp",
+                                   dict(allocids = allocids,
+                                        expected = expected))
+        if queue.load()[1] != True:
+            raise tcfl.tc.failed_e("preemption request not reported")
+        self.report_pass("waiters sorted by priority and timestamp")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_shared(self):
+        # another process' view of the same queue
+        queue = ttbl.allocation._waiter_queue_get(self.target)
+        queue_other = ttbl.allocation._waiter_queue_c(self.target)
+        queue_other.add(200000, "20240101000004", "NE", "aaaaaaa4")
+        queue_other.remove("aaaaaaa3")
+        expected = [ "aaaaaaa4", "aaaaaaa1", "aaaaaaa0" ]
+        allocids = self._allocids(queue)
+        if allocids != expected:
+            raise tcfl.tc.failed_e("changes from another instance not seen",
+                                   dict(allocids = allocids,
+                                        expected = expected))
+        # as if the daemon restarted
+        ttbl.allocation._waiter_queues.clear()
+        queue = ttbl.allocation._waiter_queue_get(self.target)
+        allocids = self._allocids(queue)
+        if allocids != expected:
+            raise tcfl.tc.failed_e("queue not recovered from the journal",
+                                   dict(allocids = allocids,
+                                        expected = expected))
+        self.report_pass("queue shared across instances and restarts")
+
+
+    @tcfl.tc.subcase()
+    def eval_30_compact(self):
+        queue = ttbl.allocation._waiter_queue_get(self.target)
+        queue_other = ttbl.allocation._waiter_queue_c(self.target)
+        expected = self._allocids(queue)
+        for count in range(200):
+            allocid = "b%07d" % count
+            queue.add(300000, "20240101000010", "NE", allocid)
+            queue.load()
+            queue.remove(allocid)
+        allocids = self._allocids(queue)
+        lines = len(open(queue.path).readlines())
+        if lines > 2 * ttbl.allocation.waiter_journal_compact_min:
+            raise tcfl.tc.failed_e(f"journal not compacted; {lines} lines")
+        if allocids != expected:
+            raise tcfl.tc.failed_e("waiters lost compacting",
+                                   dict(allocids = allocids,
+                                        expected = expected))
+        # an instance that didn't see the compaction starts over
+        allocids = self._allocids(queue_other)
+        if allocids != expected:
+            raise tcfl.tc.failed_e("compacted journal not reloaded",
+                                   dict(allocids = allocids,
+                                        expected = expected))
+        self.report_pass(f"journal compacted to {lines} lines")
+
+
+    @tcfl.tc.subcase()
+    def eval_32_readded(self):
+        queue = ttbl.allocation._waiter_queue_get(self.target)
+        expected = self._allocids(queue)
+        queue.add(400000, "20240101000011", "NE", "aaaaaaa5")
+        self._allocids(queue)
+        queue.remove("aaaaaaa5")
+        queue.add(400000, "20240101000011", "NE", "aaaaaaa5")
+        allocids = self._allocids(queue)
+        if allocids.count("aaaaaaa5") != 1:
+            raise tcfl.tc.failed_e("waiter removed and added again listed"
+                                   " more than once",
+                                   dict(allocids = allocids))
+        queue.remove("aaaaaaa5")
+        if self._allocids(queue) != expected:
+            raise tcfl.tc.failed_e("waiter not removed",
+                                   dict(allocids = self._allocids(queue)))
+        self.report_pass("waiter removed and added again listed once")
+
+
+    @tcfl.tc.subcase()
+    def eval_35_compacted_same_inode(self):
+        # another process compacts the journal and the new file gets
+        # the same inode number as the old one, which we simulate by
+        # rewriting it in place, as long as what we had read
+        queue = ttbl.allocation._waiter_queue_get(self.target)
+        queue_other = ttbl.allocation._waiter_queue_c(self.target)
+        expected = self._allocids(queue_other)
+        size = os.stat(queue.path).st_size
+        lines = [ "# compaction 99\n" ]
+        lines += [ "+ %06d %s %s %s\n" % waiter[:4]
+                   for waiter in queue.load()[0] ]
+        lines.append("+ 300000 20240101000020 NE dddddddd\n")
+        count = 0
+        while sum(len(line) for line in lines) < size:
+            lines.append("- e%07d\n" % count)
+            count += 1
+        with open(queue.path, "r+") as f:
+            f.truncate()
+            f.write("".join(lines))
+        allocids = self._allocids(queue_other)
+        if sorted(allocids) != sorted(expected + [ "dddddddd" ]):
+            raise tcfl.tc.failed_e("compacted journal with the same inode"
+                                   " not reloaded",
+                                   dict(allocids = allocids,
+                                        expected = expected))
+        self.report_pass("compacted journal with the same inode reloaded")
+
+
+    @tcfl.tc.subcase()
+    def eval_40_migrate(self):
+        target = ttbl.test_target("t1")
+        target.fsdb.set("_alloc.queue.500000-20240101000000-NE-cccccccc",
+                        "cccccccc")
+        target.fsdb.set("_alloc.queue.bad", "cccccccd")
+        queue = ttbl.allocation._waiter_queue_get(target)
+        allocids = self._allocids(queue)
+        if allocids != [ "cccccccc" ]:
+            raise tcfl.tc.failed_e("FSDB waiters not migrated",
+                                   dict(allocids = allocids))
+        if target.fsdb.get_as_slist("_alloc.queue.*"):
+            raise tcfl.tc.failed_e("FSDB waiters not removed after migrating")
+        self.report_pass("FSDB waiters migrated to the journal")
@@ -0,0 +1,189 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check the ASGI adapter (:class:`ttbl.asgi.wsgi_app_c`) runs a Flask
+application in a thread pool and streams its responses
+"""
+
+import asyncio
+import concurrent.futures
+import os
+import threading
+import time
+
+import flask
+
+import tcfl.tc
+import ttbl
+import ttbl.allocation
+import ttbl.asgi
+
+app = flask.Flask("test_asgi")
+
+@app.route("/echo/<string:name>", methods = [ "PUT" ])
+def _echo(name):
+    return dict(name = name, form = dict(flask.request.form),
+                args = dict(flask.request.args),
+                cookie = flask.request.cookies.get("c", None))
+
+@app.route("/stream")
+def _stream():
+    def _generate():
+        for i in range(5):
+            yield b"chunk%d\n" % i
+    return flask.Response(_generate())
+
+@app.route("/sleep")
+def _sleep():
+    time.sleep(0.5)
+    return dict(thread = threading.current_thread().name)
+
+@app.route("/ttb-v2/targets/<string:target_id>/console/read")
+def _console_read(target_id):
+    # a long-poll that doesn't get data
+    def _generate():
+        yield b"start\n"
+        time.sleep(1)
+        yield threading.current_thread().name.encode('utf-8')
+    return flask.Response(_generate())
+
+
+class _test(tcfl.tc.tc_c):
+    """
+    Drive :class:`ttbl.asgi.wsgi_app_c` as an ASGI server would
+    """
+
+    @staticmethod
+    async def _request(asgi_app, method, path, query = b"",
+                       headers = None, body = b""):
+        scope = {
+            'type': 'http', 'method': method, 'path': path,
+            'query_string': query, 'http_version': "1.1",
+            'scheme': "http", 'server': ( "127.0.0.1", 5000 ),
+            'client': ( "127.0.0.1", 40000 ),
+            'headers': headers if headers else [],
+        }
+        received = [ { 'type': 'http.request', 'body': body[:3],
+                       'more_body': True },
+                     { 'type': 'http.request', 'body': body[3:] } ]
+        messages = []
+        async def _receive():
+            return received.pop(0)
+        async def _send(message):
+            messages.append(message)
+        await asgi_app(scope, _receive, _send)
+        return messages
+
+    def eval_00(self):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers = 4)
+        asgi_app = ttbl.asgi.wsgi_app_c(app, executor)
+
+        body = b"a=1&b=%C3%B1"
+        messages = asyncio.run(self._request(
+            asgi_app, "PUT", "/echo/ñame", query = b"q=2",
+            headers = [
+                ( b"content-type", b"application/x-www-form-urlencoded" ),
+                ( b"content-length", str(len(body)).encode('ascii') ),
+                ( b"cookie", b"c=3" ),
+            ], body = body))
+        if messages[0]['status'] != 200:
+            raise tcfl.tc.failed_e("PUT failed", dict(messages = messages))
+        data = b"".join(m.get('body', b"") for m in messages[1:])
+        d = flask.json.loads(data)
+        if d != dict(name = "ñame", form = dict(a = "1", b = "ñ"),
+                     args = dict(q = "2"), cookie = "3"):
+            raise tcfl.tc.failed_e("request not passed correctly",
+                                   dict(d = d))
+        self.report_pass("request path, query, form and cookies passed")
+
+        messages = asyncio.run(self._request(asgi_app, "GET", "/stream"))
+        chunks = [ m['body'] for m in messages[1:] if m.get('body') ]
+        if chunks != [ b"chunk%d\n" % i for i in range(5) ]:
+            raise tcfl.tc.failed_e("response not streamed chunk by chunk",
+                                   dict(chunks = chunks))
+        if messages[-1].get('more_body', False):
+            raise tcfl.tc.failed_e("response not terminated")
+        self.report_pass("streamed responses are sent chunk by chunk")
+
+        async def _parallel():
+            return await asyncio.gather(*[
+                self._request(asgi_app, "GET", "/sleep") for _ in range(4)
+            ])
+        ts0 = time.time()
+        asyncio.run(_parallel())
+        ts = time.time() - ts0
+        self.report_data("ASGI adapter", "4 x 0.5s requests (s)", round(ts, 2))
+        if ts > 1.5:
+            raise tcfl.tc.failed_e(
+                f"blocking requests not run in parallel (took {ts:.2f}s)")
+        self.report_pass(f"blocking requests run in parallel ({ts:.2f}s)")
+
+
+    def eval_10_shared_state(self):
+        # requests in the pool share per-process objects, like a
+        # target's lock and the allocation cache
+        lock = ttbl.process_posix_file_lock_c(
+            os.path.join(self.tmpdir, "lock"), name = "test-asgi")
+        holders = []
+        cache = ttbl.allocation.lru_aged_c(lambda key: key, 120, 4)
+
+        def _fn(index):
+            for _ in range(20):
+                cache(index % 6)
+                if index == 0:
+                    cache.invalidate()
+            with lock:
+                if not lock.locked():
+                    raise AssertionError("lock not held by this thread")
+                holders.append(index)
+                time.sleep(0.01)
+                holders.append(index)
+            return lock.locked()
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers = 8) as executor:
+            locked = list(executor.map(_fn, range(16)))
+        if any(locked):
+            raise tcfl.tc.failed_e("lock still held after releasing")
+        # each holder enters and leaves before the next one enters
+        if holders[0::2] != holders[1::2]:
+            raise tcfl.tc.failed_e("threads held the lock at the same time",
+                                   dict(holders = holders))
+        self.report_pass("threads sharing a lock object exclude each other")
+
+
+    def eval_20_wait_pool(self):
+        # requests waiting for data don't tie up the threads the rest
+        # of the requests need
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers = 2, thread_name_prefix = "test-asgi")
+        wait_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers = 4, thread_name_prefix = "test-asgi-wait")
+        asgi_app = ttbl.asgi.wsgi_app_c(app, executor,
+                                        wait_executor = wait_executor)
+
+        async def _timed(path):
+            ts0 = time.time()
+            messages = await self._request(asgi_app, "GET", path)
+            return time.time() - ts0, messages
+
+        async def _parallel():
+            return await asyncio.gather(*[
+                _timed("/ttb-v2/targets/t%d/console/read" % i)
+                for i in range(4)
+            ], _timed("/sleep"), _timed("/sleep"))
+        results = asyncio.run(_parallel())
+        for ts, messages in results[4:]:
+            if ts > 0.9:
+                raise tcfl.tc.failed_e(
+                    f"request blocked by waiting ones (took {ts:.2f}s)")
+        for _ts, messages in results[:4]:
+            if not messages[-2]['body'].startswith(b"test-asgi-wait"):
+                raise tcfl.tc.failed_e("waiting request not run in the"
+                                       " wait pool",
+                                       dict(messages = messages))
+        self.report_pass("waiting requests run in their own pool")
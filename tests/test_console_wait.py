@@ -0,0 +1,147 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check console reads can wait for new data
+(:meth:`ttbl.console.interface.get_read`) instead of being polled
+"""
+
+import os
+import threading
+import time
+
+import commonl
+import tcfl.tc
+import ttbl
+import ttbl.allocation
+import ttbl.console
+import utl
+
+class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+    """
+    Exercise the *wait* and *follow* arguments of console reads,
+    without a server
+    """
+
+    def _append(self, data, delay):
+        def _fn():
+            time.sleep(delay)
+            with open(self.read_file, "ab") as f:
+                f.write(data)
+        thread = threading.Thread(target = _fn, daemon = True)
+        thread.start()
+        return thread
+
+    def _get_read(self, **args):
+        args['component'] = "c0"
+        return self.target.console.get_read(self.target, "someuser", args,
+                                            None, None)
+
+    @tcfl.tc.subcase()
+    def eval_00_create(self):
+        ttbl.test_target.state_path = os.path.join(self.tmpdir, "targets")
+        ttbl.allocation.path = os.path.join(self.tmpdir, "allocations")
+        ttbl.allocation.init(self.tmpdir)
+        self.target = ttbl.test_target("console0")
+        self.target.acquirer = ttbl.symlink_acquirer_c(self.target)
+        self.target.interface_add(
+            "console", ttbl.console.interface(c0 = ttbl.console.generic_c()))
+        self.read_file = os.path.join(self.target.state_dir,
+                                      "console-c0.read")
+        with open(self.read_file, "wb") as f:
+            f.write(b"hello")
+
+
+    @tcfl.tc.subcase()
+    def eval_10_wait(self):
+        ts0 = time.time()
+        r = self._get_read(offset = 5)
+        if time.time() - ts0 > 0.5:
+            raise tcfl.tc.failed_e("read without wait waited")
+        thread = self._append(b" world", 0.5)
+        ts0 = time.time()
+        r = self._get_read(offset = 5, wait = 10)
+        ts = time.time() - ts0
+        thread.join()
+        if ts < 0.4 or ts > 5:
+            raise tcfl.tc.failed_e(
+                f"read didn't wait for the data to arrive (took {ts:.2f}s)")
+        self.report_pass(f"read returned {ts:.2f}s later, when data arrived")
+
+        ts0 = time.time()
+        r = self._get_read(offset = 11, wait = 1)
+        ts = time.time() - ts0
+        if ts < 0.9:
+            raise tcfl.tc.failed_e(
+                f"read didn't wait for the timeout (took {ts:.2f}s)")
+        self.report_pass("read waits no longer than asked")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_generation(self):
+        self.target.fsdb.set("interfaces.console.c0.generation", "1")
+        def _fn():
+            time.sleep(0.5)
+            self.target.fsdb.set("interfaces.console.c0.generation", "2")
+        thread = threading.Thread(target = _fn, daemon = True)
+        thread.start()
+        ts0 = time.time()
+        r = self._get_read(offset = 11, wait = 10, generation = "1")
+        ts = time.time() - ts0
+        thread.join()
+        if ts > 5 or r['stream_generation'] != "2":
+            raise tcfl.tc.failed_e(
+                f"read didn't return on generation change (took {ts:.2f}s)",
+                dict(r = r))
+        self.report_pass("read returns when the generation changes")
+
+
+    @tcfl.tc.subcase()
+    def eval_30_follow(self):
+        r = self._get_read(offset = 0, follow = 10)
+        if r.get('stream_follow', None) != 10 \
+           or not callable(r.get('stream_follow_check', None)):
+            raise tcfl.tc.failed_e("follow not requested to the daemon",
+                                   dict(r = r))
+        read_wait_max = ttbl.console.interface.read_wait_max
+        try:
+            ttbl.console.interface.read_wait_max = 2
+            r = self._get_read(offset = 0, follow = 10)
+        finally:
+            ttbl.console.interface.read_wait_max = read_wait_max
+        if r.get('stream_follow', None) != 2:
+            raise tcfl.tc.failed_e("follow not capped to read_wait_max",
+                                   dict(r = r))
+        self.report_pass("follow is passed to the daemon and capped")
+
+
+    @tcfl.tc.subcase()
+    def eval_40_unrelated_changes(self):
+        # changes to other files in the target's state directory (eg:
+        # the state database) don't wake up the waiters
+        checks = []
+        def _check():
+            checks.append(time.time())
+            return False
+        def _fn():
+            for count in range(20):
+                time.sleep(0.05)
+                self.target.fsdb.set("somekey", count)
+            with open(self.read_file, "ab") as f:
+                f.write(b"!")
+        size = os.stat(self.read_file).st_size
+        thread = threading.Thread(target = _fn, daemon = True)
+        thread.start()
+        r = commonl.file_wait_grow(self.read_file, size, 10, check = _check,
+                                   check_period = 10)
+        thread.join()
+        if not r:
+            raise tcfl.tc.failed_e("didn't return when the file grew")
+        if len(checks) > 2:
+            raise tcfl.tc.failed_e(
+                f"woke up {len(checks)} times for changes to other files")
+        self.report_pass("changes to other files don't wake up waiters")
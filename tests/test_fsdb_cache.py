@@ -0,0 +1,141 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check the FSDB read cache is invalidated when the database's
+generation changes
+"""
+
+import os
+
+import commonl
+import tcfl.tc
+
+class _test(tcfl.tc.tc_c):
+    """
+    Exercise the read cache in :class:`commonl.fsdb_c` with
+    :class:`commonl.fsdb_symlink_c`
+
+    A second instance on the same directory plays the part of
+    another process (eg: another gunicorn worker) writing.
+    """
+
+    @tcfl.tc.subcase()
+    def eval_00_create(self):
+        self.fsdb_dir = os.path.join(self.tmpdir, "db")
+        commonl.makedirs_p(self.fsdb_dir)
+        self.fsdb = commonl.fsdb_symlink_c(self.fsdb_dir)
+        self.fsdb_other = commonl.fsdb_symlink_c(self.fsdb_dir)
+        self.fsdb.set_keys([ ( "a.b", 1 ), ( "a.c", 2 ), ( "d", "value" ) ])
+
+
+    @tcfl.tc.subcase()
+    def eval_10_hits(self):
+        stats0 = self.fsdb.cache_stats()
+        for _ in range(10):
+            d = self.fsdb.get_as_dict("a.*")
+            if d != { "a.b": 1, "a.c": 2 }:
+                raise tcfl.tc.failed_e("get_as_dict() returned bad data",
+                                       dict(d = d))
+        stats = self.fsdb.cache_stats()
+        hits = stats['hits'] - stats0['hits']
+        misses = stats['misses'] - stats0['misses']
+        if hits != 9 or misses != 1:
+            raise tcfl.tc.failed_e(
+                f"expected 9 hits and 1 miss, got {hits} and {misses}",
+                dict(stats = stats))
+        # what we return can be modified without messing the cache
+        d['a.b'] = 3
+        if self.fsdb.get_as_dict("a.*")['a.b'] != 1:
+            raise tcfl.tc.failed_e("cached result modified by caller")
+        self.report_pass("repeated reads are served from the cache")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_invalidation(self):
+        self.fsdb.get("d")
+        generation = self.fsdb.generation()
+        self.fsdb_other.set("d", "newvalue")
+        if self.fsdb.generation() != generation + 1:
+            raise tcfl.tc.failed_e(
+                "set() didn't bump the generation by one",
+                dict(before = generation, after = self.fsdb.generation()))
+        value = self.fsdb.get("d")
+        if value != "newvalue":
+            raise tcfl.tc.failed_e(
+                f"stale value '{value}' read after change by other instance")
+
+        generation = self.fsdb.generation()
+        # many keys, with keyspace cleanup, shall bump only once
+        self.fsdb_other.set_keys([ ( "a", 4 ), ( "e", 5 ), ( "f.g", 6 ) ])
+        if self.fsdb.generation() != generation + 1:
+            raise tcfl.tc.failed_e(
+                "set_keys() didn't bump the generation by one",
+                dict(before = generation, after = self.fsdb.generation()))
+        d = self.fsdb.get_as_dict()
+        if d != { "a": 4, "d": "newvalue", "e": 5, "f.g": 6 }:
+            raise tcfl.tc.failed_e("stale data read after set_keys()",
+                                   dict(d = d))
+        self.report_pass("changes by others invalidate the cache")
+
+
+    @tcfl.tc.subcase()
+    def eval_30_hit_ratio(self):
+        # a workload of a write every ten reads, as a target is
+        # read much more often than modified
+        fsdb = commonl.fsdb_symlink_c(self.fsdb_dir)
+        for count in range(100):
+            if count % 10 == 0:
+                self.fsdb_other.set("counter", count)
+            fsdb.get_as_dict()
+            fsdb.get("counter")
+        stats = fsdb.cache_stats()
+        self.report_data("FSDB read cache", "hit ratio (percent)",
+                         round(stats['ratio'] * 100, 1))
+        self.report_info(f"cache stats: {stats}")
+        if stats['ratio'] < 0.8:
+            raise tcfl.tc.failed_e("hit ratio lower than expected",
+                                   dict(stats = stats))
+        self.report_pass(f"hit ratio {stats['ratio']:.2f}")
+
+
+    @tcfl.tc.subcase()
+    def eval_40_removed(self):
+        dirname = os.path.join(self.tmpdir, "db-removed")
+        commonl.makedirs_p(dirname)
+        fsdb = commonl.fsdb_symlink_c(dirname)
+        fsdb.set("state", "active")
+        fsdb.get("state")
+        commonl.rm_f(os.path.join(dirname, "state"))
+        commonl.rm_f(os.path.join(dirname,
+                                  commonl.fsdb_symlink_c.generation_filename))
+        os.rmdir(dirname)
+        if fsdb.get("state") != None:
+            raise tcfl.tc.failed_e("removed database still returns data")
+        self.report_pass("removed databases are not served from the cache")
+
+
+    @tcfl.tc.subcase()
+    def eval_50_no_fds(self):
+        # each target has a database; we can't keep a file open per
+        # database or we'll run out of file descriptors
+        fds0 = len(os.listdir("/proc/self/fd"))
+        fsdbs = []
+        for count in range(50):
+            dirname = os.path.join(self.tmpdir, f"db-fds-{count}")
+            commonl.makedirs_p(dirname)
+            fsdb = commonl.fsdb_symlink_c(dirname)
+            fsdb.set("state", "active")
+            fsdb.get("state")
+            fsdb.generation()
+            fsdbs.append(fsdb)
+        fds = len(os.listdir("/proc/self/fd"))
+        # other testcases run in parallel threads, so allow some slack
+        if fds - fds0 > 10:
+            raise tcfl.tc.failed_e(
+                f"{fds - fds0} file descriptors left open by 50 databases")
+        self.report_pass("databases keep no file descriptors open")
@@ -0,0 +1,193 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Exercise the log based FSDB (:class:`commonl.fsdb_log_c`)
+"""
+
+import multiprocessing
+import os
+
+import commonl
+import tcfl.tc
+
+def _setter(dirname, name, count):
+    fsdb = commonl.fsdb_log_c(dirname)
+    for value in range(count):
+        fsdb.set(name, value)
+
+class _test(tcfl.tc.tc_c):
+    """
+    Exercise the FSDB interface (:class:`commonl.fsdb_c`) implemented by
+    the log-based database :class:`commonl.fsdb_log_c`.
+    """
+
+    db = {
+        "name ascii" : "string value",
+        # weird names are just fine, they are not file names
+        "name :/1" : "string value",
+        "name :/2" : "string value",
+        "name weird /:" : True,
+        "name weird /: 2" : False,
+        "name ñá %% int" : 2,
+        "name ñá %% float" : 3.0,
+        "name bytes" : b"\x00\x01 bytes",
+    }
+
+    @tcfl.tc.subcase()
+    def eval_00_fsdb_create(self):
+        self.fsdb_dir = os.path.join(self.tmpdir, "db")
+        commonl.makedirs_p(self.fsdb_dir)
+        self.fsdb = commonl.fsdb_c.create(self.fsdb_dir, backend = "log")
+        if not isinstance(self.fsdb, commonl.fsdb_log_c):
+            raise tcfl.tc.failed_e(
+                "fsdb_c.create(backend = 'log') returned"
+                f" {type(self.fsdb)}")
+        l = os.listdir(self.fsdb_dir)
+        if l != [ commonl.fsdb_log_c.filename ]:
+            raise tcfl.tc.failed_e(
+                "fsdb database directory shall contain only the log",
+                dict(listdir = l))
+
+
+    @tcfl.tc.subcase()
+    def eval_10_fsdb_set(self):
+        for name, value in self.db.items():
+            self.fsdb.set(name, value)
+        # another instance (as another process would) sees the same
+        fsdb = commonl.fsdb_log_c(self.fsdb_dir)
+        d = fsdb.get_as_dict()
+        if d != self.db:
+            raise tcfl.tc.failed_e(
+                "get_as_dict() from a new instance doesn't match db",
+                dict(get_as_dict = d, db = self.db))
+        self.report_pass("values set are seen by other instances")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_fsdb_patterns(self):
+        keys = sorted(self.fsdb.keys("name :/*"))
+        if keys != [ "name :/1", "name :/2" ]:
+            raise tcfl.tc.failed_e("keys() w/ pattern doesn't match expected",
+                                   dict(keys = keys))
+        l = self.fsdb.get_as_slist("name weird*")
+        if l != [ ( "name weird /:", True ), ( "name weird /: 2", False ) ]:
+            raise tcfl.tc.failed_e(
+                "get_as_slist() w/ pattern doesn't match expected",
+                dict(get_as_slist = l))
+        self.report_pass("pattern queries filter ok")
+
+
+    @tcfl.tc.subcase()
+    def eval_30_nested_flat_keyspace(self):
+        self.fsdb.set("a.b", "scalar")
+        self.fsdb.set("a.b.c.d", 1)
+        self.fsdb.set("a.b.c.e", 2)
+        if self.fsdb.get("a.b") != None:
+            raise tcfl.tc.failed_e("setting a.b.c.d did not wipe scalar a.b")
+        self.fsdb.set("a.b.c", "scalar")
+        keys = sorted(self.fsdb.keys("a.*"))
+        if keys != [ "a.b.c" ]:
+            raise tcfl.tc.failed_e("setting a.b.c did not wipe a.b.c.*",
+                                   dict(keys = keys))
+        if self.fsdb.set("a.b.c", "other", force = False) != False:
+            raise tcfl.tc.failed_e("set(force = False) overrode value")
+        self.report_pass("nested flat keyspace is kept congruent")
+
+
+    @tcfl.tc.subcase()
+    def eval_40_concurrent_compaction(self):
+        # make it compact often, so we are sure other processes
+        # running at the same time survive the file being replaced
+        compact_size_min = commonl.fsdb_log_c.compact_size_min
+        try:
+            commonl.fsdb_log_c.compact_size_min = 4096
+            processes = [
+                multiprocessing.Process(
+                    target = _setter,
+                    args = ( self.fsdb_dir, f"p{i}", 1000 ))
+                for i in range(4)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            d = self.fsdb.get_as_dict("p*")
+            if d != { "p0": 999, "p1": 999, "p2": 999, "p3": 999 }:
+                raise tcfl.tc.failed_e("concurrent sets lost data",
+                                       dict(d = d))
+            size = os.path.getsize(
+                os.path.join(self.fsdb_dir, commonl.fsdb_log_c.filename))
+            if size > 2 * commonl.fsdb_log_c.compact_size_min:
+                raise tcfl.tc.failed_e(f"log was not compacted, size {size}")
+        finally:
+            commonl.fsdb_log_c.compact_size_min = compact_size_min
+        self.report_pass("concurrent sets and compactions are consistent")
+
+
+    @tcfl.tc.subcase()
+    def eval_50_migrate(self):
+        dirname = os.path.join(self.tmpdir, "db-symlink")
+        commonl.makedirs_p(dirname)
+        fsdb_symlink = commonl.fsdb_symlink_c(dirname)
+        fsdb_symlink.set_keys(list(self.db.items()))
+        os.symlink("someowner", os.path.join(dirname, "mutex"))
+        fsdb = commonl.fsdb_log_c.migrate_from_symlink(
+            dirname, exclude = [ "mutex" ])
+        d = fsdb.get_as_dict()
+        if d != self.db:
+            raise tcfl.tc.failed_e("migrated database doesn't match db",
+                                   dict(get_as_dict = d, db = self.db))
+        l = sorted(os.listdir(dirname))
+        if l != [ commonl.fsdb_log_c.filename, "mutex" ]:
+            raise tcfl.tc.failed_e("symlinks not removed / excluded",
+                                   dict(listdir = l))
+        self.report_pass("symlink database migrated")
+
+
+    @tcfl.tc.subcase()
+    def eval_60_wiped(self):
+        dirname = os.path.join(self.tmpdir, "db-wiped")
+        commonl.makedirs_p(dirname)
+        fsdb = commonl.fsdb_log_c(dirname)
+        fsdb.set("key", "value")
+        os.unlink(os.path.join(dirname, commonl.fsdb_log_c.filename))
+        if fsdb.get("key") != None:
+            raise tcfl.tc.failed_e("value still there after wiping the log")
+        fsdb.set("key2", "value2")
+        d = commonl.fsdb_log_c(dirname).get_as_dict()
+        if d != { "key2": "value2" }:
+            raise tcfl.tc.failed_e("log not recreated after being wiped",
+                                   dict(d = d))
+        self.report_pass("log recreated after being wiped")
+
+        os.unlink(os.path.join(dirname, commonl.fsdb_log_c.filename))
+        os.rmdir(dirname)
+        fsdb.get("key2")
+        try:
+            fsdb.set("key3", "value3")
+        except commonl.fsdb_log_c.invalid_e as e:
+            self.report_pass(f"setting in a removed database fails: {e}")
+        else:
+            raise tcfl.tc.failed_e(
+                "no error setting in a removed database")
+
+
+    @tcfl.tc.subcase()
+    def eval_70_key_too_long(self):
+        key = "k" * (commonl.fsdb_log_c.key_len_max + 1)
+        try:
+            self.fsdb.set(key, "value")
+        except ValueError as e:
+            self.report_pass(f"key too long rejected: {str(e)[:60]}")
+        else:
+            raise tcfl.tc.failed_e("key too long not rejected")
+        key = "k" * commonl.fsdb_log_c.key_len_max
+        self.fsdb.set(key, "value")
+        if commonl.fsdb_log_c(self.fsdb_dir).get(key) != "value":
+            raise tcfl.tc.failed_e("key of maximum length not set")
+        self.report_pass("key of maximum length set")
@@ -0,0 +1,137 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check the key index of :class:`commonl.fsdb_symlink_c` and measure
+how long it takes to load an allocation queue as the database grows
+"""
+
+import os
+import time
+import urllib.parse
+
+import commonl
+import tcfl.tc
+
+class _test(tcfl.tc.tc_c):
+    """
+    Exercise the key index in :class:`commonl.fsdb_symlink_c`
+
+    - pattern queries return the same as a full scan + fnmatch
+
+    - changes done by other instances (as other processes would) are
+      seen right away
+
+    - microbenchmark: time to load a target's allocation queue
+      (*_alloc.queue.\\**, as :func:`ttbl.allocation._target_queue_load`
+      does) vs the number of keys in the database, reported as data
+      in the *FSDB queue load* domain.
+    """
+
+    key_counts = [ 100, 1000, 10000 ]
+    queue_size = 10
+    repeat = 50
+
+    @staticmethod
+    def _full_scan(dirname, *patterns):
+        # the way it was done before the index: scan + fnmatch all
+        fl = []
+        for filename in sorted(os.listdir(dirname)):
+            key = urllib.parse.unquote(filename)
+            if commonl.field_needed(key, patterns):
+                fl.append(( key, os.readlink(os.path.join(dirname, filename)) ))
+        return fl
+
+    def _db_make(self, name, count):
+        dirname = os.path.join(self.tmpdir, f"db-{name}-{count}")
+        commonl.makedirs_p(dirname)
+        fsdb = commonl.fsdb_symlink_c(dirname)
+        for i in range((count - self.queue_size) // 2):
+            # interfaces.power.* and the like, that sort before and
+            # after _alloc.queue.*
+            os.symlink(f"s:value{i}", os.path.join(dirname, f"field{i}.sub"))
+            os.symlink(f"s:value{i}", os.path.join(dirname, f"_alloc.{i}"))
+        for i in range(self.queue_size):
+            fsdb.set(f"_alloc.queue.50-{i:010d}-P-allocid{i}", "waiter")
+        return dirname, fsdb
+
+
+    @tcfl.tc.subcase()
+    def eval_00_patterns(self):
+        dirname, fsdb = self._db_make("patterns", 100)
+        fsdb.set("a.b.c", 1)
+        fsdb.set("a.b.d", 2)
+        fsdb.set("a.bc", 3)
+        fsdb.set("ab", 4)
+        for patterns in [
+                ( "_alloc.queue.*", ),
+                ( "a.b", ),		# a.b.* are subfields of a.b
+                ( "a.b", "a.b.c" ),
+                ( "a.*", "field1*", "_alloc.queue.*" ),
+                ( "*.sub", ),
+                ( "[af]*", ),
+                ( "nonexistant*", ),
+        ]:
+            l_index = [ k for k, _v in fsdb.get_as_slist(*patterns) ]
+            l_scan = [ k for k, _v in self._full_scan(dirname, *patterns) ]
+            if l_index != l_scan:
+                raise tcfl.tc.failed_e(
+                    f"{patterns}: get_as_slist() differs from full scan",
+                    dict(index = l_index, scan = l_scan))
+        keys = fsdb.keys("a.b*")
+        if keys != [ "a.b.c", "a.b.d", "a.bc" ]:
+            raise tcfl.tc.failed_e("keys('a.b*') returned unexpected keys",
+                                   dict(keys = keys))
+        self.report_pass("indexed pattern queries match full scans")
+
+
+    @tcfl.tc.subcase()
+    def eval_10_freshness(self):
+        dirname, fsdb = self._db_make("freshness", 100)
+        fsdb_other = commonl.fsdb_symlink_c(dirname)
+        fsdb.get_as_dict()		# prime the index
+        # wait until the mtime is old enough for the index to be
+        # trusted, so we are really testing the refresh
+        time.sleep(2 * commonl.fsdb_symlink_c.index_mtime_racy)
+        fsdb.get_as_dict()
+        fsdb_other.set("newkey.sub", "value")
+        if fsdb.get_as_dict("newkey") != { "newkey.sub": "value" }:
+            raise tcfl.tc.failed_e("key set by other instance not seen")
+        fsdb_other.set("newkey.sub", None)
+        if fsdb.get_as_dict("newkey") != {}:
+            raise tcfl.tc.failed_e("key removed by other instance still seen")
+        self.report_pass("changes by others are seen right away")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_queue_load_benchmark(self):
+        for count in self.key_counts:
+            dirname, fsdb = self._db_make("benchmark", count)
+            time.sleep(2 * commonl.fsdb_symlink_c.index_mtime_racy)
+
+            ts0 = time.time()
+            for _ in range(self.repeat):
+                l_scan = self._full_scan(dirname, "_alloc.queue.*")
+            ts_scan = (time.time() - ts0) / self.repeat
+
+            ts0 = time.time()
+            for _ in range(self.repeat):
+                l = fsdb.get_as_slist("_alloc.queue.*")
+            ts_index = (time.time() - ts0) / self.repeat
+
+            if len(l) != self.queue_size or len(l_scan) != self.queue_size:
+                raise tcfl.tc.failed_e(
+                    f"{count} keys: expected {self.queue_size} waiters,"
+                    f" got {len(l)} (full scan {len(l_scan)})")
+            self.report_data("FSDB queue load", f"full scan {count} keys (ms)",
+                             round(ts_scan * 1000, 3))
+            self.report_data("FSDB queue load", f"indexed {count} keys (ms)",
+                             round(ts_index * 1000, 3))
+            self.report_info(
+                f"{count} keys: queue load {ts_index * 1000:.3f}ms"
+                f" indexed vs {ts_scan * 1000:.3f}ms full scan")
+        self.report_pass("queue load benchmark completed")
@@ -0,0 +1,138 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check FSDB transactions (:meth:`commonl.fsdb_c.transaction`) commit
+all the changes at once
+"""
+
+import os
+import threading
+
+import commonl
+import tcfl.tc
+
+class _test(tcfl.tc.tc_c):
+    """
+    Exercise :meth:`commonl.fsdb_c.transaction` in the symlink and
+    log backends
+
+    A second instance on the same directory plays the part of
+    another process reading.
+    """
+
+    backends = [ "symlink", "log" ]
+
+    def _fsdb_make(self, backend, name):
+        dirname = os.path.join(self.tmpdir, f"{backend}-{name}")
+        commonl.makedirs_p(dirname)
+        return commonl.fsdb_c.create(dirname, backend = backend), \
+            commonl.fsdb_c.create(dirname, backend = backend)
+
+
+    @tcfl.tc.subcase()
+    def eval_00_commit(self):
+        for backend in self.backends:
+            with self.subcase(backend):
+                fsdb, fsdb_other = self._fsdb_make(backend, "commit")
+                fsdb.set("a.b", 1)
+                fsdb.set("_alloc.queue.50-waiter", "waiter")
+                generation = fsdb_other.generation()
+                with fsdb.transaction():
+                    fsdb.set("owner", "someuser")
+                    fsdb.set("_alloc.id", "1234")
+                    fsdb.set("_alloc.queue.50-waiter", None)
+                    # applied in order, so this wipes a.b
+                    fsdb.set("a", "scalar")
+                    with fsdb.transaction():	# nested, folds in
+                        fsdb.set_keys([ ( "x", 1 ), ( "y", 2 ) ])
+                    if fsdb_other.get_as_dict() \
+                       != { "a.b": 1, "_alloc.queue.50-waiter": "waiter" }:
+                        raise tcfl.tc.failed_e(
+                            "changes seen before the transaction committed",
+                            dict(d = fsdb_other.get_as_dict()))
+                d = fsdb_other.get_as_dict()
+                if d != { "a": "scalar", "owner": "someuser",
+                          "_alloc.id": "1234", "x": 1, "y": 2 }:
+                    raise tcfl.tc.failed_e("unexpected data after commit",
+                                           dict(d = d))
+                if backend == "symlink" \
+                   and fsdb_other.generation() != generation + 1:
+                    raise tcfl.tc.failed_e(
+                        "transaction didn't bump the generation once",
+                        dict(before = generation,
+                             after = fsdb_other.generation()))
+                self.report_pass(f"{backend}: transaction committed")
+
+
+    @tcfl.tc.subcase()
+    def eval_10_discard(self):
+        for backend in self.backends:
+            with self.subcase(backend):
+                fsdb, fsdb_other = self._fsdb_make(backend, "discard")
+                fsdb.set("owner", "someuser")
+                try:
+                    with fsdb.transaction():
+                        fsdb.set("owner", None)
+                        fsdb.set("_alloc.id", "1234")
+                        raise RuntimeError("abort")
+                except RuntimeError:
+                    pass
+                d = fsdb_other.get_as_dict()
+                if d != { "owner": "someuser" }:
+                    raise tcfl.tc.failed_e(
+                        "changes committed from a failed transaction",
+                        dict(d = d))
+                try:
+                    with fsdb.transaction():
+                        fsdb.set("bad", object())
+                    raise tcfl.tc.failed_e("bad value type not detected")
+                except ValueError:
+                    pass
+                try:
+                    with fsdb.transaction():
+                        fsdb.set("owner", "otheruser", force = False)
+                    raise tcfl.tc.failed_e(
+                        "force = False inside a transaction not rejected")
+                except AssertionError:
+                    pass
+                self.report_pass(f"{backend}: failed transaction discarded")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_readers_see_all_or_nothing(self):
+        # while one thread commits transactions that keep
+        # owner == _alloc.owner, another reading from a different
+        # instance (with no cache, so it always reads from disk) must
+        # never see them different
+        for backend in self.backends:
+            with self.subcase(backend):
+                fsdb, fsdb_other = self._fsdb_make(backend, "readers")
+                fsdb_other.cache_enabled = False
+                fsdb.set_keys([ ( "owner", "user0" ),
+                                ( "_alloc.owner", "user0" ) ])
+                done = threading.Event()
+                def _fn():
+                    for count in range(1, 200):
+                        with fsdb.transaction():
+                            fsdb.set("owner", f"user{count}")
+                            fsdb.set("_alloc.owner", f"user{count}")
+                    done.set()
+                thread = threading.Thread(target = _fn, daemon = True)
+                thread.start()
+                reads = 0
+                while not done.is_set():
+                    d = fsdb_other.get_as_dict()
+                    reads += 1
+                    if d.get("owner") != d.get("_alloc.owner"):
+                        done.wait()
+                        raise tcfl.tc.failed_e(
+                            "reader saw a partially committed transaction",
+                            dict(d = d))
+                thread.join()
+                self.report_pass(
+                    f"{backend}: {reads} reads saw no partial commits")
@@ -0,0 +1,119 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check the inventory generation (:mod:`ttbl.inventory`) stamps only
+the targets whose data changed and records removed targets
+"""
+
+import os
+
+import tcfl.tc
+import ttbl
+import ttbl.allocation
+import ttbl.inventory
+import utl
+
+class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+    """
+    Exercise :mod:`ttbl.inventory`, without a server
+    """
+
+    def _target_make(self, name):
+        target = ttbl.test_target(name)
+        target.acquirer = ttbl.symlink_acquirer_c(target)
+        target.tags_update(dict(a = dict(b = 1)))
+        target.tags_cache_enable()
+        return target
+
+    @tcfl.tc.subcase()
+    def eval_00_create(self):
+        ttbl.test_target.state_path = os.path.join(self.tmpdir, "targets")
+        ttbl.allocation.path = os.path.join(self.tmpdir, "allocations")
+        ttbl.allocation.init(self.tmpdir)
+        # a period in the name, to make sure it is not taken as a
+        # field separator
+        self.inv_targets = [ self._target_make(name)
+                             for name in [ "inv0", "inv1", "inv.2" ] ]
+        ttbl.inventory.init(self.tmpdir, self.inv_targets)
+        generation0, stamps = ttbl.inventory.stamps_update(self.inv_targets)
+        if set(stamps.values()) != { generation0 }:
+            raise tcfl.tc.failed_e("new targets not stamped with the"
+                                   f" current generation {generation0}",
+                                   dict(stamps = stamps))
+        self.generation0 = generation0
+
+
+    @tcfl.tc.subcase()
+    def eval_10_quiet(self):
+        generation, stamps = ttbl.inventory.stamps_update(self.inv_targets)
+        if generation != self.generation0:
+            raise tcfl.tc.failed_e(
+                f"generation changed {self.generation0} -> {generation}"
+                " with no changes")
+        self.report_pass("no changes, no new generation")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_changes(self):
+        self.inv_targets[1].fsdb.set("a.x", 5)
+        self.inv_targets[2].fsdb.set("a.y", 6)
+        generation, stamps = ttbl.inventory.stamps_update(self.inv_targets)
+        if generation != self.generation0 + 1:
+            raise tcfl.tc.failed_e(
+                f"expected generation {self.generation0 + 1}, got {generation}")
+        changed = sorted(target_id for target_id, stamp in stamps.items()
+                         if stamp > self.generation0)
+        if changed != [ "inv.2", "inv1" ]:
+            raise tcfl.tc.failed_e("unexpected targets seen as changed",
+                                   dict(stamps = stamps))
+        self.report_pass("only changed targets get a new stamp")
+
+
+    @tcfl.tc.subcase()
+    def eval_30_removed(self):
+        generation0 = ttbl.inventory.generation()
+        # restart without inv1 in the configuration
+        ttbl.inventory.init(self.tmpdir,
+                            [ self.inv_targets[0], self.inv_targets[2] ])
+        generation = ttbl.inventory.generation()
+        if generation != generation0 + 1:
+            raise tcfl.tc.failed_e(
+                f"expected generation {generation0 + 1}, got {generation}")
+        removed = ttbl.inventory.tombstones(generation0)
+        if removed != [ "inv1" ]:
+            raise tcfl.tc.failed_e("unexpected tombstones",
+                                   dict(removed = removed))
+        if ttbl.inventory.tombstones(generation) != []:
+            raise tcfl.tc.failed_e("tombstones after current generation")
+        # added back, it is no longer dead
+        generation, stamps = ttbl.inventory.stamps_update(self.inv_targets)
+        if stamps['inv1'] != generation \
+           or ttbl.inventory.tombstones(generation0) != []:
+            raise tcfl.tc.failed_e("re-added target still has a tombstone",
+                                   dict(stamps = stamps))
+        self.report_pass("removed targets get tombstones")
+
+
+    @tcfl.tc.subcase()
+    def eval_40_cursor(self):
+        target_ids = [ "inv0", "inv.2" ]
+        generation = ttbl.inventory.generation()
+        cursor = ttbl.inventory.cursor(generation, target_ids)
+        if ttbl.inventory.cursor_check(cursor, list(reversed(target_ids))) \
+           != generation:
+            raise tcfl.tc.failed_e("cursor not recognized")
+        # lost access to a target or gained access to another one
+        for ids in [ [ "inv0" ], target_ids + [ "inv1" ] ]:
+            if ttbl.inventory.cursor_check(cursor, ids) != 0:
+                raise tcfl.tc.failed_e(
+                    "change in allowed targets not detected",
+                    dict(target_ids = ids))
+        # a bare generation from an older server
+        if ttbl.inventory.cursor_check(generation, target_ids) != 0:
+            raise tcfl.tc.failed_e("bare generation taken as a cursor")
+        self.report_pass("cursor detects changes in the allowed targets")
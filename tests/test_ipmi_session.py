@@ -0,0 +1,273 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check IPMI commands are run on a persistent session to the BMC
+(:class:`ttbl.ipmi.bmc_session_c`) shared by the components
+accessing it, using a fake *ipmitool* simulating a BMC
+"""
+
+import concurrent.futures
+import os
+import stat
+import subprocess
+import sys
+
+import tcfl.tc
+import ttbl
+import ttbl.ipmi
+import ttbl.power
+import utl
+
+# Fakes the ipmitool commands ttbl.ipmi uses, one shot or in a
+# shell; each time it is started it counts as a session negotiated
+# with the BMC
+_ipmitool = """\
+#! %(python)s
+import os, sys, time
+
+state_dir = %(state_dir)r
+
+def _path(name):
+    return os.path.join(state_dir, name)
+
+def _command(args):
+    time.sleep(0.05)
+    if os.path.exists(_path("drop")):
+        # BMC closes the session
+        os.unlink(_path("drop"))
+        sys.exit(1)
+    if args == [ "chassis", "power", "status" ]:
+        state = "on" if os.path.exists(_path("on")) else "off"
+        print(f"Chassis Power is {state}")
+    elif args == [ "chassis", "power", "on" ]:
+        open(_path("on"), "w").close()
+        print("Chassis Power Control: Up/On")
+    elif args == [ "chassis", "power", "off" ]:
+        if os.path.exists(_path("fail")):
+            print("Unable to set Chassis Power Control to Down/Off",
+                  file = sys.stderr)
+            return 1
+        if os.path.exists(_path("on")):
+            os.unlink(_path("on"))
+        print("Chassis Power Control: Down/Off")
+    elif args == [ "chassis", "power", "cycle" ]:
+        with open(_path("cycles"), "a") as f:
+            f.write("cycle\\n")
+        print("Chassis Power Control: Cycle")
+    elif args[:3] == [ "chassis", "bootparam", "set" ]:
+        with open(_path("bootflag"), "w") as f:
+            f.write(args[-1])
+        print("Set Boot Device to " + args[-1])
+    else:
+        # like ipmitool, list the valid commands
+        print("Invalid command: " + " ".join(args), file = sys.stderr)
+        print("Commands:", file = sys.stderr)
+        for name, description in [
+                ( "raw", "Send a RAW IPMI request and print response" ),
+                ( "chassis", "Get chassis status and set power state" ),
+                ( "power", "Shortcut to chassis power commands" ),
+                ( "sol", "Configure and connect IPMIv2.0 Serial-over-LAN" ),
+        ]:
+            print(f"\t{name:<12s}  {description}", file = sys.stderr)
+        print("", file = sys.stderr)
+        return 1
+    return 0
+
+args = sys.argv[1:]
+while args and args[0].startswith("-"):
+    if args.pop(0) in ( "-N", "-R", "-H", "-U", "-I" ):
+        args.pop(0)
+with open(_path("sessions"), "a") as f:
+    f.write(" ".join(args) + "\\n")
+if args == [ "shell" ]:
+    while True:
+        print("ipmitool> ", end = "", flush = True)
+        line = sys.stdin.readline()
+        if not line:
+            break
+        _command(line.split())
+        sys.stdout.flush()
+else:
+    sys.exit(_command(args))
+"""
+
+class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+    """
+    Exercise :class:`ttbl.ipmi.pci` and :class:`ttbl.ipmi.pos_mode_c`
+    on a persistent session, without a server
+    """
+
+    @tcfl.tc.subcase()
+    def eval_00_create(self):
+        ttbl.test_target.state_path = os.path.join(self.tmpdir, "targets")
+        self.bmc_dir = os.path.join(self.tmpdir, "bmc")
+        bin_dir = os.path.join(self.tmpdir, "bin")
+        os.makedirs(self.bmc_dir, exist_ok = True)
+        os.makedirs(bin_dir, exist_ok = True)
+        ipmitool = os.path.join(bin_dir, "ipmitool")
+        with open(ipmitool, "w") as f:
+            f.write(_ipmitool % dict(python = sys.executable,
+                                     state_dir = self.bmc_dir))
+        os.chmod(ipmitool, os.stat(ipmitool).st_mode | stat.S_IXUSR)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = bin_dir + ":" + self.path
+
+        self.target = ttbl.test_target("server")
+        self.target.acquirer = ttbl.symlink_acquirer_c(self.target)
+        self.target.interface_add("power", ttbl.power.interface(
+            ( "boot", ttbl.ipmi.pos_mode_c("admin:secret@bmc0") ),
+            ( "main", ttbl.ipmi.pci("admin:secret@bmc0") ),
+        ))
+        # don't wait long between paranoid checks of the power state
+        self.target.power.impls['main'].wait = 0.1
+        # the session the components share
+        impl = self.target.power.impls['main']
+        self.session = ttbl.ipmi.bmc_session_get(
+            "bmc0", "admin", impl.cmdline, impl.env, 10)
+
+
+    def _sessions(self):
+        with open(os.path.join(self.bmc_dir, "sessions")) as f:
+            return f.read().splitlines()
+
+
+    @tcfl.tc.subcase()
+    def eval_10_shared(self):
+        target = self.target
+        target.fsdb.set("pos_mode", "pxe")
+        target.power._on(target, list(target.power.impls.items()),
+                         "", True, False)
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            states = list(executor.map(
+                lambda _: target.power._get(target)[0], range(8)))
+        if states != [ True ] * 8:
+            raise tcfl.tc.failed_e("expected powered on",
+                                   dict(states = states))
+        with open(os.path.join(self.bmc_dir, "bootflag")) as f:
+            bootflag = f.read()
+        if bootflag != "force_pxe":
+            raise tcfl.tc.failed_e(f"boot flag set to {bootflag}")
+        sessions = self._sessions()
+        if sessions != [ "shell" ]:
+            raise tcfl.tc.failed_e(
+                f"expected one session to the BMC, got {len(sessions)}",
+                dict(sessions = sessions, stats = self.session.stats))
+        self.report_pass(
+            f"{self.session.stats['commands']} commands from the boot"
+            " mode and power components run on one session",
+            dict(stats = self.session.stats))
+
+
+    @tcfl.tc.subcase()
+    def eval_15_pipelined_output(self):
+        # the listing of commands ipmitool prints after each marker
+        # must not end up in the output of the next command
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            outputs = list(executor.map(
+                lambda _: self.session.run([ "chassis", "power", "status" ]),
+                range(16)))
+        for output in outputs:
+            if output != b"Chassis Power is on":
+                raise tcfl.tc.failed_e("unexpected command output",
+                                       dict(output = output))
+        self.report_pass("pipelined commands get only their output")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_reconnect(self):
+        target = self.target
+        open(os.path.join(self.bmc_dir, "drop"), "w").close()
+        state, _data, _substate = target.power._get(target)
+        if state != True:
+            raise tcfl.tc.failed_e("state not read after dropping the"
+                                   " session", dict(state = state))
+        if len(self._sessions()) != 2 or self.session.stats['retries'] != 1:
+            raise tcfl.tc.failed_e("expected one reconnection",
+                                   dict(sessions = self._sessions(),
+                                        stats = self.session.stats))
+        self.report_pass("reconnected transparently when the BMC"
+                         " dropped the session")
+
+
+    @tcfl.tc.subcase()
+    def eval_25_no_retry(self):
+        retries = self.session.stats['retries']
+        open(os.path.join(self.bmc_dir, "drop"), "w").close()
+        try:
+            self.session.run([ "chassis", "power", "cycle" ])
+            raise tcfl.tc.failed_e("broken session not reported")
+        except subprocess.CalledProcessError:
+            pass
+        if self.session.stats['retries'] != retries:
+            raise tcfl.tc.failed_e("retried a command not safe to repeat",
+                                   dict(stats = self.session.stats))
+        self.session.run([ "chassis", "power", "cycle" ])
+        with open(os.path.join(self.bmc_dir, "cycles")) as f:
+            cycles = f.read().splitlines()
+        if len(cycles) != 1:
+            raise tcfl.tc.failed_e(f"expected one power cycle, got {cycles}")
+        self.report_pass("command not safe to repeat failed, not retried,"
+                         " when the session broke")
+
+
+    @tcfl.tc.subcase()
+    def eval_30_error(self):
+        impl = self.target.power.impls['main']
+        open(os.path.join(self.bmc_dir, "fail"), "w").close()
+        try:
+            impl.off(self.target, "main")
+        except impl.error_e as e:
+            self.report_pass(f"command failure reported: {e}")
+            return
+        finally:
+            os.unlink(os.path.join(self.bmc_dir, "fail"))
+        raise tcfl.tc.failed_e("command failure not reported")
+
+
+    @tcfl.tc.subcase()
+    def eval_40_idle(self):
+        idle_max = ttbl.ipmi.session_idle_max
+        try:
+            ttbl.ipmi.session_idle_max = 0
+            sessions = len(self._sessions())
+            self.target.power._get(self.target)
+            # a new session for each command
+            if len(self._sessions()) <= sessions:
+                raise tcfl.tc.failed_e("idle session not restarted",
+                                       dict(sessions = self._sessions()))
+        finally:
+            ttbl.ipmi.session_idle_max = idle_max
+        self.report_pass("idle session restarted")
+
+
+    @tcfl.tc.subcase()
+    def eval_50_key(self):
+        cmdline = [ "ipmitool", "-H", "bmc0", "-U", "admin" ]
+        session = ttbl.ipmi.bmc_session_get(
+            "bmc0", "admin", cmdline, { "IPMI_PASSWORD": "secret" }, 10)
+        if session is not ttbl.ipmi.bmc_session_get(
+                "bmc0", "admin", cmdline + [ "-v" ],
+                { "IPMI_PASSWORD": "secret" }, 10):
+            raise tcfl.tc.failed_e("same access, different sessions")
+        for _cmdline, env in [
+                ( cmdline, { "IPMI_PASSWORD": "other" } ),
+                ( cmdline + [ "-I", "lanplus" ],
+                  { "IPMI_PASSWORD": "secret" } ),
+        ]:
+            if session is ttbl.ipmi.bmc_session_get(
+                    "bmc0", "admin", _cmdline, env, 10):
+                raise tcfl.tc.failed_e(
+                    "different access, same session",
+                    dict(cmdline = _cmdline, env = env))
+        self.report_pass("sessions shared only with the same command"
+                         " line and environment")
+
+
+    def teardown_90_session(self):
+        self.session.close()
+        os.environ['PATH'] = self.path
@@ -0,0 +1,87 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check the incremental JSON decoder (:class:`commonl.json_stream_c`)
+and the streaming gzip compressor (:func:`commonl.gzip_iterator`)
+"""
+
+import collections
+import gzip
+import json
+
+import commonl
+import tcfl.tc
+
+class _test(tcfl.tc.tc_c):
+    """
+    Decode an inventory-like document received in chunks of
+    different sizes, as it would come from the network
+    """
+
+    doc = {
+        "generation": 1712345678901234,
+        "full": False,
+        "targets": {
+            "t0": { "a": { "b": 1, "c": [ 1, 2.5, "ñá" ] }, "id": "t0" },
+            "t.1": { "id": "t.1", "flag": True, "none": None },
+            "t2": {},
+        },
+        "removed": [ "t3", "t4" ],
+    }
+
+    @staticmethod
+    def _decode(chunks):
+        stream = commonl.json_stream_c(
+            chunks, object_pairs_hook = collections.OrderedDict)
+        d = {}
+        for key in stream.object_iter():
+            if key == "targets":
+                d[key] = collections.OrderedDict()
+                for target_id in stream.object_iter():
+                    d[key][target_id] = stream.value()
+            else:
+                d[key] = stream.value()
+        return d
+
+
+    @tcfl.tc.subcase()
+    def eval_00_chunks(self):
+        text = json.dumps(self.doc, indent = 1).encode('utf-8')
+        for size in [ 1, 2, 3, 5, 17, 4096 ]:
+            chunks = [ text[i:i + size] for i in range(0, len(text), size) ]
+            d = self._decode(chunks)
+            if d != self.doc:
+                raise tcfl.tc.failed_e(
+                    f"chunk size {size}: decoded data doesn't match",
+                    dict(d = d, doc = self.doc))
+            if list(d['targets'].keys()) != [ "t0", "t.1", "t2" ]:
+                raise tcfl.tc.failed_e(
+                    f"chunk size {size}: order not kept",
+                    dict(keys = list(d['targets'].keys())))
+        self.report_pass("document decoded in chunks of any size")
+
+
+    @tcfl.tc.subcase()
+    def eval_10_truncated(self):
+        text = json.dumps(self.doc).encode('utf-8')
+        try:
+            self._decode([ text[:-10] ])
+            raise tcfl.tc.failed_e("truncated document decoded")
+        except ValueError:
+            self.report_pass("truncated document raises ValueError")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_gzip(self):
+        text = json.dumps(self.doc).encode('utf-8')
+        chunks = [ text[i:i + 10] for i in range(0, len(text), 10) ]
+        data = b"".join(commonl.gzip_iterator(chunks))
+        if gzip.decompress(data) != text:
+            raise tcfl.tc.failed_e("gzip_iterator() output doesn't decompress"
+                                   " to the input")
+        self.report_pass("streamed gzip decompresses to the input")
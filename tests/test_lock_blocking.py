@@ -0,0 +1,145 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check :class:`ttbl.process_posix_file_lock_c` and
+:class:`ttbl.mutex.mutex_symlink` wake up as soon as the lock is
+released, time out and account contention in :data:`ttbl.lock_stats`
+"""
+
+import os
+import resource
+import threading
+import time
+
+import commonl
+import tcfl.tc
+import ttbl
+import ttbl.mutex
+
+class _test(tcfl.tc.tc_c):
+    """
+    Contend for locks from two threads (:func:`fcntl.flock` locks
+    are per open file, so two lock objects on the same file conflict
+    even in the same process)
+    """
+
+    @staticmethod
+    def _hold(lock, hold, acquired):
+        def _fn():
+            with lock:
+                acquired.set()
+                time.sleep(hold)
+        thread = threading.Thread(target = _fn)
+        thread.start()
+        acquired.wait()
+        return thread
+
+    @tcfl.tc.subcase()
+    def eval_00_wakeup(self):
+        lockfile = os.path.join(self.tmpdir, "lock-wakeup")
+        holder = ttbl.process_posix_file_lock_c(lockfile, name = "test-wakeup")
+        waiter = ttbl.process_posix_file_lock_c(lockfile, name = "test-wakeup",
+                                                timeout = 5, wait = 3)
+        hold = 0.5
+        ts0 = time.time()
+        thread = self._hold(holder, hold, threading.Event())
+        waiter.acquire()
+        wait = time.time() - ts0
+        waiter.release()
+        thread.join()
+        # the poll period is 3s, so we must have been woken up by
+        # the release
+        if wait > hold + 0.2:
+            raise tcfl.tc.failed_e(
+                f"took {wait:.2f}s to acquire a lock held for {hold}s")
+        stats = ttbl.lock_stats["test-wakeup"]
+        if stats['acquisitions'] != 2 or stats['contended'] != 1 \
+           or stats['hold_max'] < hold or stats['holder'] != None:
+            raise tcfl.tc.failed_e("unexpected lock statistics",
+                                   dict(stats = stats))
+        self.report_pass(f"acquired {wait - hold:.3f}s after release")
+
+
+    @tcfl.tc.subcase()
+    def eval_10_timeout(self):
+        lockfile = os.path.join(self.tmpdir, "lock-timeout")
+        holder = ttbl.process_posix_file_lock_c(lockfile, name = "test-timeout")
+        waiter = ttbl.process_posix_file_lock_c(lockfile, name = "test-timeout",
+                                                timeout = 0.3)
+        thread = self._hold(holder, 1, threading.Event())
+        try:
+            waiter.acquire()
+            raise tcfl.tc.failed_e("acquired a held lock")
+        except ttbl.process_posix_file_lock_c.timeout_e as e:
+            message = str(e)
+        thread.join()
+        if str(os.getpid()) not in message:
+            raise tcfl.tc.failed_e(
+                f"timeout message doesn't report the holder: {message}")
+        if ttbl.lock_stats["test-timeout"]['timeouts'] != 1:
+            raise tcfl.tc.failed_e("timeout not accounted",
+                                   dict(stats = ttbl.lock_stats["test-timeout"]))
+        self.report_pass(f"timed out reporting holder: {message}")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_mutex_symlink(self):
+        location = os.path.join(self.tmpdir, "mutex")
+        holder = ttbl.mutex.mutex_symlink(location, "holder")
+        waiter = ttbl.mutex.mutex_symlink(location, "waiter", timeout = 5,
+                                          wait_period = 3)
+        hold = 0.5
+        ts0 = time.time()
+        thread = self._hold(holder, hold, threading.Event())
+        waiter.acquire()
+        wait = time.time() - ts0
+        waiter.release()
+        thread.join()
+        if wait > hold + 0.2:
+            raise tcfl.tc.failed_e(
+                f"took {wait:.2f}s to acquire a mutex held for {hold}s")
+        self.report_pass(f"mutex acquired {wait - hold:.3f}s after release")
+
+
+    @tcfl.tc.subcase()
+    def eval_30_high_fds(self):
+        # a busy daemon has over 1024 files open, which select.select()
+        # can't wait on; fill the low file descriptors so the watches
+        # get high numbers
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < 1200:
+            if hard != resource.RLIM_INFINITY and hard < 1200:
+                raise tcfl.tc.skip_e(f"can't open 1200 files (limit {hard})")
+            resource.setrlimit(resource.RLIMIT_NOFILE, ( 1200, hard ))
+        fds = []
+        try:
+            while not fds or fds[-1] < 1030:
+                fds.append(os.open("/dev/null", os.O_RDONLY))
+            lockfile = os.path.join(self.tmpdir, "lock-high-fds")
+            holder = ttbl.process_posix_file_lock_c(lockfile,
+                                                    name = "test-high-fds")
+            waiter = ttbl.process_posix_file_lock_c(lockfile,
+                                                    name = "test-high-fds",
+                                                    timeout = 5, wait = 3)
+            thread = self._hold(holder, 0.5, threading.Event())
+            waiter.acquire()
+            waiter.release()
+            thread.join()
+            watch = commonl.dir_watch_c(self.tmpdir)
+            try:
+                with open(os.path.join(self.tmpdir, "high-fds"), "w"):
+                    pass
+                if not watch.wait(1):
+                    raise tcfl.tc.failed_e("directory change not seen")
+            finally:
+                watch.close()
+        finally:
+            for fd in fds:
+                os.close(fd)
+            resource.setrlimit(resource.RLIMIT_NOFILE, ( soft, hard ))
+        self.report_pass("waits work with file descriptors over 1024")
@@ -0,0 +1,115 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check deferred power actions (:func:`ttbl.power.execute_defer_list`)
+are executed in parallel, throttling those on targets sharing
+hardware
+"""
+
+import os
+import time
+
+import tcfl.tc
+import ttbl
+import ttbl.config
+import ttbl.power
+import utl
+
+class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+    """
+    Exercise :func:`ttbl.power.execute_defer_list`, without a server
+    """
+
+    @tcfl.tc.subcase()
+    def eval_00_create(self):
+        ttbl.test_target.state_path = os.path.join(self.tmpdir, "targets")
+        ttbl.config.targets.clear()
+        if ttbl.who_daemon() == None:
+            # set by the daemon when it starts
+            ttbl._who_daemon = "internal-test"
+        self.defer_list = []
+        for index in range(8):
+            target = ttbl.test_target(f"t{index}")
+            target.acquirer = ttbl.symlink_acquirer_c(target)
+            # the first four share a PDU
+            target.interface_add("power", ttbl.power.interface(
+                main = ttbl.power.fake_c(
+                    delay = 0.3,
+                    throttle_group = "pdu0" if index < 4 else None)))
+            ttbl.power.defer(target, True, self.defer_list)
+
+
+    @tcfl.tc.subcase()
+    def eval_10_parallel(self):
+        keepalives = []
+        timeline = ttbl.power.execute_defer_list(
+            self.defer_list, "test",
+            keepalive_fn = lambda: keepalives.append(time.time()),
+            keepalive_period = 0.1)
+        if timeline is not ttbl.power.defer_timelines["test"]:
+            raise tcfl.tc.failed_e("timeline not kept")
+        for target, _state, _soft_failure in self.defer_list:
+            state, _data, _substate = target.power._get(target)
+            if state != True:
+                raise tcfl.tc.failed_e(f"{target.id} not powered on",
+                                       dict(timeline = timeline))
+        # each action takes ~0.6s (reading the state, powering on),
+        # so serially this would take ~4.8s; the PDU throttles its
+        # four targets to two at the same time, so at least ~1.2s
+        if timeline['duration'] > 2.5:
+            raise tcfl.tc.failed_e(
+                f"deferred actions not executed in parallel"
+                f" (took {timeline['duration']:.2f}s)",
+                dict(timeline = timeline))
+        if timeline['groups'].get('pdu0', 0) < 1:
+            raise tcfl.tc.failed_e("throttle group pdu0 not throttled",
+                                   dict(timeline = timeline))
+        pdu0 = [ action for action in timeline['actions']
+                 if action['groups'] == [ "pdu0" ] ]
+        for action in pdu0:
+            overlapping = [
+                other for other in pdu0
+                if other['start'] <= action['start'] < other['end']
+            ]
+            if len(overlapping) > ttbl.power.defer_group_concurrency:
+                raise tcfl.tc.failed_e(
+                    f"{len(overlapping)} actions on throttle group pdu0"
+                    " executed at the same time",
+                    dict(timeline = timeline))
+        if not keepalives:
+            raise tcfl.tc.failed_e("no keepalives while executing")
+        self.report_pass(
+            f"executed in {timeline['duration']:.2f}s, throttle group"
+            f" pdu0 took {timeline['groups']['pdu0']:.2f}s",
+            dict(timeline = timeline))
+
+
+    @tcfl.tc.subcase()
+    def eval_20_hard_failure(self):
+        target = ttbl.test_target("broken")
+        target.acquirer = ttbl.symlink_acquirer_c(target)
+        target.interface_add("power", ttbl.power.interface(
+            main = ttbl.power.fake_c(throttle_group = "pdu1")))
+        target.power.impls['main'].on = None	# not callable, will fail
+        defer_list = [ ( target, True, False ) ]
+        for _target, _state, _soft_failure in self.defer_list:
+            defer_list.append(( _target, False, True ))
+        try:
+            ttbl.power.execute_defer_list(defer_list, "test", serialize = True)
+        except Exception as e:
+            timeline = ttbl.power.defer_timelines["test"]
+            not_executed = [ action for action in timeline['actions']
+                             if action['start'] == None ]
+            if len(not_executed) != len(self.defer_list):
+                raise tcfl.tc.failed_e(
+                    "actions started after a hard failure",
+                    dict(timeline = timeline))
+            self.report_pass(
+                f"hard failure stopped executing the list: {e}")
+            return
+        raise tcfl.tc.failed_e("hard failure not raised")
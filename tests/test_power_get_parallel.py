@@ -0,0 +1,153 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check the state of the components of a power rail is read in
+parallel and cached when asked to
+"""
+
+import os
+import threading
+import time
+
+import tcfl.tc
+import ttbl
+import ttbl.config
+import ttbl.power
+import utl
+
+class _counting_c(ttbl.power.fake_c):
+    # fake power component that counts how many times its state is read
+    def __init__(self, **kwargs):
+        ttbl.power.fake_c.__init__(self, **kwargs)
+        self.gets = 0
+
+    def get(self, target, component):
+        self.gets += 1
+        return ttbl.power.fake_c.get(self, target, component)
+
+
+class _concurrency_c(ttbl.power.fake_c):
+    # fake power component that records how many components of its
+    # class are being read at the same time
+    lock = threading.Lock()
+    reading = 0
+    reading_max = 0
+
+    def get(self, target, component):
+        cls = type(self)
+        with cls.lock:
+            cls.reading += 1
+            cls.reading_max = max(cls.reading_max, cls.reading)
+        try:
+            return ttbl.power.fake_c.get(self, target, component)
+        finally:
+            with cls.lock:
+                cls.reading -= 1
+
+
+class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+    """
+    Exercise :meth:`ttbl.power.interface._get`, without a server
+    """
+
+    @tcfl.tc.subcase()
+    def eval_00_create(self):
+        ttbl.test_target.state_path = os.path.join(self.tmpdir, "targets")
+        ttbl.config.targets.clear()
+        self.slow = ttbl.test_target("slow")
+        self.slow.interface_add("power", ttbl.power.interface(
+            get_parallel = True, **{
+                f"c{index}": ttbl.power.fake_c(delay = 0.3)
+                for index in range(10)
+            }))
+        self.serial = ttbl.test_target("serial")
+        self.serial.interface_add("power", ttbl.power.interface(**{
+            f"c{index}": ttbl.power.fake_c(delay = 0.1)
+            for index in range(3)
+        }))
+        self.grouped = ttbl.test_target("grouped")
+        self.grouped.interface_add("power", ttbl.power.interface(
+            get_parallel = True, **{
+                f"c{index}": _concurrency_c(delay = 0.2,
+                                            throttle_group = "pdu0")
+                for index in range(4)
+            }))
+        self.cached = ttbl.test_target("cached")
+        self.impl = _counting_c(get_cache_ttl = 60)
+        self.cached.interface_add(
+            "power", ttbl.power.interface(main = self.impl))
+
+
+    @tcfl.tc.subcase()
+    def eval_10_parallel(self):
+        ts0 = time.time()
+        state, data, substate = self.slow.power._get(self.slow)
+        elapsed = time.time() - ts0
+        if list(data) != [ f"c{index}" for index in range(10) ]:
+            raise tcfl.tc.failed_e("missing components or out of order",
+                                   dict(data = data))
+        if ( state, substate ) != ( False, "full" ):
+            raise tcfl.tc.failed_e(
+                f"expected off/full, got {state}/{substate}")
+        # serially this would take 3s
+        if elapsed > 1.5:
+            raise tcfl.tc.failed_e(
+                f"getting ten 0.3s components took {elapsed:.2f}s;"
+                " not parallel?")
+        self.report_pass(f"ten 0.3s components read in {elapsed:.2f}s")
+
+
+    @tcfl.tc.subcase()
+    def eval_15_serial(self):
+        # by default, components are read one after another
+        ts0 = time.time()
+        self.serial.power._get(self.serial)
+        elapsed = time.time() - ts0
+        if elapsed < 0.3:
+            raise tcfl.tc.failed_e(
+                f"getting three 0.1s components took {elapsed:.2f}s;"
+                " parallel by default?")
+        # in parallel, components on the same hardware are not
+        self.grouped.power._get(self.grouped)
+        if _concurrency_c.reading_max != 1:
+            raise tcfl.tc.failed_e(
+                f"{_concurrency_c.reading_max} components in the same"
+                " throttle group read at the same time")
+        self.report_pass("components read serially by default and"
+                         " within a throttle group")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_cache(self):
+        target = self.cached
+        target.power._get(target)
+        target.power._get(target)
+        if self.impl.gets != 1:
+            raise tcfl.tc.failed_e(
+                f"state read {self.impl.gets} times, expected cached")
+        self.report_pass("state cached")
+
+        target.power._impl_on(self.impl, target, "main")
+        state, _data, _substate = target.power._get(target)
+        if self.impl.gets != 2 or state != True:
+            raise tcfl.tc.failed_e(
+                "cached state not invalidated when powered on",
+                dict(gets = self.impl.gets, state = state))
+        self.report_pass("cached state invalidated when powered on")
+
+        ttl = self.impl.get_cache_ttl
+        try:
+            self.impl.get_cache_ttl = 0.1
+            time.sleep(0.2)
+            target.power._get(target)
+            if self.impl.gets != 3:
+                raise tcfl.tc.failed_e("cached state not expired",
+                                       dict(gets = self.impl.gets))
+        finally:
+            self.impl.get_cache_ttl = ttl
+        self.report_pass("cached state expired")
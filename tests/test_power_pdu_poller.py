@@ -0,0 +1,166 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check the state of the outlets of a PDU is read in bulk and shared
+(:class:`ttbl.power.pdu_poller_c`), using a fake Digital Loggers Web
+Power Switch (:class:`ttbl.pc.dlwps7`) served locally
+"""
+
+import concurrent.futures
+import http.server
+import os
+import re
+import threading
+import time
+
+import tcfl.tc
+import ttbl
+import ttbl.config
+import ttbl.pc
+import ttbl.power
+import utl
+
+class _dlwps7_handler_c(http.server.BaseHTTPRequestHandler):
+    # fakes just what ttbl.pc.dlwps7 uses
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        m = re.match(r"^/outlet\?(?P<outlet>[0-9])=(?P<op>ON|OFF)$",
+                     self.path)
+        if m:
+            with server.lock:
+                bit = 1 << int(m.group('outlet')) - 1
+                if m.group('op') == "ON":
+                    server.state |= bit
+                else:
+                    server.state &= ~bit
+            body = b"ok"
+        elif self.path == "/index.htm":
+            with server.lock:
+                server.reads += 1
+                state = server.state
+            time.sleep(server.delay)
+            body = b"<html><!-- state=%02x lock=00 --></html>" % state
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+    """
+    Exercise :class:`ttbl.power.pdu_poller_c`, without a server
+    """
+
+    @tcfl.tc.subcase()
+    def eval_00_create(self):
+        ttbl.test_target.state_path = os.path.join(self.tmpdir, "targets")
+        self.server = http.server.ThreadingHTTPServer(
+            ( "127.0.0.1", 0 ), _dlwps7_handler_c)
+        self.server.lock = threading.Lock()
+        self.server.state = 0
+        self.server.reads = 0
+        self.server.delay = 0.2
+        self.server.daemon_threads = True
+        threading.Thread(target = self.server.serve_forever,
+                         daemon = True).start()
+        port = self.server.server_address[1]
+        ttbl.config.targets.clear()
+        self.pdu_targets = []
+        for outlet in range(1, 9):
+            target = ttbl.test_target(f"t{outlet}")
+            target.interface_add("power", ttbl.power.interface(
+                main = ttbl.pc.dlwps7(f"http://127.0.0.1:{port}/{outlet}")))
+            self.pdu_targets.append(target)
+
+
+    def _states_get(self):
+        # read the power state of all the targets at the same time
+        with concurrent.futures.ThreadPoolExecutor(len(self.pdu_targets)) \
+             as executor:
+            return list(executor.map(
+                lambda target: target.power._get(target)[0],
+                self.pdu_targets))
+
+
+    @tcfl.tc.subcase()
+    def eval_10_bulk(self):
+        reads = self.server.reads
+        states = self._states_get()
+        if states != [ False ] * 8:
+            raise tcfl.tc.failed_e("expected all off", dict(states = states))
+        if self.server.reads - reads != 1:
+            raise tcfl.tc.failed_e(
+                f"reading 8 outlets took {self.server.reads - reads}"
+                " requests to the PDU, expected one")
+        self.report_pass("eight outlets read with one request")
+
+        reads = self.server.reads
+        self._states_get()
+        if self.server.reads != reads:
+            raise tcfl.tc.failed_e(
+                "state read again from the PDU while still fresh")
+        self.report_pass("state read while fresh not read again")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_invalidate(self):
+        target = self.pdu_targets[2]
+        target.power._impl_on(target.power.impls["main"], target, "main")
+        states = self._states_get()
+        if states != [ False, False, True ] + [ False ] * 5:
+            raise tcfl.tc.failed_e("expected t3 on after powering it on",
+                                   dict(states = states))
+        self.report_pass("state read again after powering on")
+
+        freshness = ttbl.power.pdu_state_freshness
+        try:
+            ttbl.power.pdu_state_freshness = 0
+            reads = self.server.reads
+            target.power._get(target)
+            target.power._get(target)
+            if self.server.reads - reads != 2:
+                raise tcfl.tc.failed_e(
+                    "state not read again once stale",
+                    dict(reads = self.server.reads - reads))
+        finally:
+            ttbl.power.pdu_state_freshness = freshness
+        self.report_pass("state read again once stale")
+
+
+    @tcfl.tc.subcase()
+    def eval_30_errors(self):
+        calls = []
+        def _fetch():
+            calls.append(time.time())
+            time.sleep(0.2)
+            raise RuntimeError("PDU unreachable")
+        poller = ttbl.power.pdu_poller_c("broken", _fetch)
+        def _get(outlet):
+            try:
+                poller.state_get(outlet)
+                return None
+            except RuntimeError as e:
+                return str(e)
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            errors = list(executor.map(_get, range(4)))
+        if errors != [ "PDU unreachable" ] * 4 or len(calls) != 1:
+            raise tcfl.tc.failed_e(
+                "concurrent queries didn't share the failed read",
+                dict(errors = errors, calls = len(calls)))
+        self.report_pass("concurrent queries share a failed read")
+
+
+    def teardown_90_server(self):
+        self.server.shutdown()
@@ -0,0 +1,110 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check power rail components that declare their dependencies are
+powered on and off in parallel, keeping the declared order
+"""
+
+import os
+
+import tcfl.tc
+import ttbl
+import ttbl.config
+import ttbl.power
+import utl
+
+class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+    """
+    Exercise :meth:`ttbl.power.interface._on` and
+    :meth:`ttbl.power.interface._off` with dependencies, without a
+    server
+    """
+
+    @tcfl.tc.subcase()
+    def eval_00_create(self):
+        ttbl.test_target.state_path = os.path.join(self.tmpdir, "targets")
+        ttbl.config.targets.clear()
+        self.target = ttbl.test_target("graph")
+        self.target.interface_add("power", ttbl.power.interface(
+            ( "daemon0", ttbl.power.fake_c(delay = 0.3, depends = []) ),
+            ( "daemon1", ttbl.power.fake_c(delay = 0.3, depends = []) ),
+            ( "daemon2", ttbl.power.fake_c(delay = 0.3, depends = []) ),
+            ( "AC", ttbl.power.fake_c(
+                delay = 0.1, depends = [ "daemon0", "daemon1", "daemon2" ]) ),
+            ( "jtag", ttbl.power.fake_c(explicit = "both", depends = []) ),
+        ))
+
+
+    def _rail(self):
+        return list(self.target.power.impls.items())
+
+
+    @tcfl.tc.subcase()
+    def eval_10_on(self):
+        target = self.target
+        target.power._on(target, self._rail(), "", True, False)
+        timelines = target.power.timelines[target.id]
+        timeline = timelines['timeline']
+        elapsed = max(end for _start, end in timeline.values())
+        state, data, substate = target.power._get(target)
+        if ( state, substate ) != ( True, "normal" ) \
+           or data['jtag']['state'] != False:
+            raise tcfl.tc.failed_e(
+                "expected on, but the explicit component",
+                dict(data = data, substate = substate))
+        # serially this would take 1s
+        if elapsed > 0.7:
+            raise tcfl.tc.failed_e(
+                f"independent components not powered on in parallel"
+                f" (took {elapsed:.2f}s)", dict(timelines = timelines))
+        ac_start = timeline['AC'][0]
+        for daemon in ( "daemon0", "daemon1", "daemon2" ):
+            if timeline[daemon][1] > ac_start:
+                raise tcfl.tc.failed_e(
+                    f"AC started before {daemon} was done",
+                    dict(timelines = timelines))
+        if timelines['critical_path'][-1] != "AC" \
+           or len(timelines['critical_path']) != 2:
+            raise tcfl.tc.failed_e("unexpected critical path",
+                                   dict(timelines = timelines))
+        self.report_pass(f"powered on in {elapsed:.2f}s, critical path"
+                         f" {' > '.join(timelines['critical_path'])}",
+                         dict(timelines = timelines))
+
+
+    @tcfl.tc.subcase()
+    def eval_20_off(self):
+        target = self.target
+        target.power._off(target, self._rail(), "", True, False)
+        timelines = target.power.timelines[target.id]
+        timeline = timelines['timeline']
+        state, _data, _substate = target.power._get(target)
+        if state != False:
+            raise tcfl.tc.failed_e("not powered off")
+        ac_end = timeline['AC'][1]
+        for daemon in ( "daemon0", "daemon1", "daemon2" ):
+            if timeline[daemon][0] < ac_end:
+                raise tcfl.tc.failed_e(
+                    f"{daemon} powered off before AC",
+                    dict(timelines = timelines))
+        self.report_pass("powered off in reverse dependency order",
+                         dict(timelines = timelines))
+
+
+    @tcfl.tc.subcase()
+    def eval_30_loop(self):
+        target = ttbl.test_target("loop")
+        try:
+            target.interface_add("power", ttbl.power.interface(
+                ( "a", ttbl.power.fake_c(depends = [ "b" ]) ),
+                ( "b", ttbl.power.fake_c(depends = [ "a" ]) ),
+            ))
+        except AssertionError as e:
+            self.report_pass(f"dependency loop detected: {e}")
+            return
+        raise tcfl.tc.failed_e("dependency loop not detected")
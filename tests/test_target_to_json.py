@@ -0,0 +1,75 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Check the cached JSON inventory of a target
+(:meth:`ttbl.test_target.to_json`) follows changes to its data
+"""
+
+import json
+import os
+
+import tcfl.tc
+import ttbl
+import ttbl.allocation
+import ttbl.config
+import utl
+
+class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+    """
+    Exercise :meth:`ttbl.test_target.to_json` caching, without a
+    server
+    """
+
+    @tcfl.tc.subcase()
+    def eval_00_create(self):
+        ttbl.test_target.state_path = os.path.join(self.tmpdir, "targets")
+        ttbl.allocation.path = os.path.join(self.tmpdir, "allocations")
+        ttbl.allocation.init(self.tmpdir)
+        self.target = ttbl.test_target("t0")
+        self.target.acquirer = ttbl.symlink_acquirer_c(self.target)
+        self.target.tags_update(dict(a = dict(b = 1, c = dict(d = 2))))
+        self.target.tags_cache_enable()
+
+
+    def _check(self, projections, expected):
+        data = self.target.to_json(projections)
+        d = json.loads(data)
+        if d != expected:
+            raise tcfl.tc.failed_e(
+                f"{projections}: unexpected data", dict(d = d, expected = expected))
+        return data
+
+
+    @tcfl.tc.subcase()
+    def eval_10_cached(self):
+        data = self._check([ "a" ],
+                           { "a": { "b": 1, "c": { "d": 2 } }, "id": "t0" })
+        if self.target.to_json([ "a" ]) is not data:
+            raise tcfl.tc.failed_e("second call not served from cache")
+        d = self.target.to_dict([ "a" ])
+        d['id'] = "t0"
+        if json.loads(data) != d:
+            raise tcfl.tc.failed_e("to_json() differs from to_dict()",
+                                   dict(to_json = data, to_dict = d))
+        if self.target.to_json([ "nonexistant" ]) != None:
+            raise tcfl.tc.failed_e("empty projection shall return None")
+        self.report_pass("JSON inventory is cached")
+
+
+    @tcfl.tc.subcase()
+    def eval_20_invalidation(self):
+        self.target.to_json([ "a" ])
+        self.target.fsdb.set("a.x", 5)
+        self._check([ "a" ],
+                    { "a": { "b": 1, "c": { "d": 2 }, "x": 5 }, "id": "t0" })
+        self.target.properties_flat_set([ ( "a.x", None ), ( "a.y", 3 ) ])
+        self._check([ "a" ],
+                    { "a": { "b": 1, "c": { "d": 2 }, "y": 3 }, "id": "t0" })
+        self.target.tags_update(dict(a = dict(b = 4)))
+        self._check([ "a" ], { "a": { "b": 4, "y": 3 }, "id": "t0" })
+        self.report_pass("changes to the FSDB and tags are seen")
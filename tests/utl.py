@@ -9,10 +9,114 @@
 Unit test library and utilites
 ==============================
 """
+import importlib
 import os
+import threading
 
 def tcf_tool_path(testcase):
     """
     Return the to the TCF tool in the current source tree
     """
     return os.path.join(testcase.kws['srcdir_abs'], os.path.pardir, "tcf")
+
+
+
+#: Globals of the daemon's code standalone testcases might modify
+#:
+#: Saved before the testcase runs and restored after it is done (see
+#: :class:`ttbl_standalone_c`); dictionaries and lists are restored
+#: in place, since other modules might have a reference to them.
+ttbl_standalone_globals = [
+    "ttbl._who_daemon",
+    "ttbl.test_target.state_path",
+    "ttbl.config.targets",
+    "ttbl.config.target_max_idle",
+    "ttbl.user_control.User.state_dir",
+    "ttbl.user_control.User.state_dir_secondary",
+    "ttbl.allocation.path",
+    "ttbl.allocation.allocid_uuid_db",
+    "ttbl.allocation.events_path",
+    "ttbl.config.allocation_scheduler_events",
+    "ttbl.allocation._waiter_queues",
+    "ttbl.allocation.backfill",
+    "ttbl.allocation.backfill_stats",
+    "ttbl.allocation._durations_db",
+    "ttbl.allocation._time",
+    "ttbl.allocation.index_path",
+    "ttbl.allocation.maintenance_stats",
+    "ttbl.power._pdu_pollers",
+    "ttbl.power.defer_timelines",
+    "ttbl.ipmi._sessions",
+    "ttbl.inventory.path",
+    "ttbl.inventory._fsdb",
+    "ttbl.inventory._lock",
+    "ttbl.inventory._hashes",
+]
+
+_ttbl_standalone_lock = threading.Lock()
+
+def _global_resolve(name):
+    # "ttbl.config.targets" -> ( MODULE ttbl.config, "targets" ),
+    # "ttbl.test_target.state_path" -> ( CLASS ttbl.test_target,
+    # "state_path" ), importing as needed
+    parts = name.split(".")
+    for index in range(len(parts) - 1, 0, -1):
+        try:
+            obj = importlib.import_module(".".join(parts[:index]))
+            break
+        except ImportError:
+            continue
+    else:
+        raise ImportError(f"{name}: can't find module")
+    for part in parts[index:-1]:
+        obj = getattr(obj, part)
+    return obj, parts[-1]
+
+
+class ttbl_standalone_c:
+    """
+    Mixin for testcases that run the daemon's code (:mod:`ttbl`)
+    without starting a server::
+
+      class _test(utl.ttbl_standalone_c, tcfl.tc.tc_c):
+          ...
+
+    These testcases set up the daemon's globals (where the state is
+    kept, which targets are configured...) to their needs; since
+    *tcf run* runs the testcases as threads of the same process, the
+    testcases using this mixin are run one at a time and the globals
+    in :data:`ttbl_standalone_globals` are restored once each is
+    done; the allocation cache is flushed before and after.
+    """
+
+    def setup_00_ttbl_standalone(self):
+        _ttbl_standalone_lock.acquire()
+        self._ttbl_globals = []
+        for name in ttbl_standalone_globals:
+            obj, attr = _global_resolve(name)
+            value = getattr(obj, attr)
+            if isinstance(value, ( dict, list )):
+                self._ttbl_globals.append(( obj, attr, value, value.copy() ))
+            else:
+                self._ttbl_globals.append(( obj, attr, value, None ))
+        self._ttbl_caches_flush()
+
+    @staticmethod
+    def _ttbl_caches_flush():
+        # allocations are cached by ID, no matter where they are kept
+        import ttbl.allocation
+        ttbl.allocation.lru_aged_cache_allocation_c.invalidate()
+
+    def teardown_99_ttbl_standalone(self):
+        try:
+            for obj, attr, value, contents in self._ttbl_globals:
+                setattr(obj, attr, value)
+                if contents != None:
+                    value.clear()
+                    if isinstance(value, dict):
+                        value.update(contents)
+                    else:
+                        value.extend(contents)
+            self._ttbl_caches_flush()
+        finally:
+            _ttbl_standalone_lock.release()
@@ -95,6 +95,8 @@ targets over HTTP to be controlled by the TCF client.
     scripts = [
         "ttbd",
         "ttbd-passwd",
+        "ttbd-fsdb-migrate",
+        "ttbd-allocation-sim",
         'hw-healthmonitor/ttbd-hw-healthmonitor.py',
         "usb-sibling-by-serial"
     ],
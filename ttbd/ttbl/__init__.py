@@ -144,13 +144,53 @@ def who_create(user_id, ticket = None):
         return user_id
 
 
+#: Log a warning when it takes longer than this many seconds to
+#: acquire a :class:`process_posix_file_lock_c` lock
+lock_wait_warn = 2
+
+#: Contention statistics of the :class:`process_posix_file_lock_c`
+#: locks taken by this process, keyed by lock name; each entry is a
+#: dictionary with:
+#:
+#: - *acquisitions*: times it was acquired
+#: - *contended*: times it was held by someone else when acquiring
+#: - *timeouts*: times it timed out acquiring
+#: - *wait_total*, *wait_max*: seconds spent waiting to acquire it
+#: - *hold_total*, *hold_max*: seconds it was held
+#: - *holder*: who holds it now in this process (*PID THREAD
+#:   [INTERFACE]*), *None* if no one
+lock_stats = collections.defaultdict(lambda: dict(
+    acquisitions = 0, contended = 0, timeouts = 0,
+    wait_total = 0.0, wait_max = 0.0,
+    hold_total = 0.0, hold_max = 0.0,
+    holder = None))
+_lock_stats_lock = threading.Lock()
+
 class process_posix_file_lock_c(object):
     """
-    Very simple interprocess file-based spinning lock
+    Very simple interprocess file-based lock
 
-    .. warning::
+    Acquiring waits in the kernel (see :func:`commonl.flock_timeout`)
+    for the lock to be released, for up to *timeout* seconds.
+
+    Who holds the lock is written to the lock file, so it can be
+    reported when acquiring takes long (see :data:`lock_wait_warn`)
+    or times out; wait and hold times are accounted in
+    :data:`lock_stats`.
+
+    :param str lockfile: name of the file to lock (will be created)
+    :param float timeout: (optional) maximum seconds to wait to
+      acquire
+    :param float wait: (optional) seconds between attempts if the
+      platform can't wait in the kernel
+    :param str name: (optional) name under which to account the
+      lock's statistics in :data:`lock_stats` (default *lockfile*)
 
-       - Won't work between threads of a process
+    Threads of a process sharing the same object lock each other
+    out too, since each acquires with its own file descriptor
+    (kept in thread local storage); it is not recursive.
+
+    .. warning::
 
        - If a process dies, the next process can acquire it but there
          will be no warning about the previous process having died,
@@ -160,38 +200,92 @@ class process_posix_file_lock_c(object):
     class timeout_e(Exception):
         pass
 
-    def __init__(self, lockfile, timeout = 20, wait = 0.3):
+    def __init__(self, lockfile, timeout = 20, wait = 0.3, name = None):
         self.lockfile = lockfile
         self.timeout = timeout
         self.wait = wait
-        self.fd = None
-        # ensure the file is created
-        with open(self.lockfile, "w+") as f:
-            f.write("")
+        self.name = name if name else lockfile
+        # fd, ts_acquired of the thread holding it
+        self._tls = threading.local()
+        # ensure the file is created, but don't wipe the holder
+        os.close(os.open(self.lockfile, os.O_CREAT | os.O_RDWR, 0o666))
+
+    def holder_get(self):
+        """
+        Return who holds (or last held) the lock
+
+        :returns str: *PID THREAD [INTERFACE] since TIMESTAMP*, as
+          written by the holder; *None* if unknown
+        """
+        try:
+            with open(self.lockfile) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
 
     def acquire(self):
         ts0 = time.time()
-        self.fd = os.open(self.lockfile, os.O_RDWR | os.O_EXCL)
-        while True:
+        fd = os.open(self.lockfile, os.O_RDWR | os.O_CLOEXEC)
+        try:
+            contended = False
             try:
-                fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                break
-            except IOError as e:
-                if e.errno != errno.EAGAIN:
-                    self.release()
-                    raise
-                time.sleep(self.wait)
-                ts = time.time()
-                if ts - ts0 > self.timeout:
-                    self.release()
-                    raise self.timeout_e
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                contended = True
+                if not commonl.flock_timeout(fd, self.lockfile,
+                                             self.timeout, self.wait):
+                    with _lock_stats_lock:
+                        lock_stats[self.name]['timeouts'] += 1
+                    raise self.timeout_e(
+                        f"{self.name}: timed out after {self.timeout}s"
+                        f" acquiring lock held by {self.holder_get()}")
+        except:
+            os.close(fd)
+            raise
+        ts_acquired = time.time()
+        self._tls.fd = fd
+        self._tls.ts_acquired = ts_acquired
+        wait = ts_acquired - ts0
+        if wait > lock_wait_warn:
+            logging.warning("%s: waited %.1fs to acquire lock",
+                            self.name, wait)
+        holder = "%d %s" % (os.getpid(), threading.current_thread().name)
+        interface = getattr(tls, 'interface', None)
+        if interface:
+            holder += f" [{interface}]"
+        # PID first, padded as in UUCP lock files (LCK..DEVICE), in
+        # case someone else reads them
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, f"{holder:>10} since {ts_acquired:.6f}\n"\
+                  .encode('utf-8'), 0)
+        with _lock_stats_lock:
+            stats = lock_stats[self.name]
+            stats['acquisitions'] += 1
+            if contended:
+                stats['contended'] += 1
+            stats['wait_total'] += wait
+            stats['wait_max'] = max(stats['wait_max'], wait)
+            stats['holder'] = holder
 
     def release(self):
-        os.close(self.fd)
-        self.fd = None
+        fd = self._tls.fd
+        hold = time.time() - self._tls.ts_acquired
+        self._tls.fd = None
+        self._tls.ts_acquired = None
+        with _lock_stats_lock:
+            stats = lock_stats[self.name]
+            stats['hold_total'] += hold
+            stats['hold_max'] = max(stats['hold_max'], hold)
+            stats['holder'] = None
+        # closing also releases the flock, which wakes up whoever is
+        # waiting in commonl.flock_timeout()
+        os.close(fd)
 
     def locked(self):
-        return self.fd != None
+        """
+        Return if the calling thread holds the lock
+        """
+        return getattr(self._tls, "fd", None) != None
 
     def __enter__(self):
         self.acquire()
@@ -558,6 +652,13 @@ class tt_interface(object):
          cycles, this number goes up and the capture size starts at
          zero).
 
+       - *stream_follow*: (optional, seconds) once the end of the
+         file is reached, keep streaming what is appended to it for
+         up to this long.
+       - *stream_follow_check*: (optional, callable) when following,
+         called periodically and when the file changes; if it returns
+         *True*, stop (eg: the file was replaced).
+
        An X-stream-gen-offset header will be returned to the client
        with the string *GENERATION OFFSET*, where the current
        generation of the stream as provided and the offset that was
@@ -1152,17 +1253,29 @@ class test_target(object):
         commonl.makedirs_p(os.path.join(self.state_dir, "queue"), 0o2770,
                            "target %s's allocation queue" % self.id)
         self.lock = process_posix_file_lock_c(
-            os.path.join(self.state_dir, "lockfile"))
+            os.path.join(self.state_dir, "lockfile"),
+            name = f"target-{self.id}")
         #: filesystem database of target state; the multiple daemon
         #: processes use this to store information that reflect's the
         #: target's state.
         if fsdb == None:
-            self.fsdb = commonl.fsdb_symlink_c(self.state_dir)
+            if ttbl.config.fsdb_backend == None:
+                self.fsdb = commonl.fsdb_symlink_c(self.state_dir)
+            else:
+                self.fsdb = commonl.fsdb_c.create(
+                    self.state_dir, backend = ttbl.config.fsdb_backend)
         else:
             assert isinstance(fsdb, commonl.fsdb_c), \
                 "fsdb %s must inherit commonl.fsdb_c" % fsdb
             self.fsdb = fsdb
 
+        # caches for to_dict() and to_json(); see tags_cache_enable()
+        # the lock protects them from multiple threads (not held
+        # while computing what's to be cached)
+        self._cache_lock = threading.Lock()
+        self._tags_flat_cache = None
+        self._json_cache = ( None, {} )
+
         #: Keywords that can be used to substitute values in commands,
         #: messages. Target's tags are translated to keywords
         #: here. :func:`ttbl.config.target_add` will update this with
@@ -1293,8 +1406,7 @@ class test_target(object):
         # because it is way easier to filter on flat triyng to keep
         # what has to be there and what not. And the performance at
         # the end might not be much more or less...
-        l = commonl.dict_to_flat(self.tags, projections,
-                                 sort = False, empty_dict = True)
+        l = self._tags_flat_get(projections)
 
         # Override with changeable stuff set by users
         #
@@ -1354,6 +1466,117 @@ class test_target(object):
             r.setdefault('_alloc', {})['timestamp'] = self.timestamp_get()
         return r
 
+    #: Maximum number of projection sets for which we cache the
+    #: flattened tags (see :meth:`tags_cache_enable`)
+    tags_flat_cache_max = 64
+
+    def tags_cache_enable(self):
+        """
+        Start caching the target's flattened tags
+
+        :meth:`to_dict` flattens the tags for each projection it is
+        asked for; since tags do not change once the configuration is
+        loaded, we can keep the flattened versions.
+
+        The daemon calls this once the configuration has been loaded;
+        from there on, tags shall only be modified with
+        :meth:`tags_update`, which flushes the cache.
+        """
+        with self._cache_lock:
+            self._tags_flat_cache = {}
+            self._json_cache = ( None, {} )
+
+    def _tags_cache_flush(self):
+        with self._cache_lock:
+            if self._tags_flat_cache != None:
+                self._tags_flat_cache = {}
+            self._json_cache = ( None, {} )
+
+    def _tags_flat_get(self, projections):
+        # dict_to_flat(self.tags), cached if enabled
+        if self._tags_flat_cache == None:
+            return commonl.dict_to_flat(self.tags, projections,
+                                        sort = False, empty_dict = True)
+        projections_key = tuple(projections) if projections else ()
+        with self._cache_lock:
+            l = self._tags_flat_cache.get(projections_key, None)
+        if l == None:
+            l = commonl.dict_to_flat(self.tags, projections,
+                                     sort = False, empty_dict = True)
+            with self._cache_lock:
+                if len(self._tags_flat_cache) >= self.tags_flat_cache_max:
+                    self._tags_flat_cache = {}
+                self._tags_flat_cache[projections_key] = l
+        return list(l)		# callers append to it
+
+    def _json_cache_key(self):
+        # Return a key that changes whenever the output of to_dict()
+        # might change; None if we can't tell (and thus can't cache)
+        #
+        # Other than the tags (see tags_cache_enable()) to_dict() gets
+        # data from the target's FSDB, the allocation that owns it
+        # (timestamp), the acquirer (owner) and the queue of waiters
+        if self._tags_flat_cache == None:
+            return None
+        fsdb_generation = self.fsdb.generation()
+        if fsdb_generation == None:
+            return None
+        allocid = self.fsdb.get('_alloc.id')
+        allocdb_generation = None
+        if allocid:
+            try:
+                allocdb = allocation.get_from_cache(allocid)
+            except allocation.allocation_c.invalid_e:
+                return None	# to_dict() will clean it up
+            allocdb_generation = allocdb.generation()
+            if allocdb_generation == None:
+                return None
+        return ( fsdb_generation, allocid, allocdb_generation,
+                 self._acquirer.get(),
+                 allocation._target_queue_version(self) )
+
+    def to_json(self, projections):
+        """
+        Return all of the target's data JSON encoded
+
+        This is the same as :meth:`to_dict`, with the target's *id*
+        added, encoded to JSON; the result is cached until the
+        target's data changes, so it is cheap to call repeatedly (eg:
+        when listing the inventory).
+
+        :param list projections: list of fields to include (see
+          :meth:`to_dict`)
+
+        :returns bytes: JSON encoded data, *None* if the projections
+          yield no data
+        """
+        projections_key = tuple(projections) if projections else ()
+        # get the key before, so if something changes while we
+        # compute, we'll cache it with the old key and recompute next
+        key = self._json_cache_key()
+        if key != None:
+            with self._cache_lock:
+                cache_key, cache = self._json_cache
+                if cache_key != key:
+                    cache = {}
+                    self._json_cache = ( key, cache )
+                elif projections_key in cache:
+                    return cache[projections_key]
+        d = self.to_dict(projections)
+        if d:
+            # list it only if the projections yielded a non empty
+            # set of data
+            d['id'] = self.id
+            data = json.dumps(d).encode('utf-8')
+        else:
+            data = None
+        if key != None:
+            with self._cache_lock:
+                if len(cache) >= self.tags_flat_cache_max:
+                    cache.clear()
+                cache[projections_key] = data
+        return data
+
 
     def kws_collect(self, impl = None, kws = None):
         """
@@ -1375,8 +1598,7 @@ class test_target(object):
         if kws == None:
             kws = dict()
         # see to_dict(), very similar
-        l = commonl.dict_to_flat(self.tags,
-                                 sort = False, empty_dict = True)
+        l = self._tags_flat_get(None)
         # fstb can overwrite tags, per policy
         l += self.fsdb.get_as_slist()
         kws.update(self.kws)
@@ -1399,6 +1621,7 @@ class test_target(object):
     def type(self, new_type):
         assert isinstance(new_type, str)
         self.tags['type'] = new_type
+        self._tags_cache_flush()
         return self.tags['type']
 
     @property
@@ -1581,6 +1804,7 @@ class test_target(object):
         else:
             # FIXME: validate interconnects is a dict
             self.tags['interconnects'].setdefault(ic, {}).update(d)
+        self._tags_cache_flush()
 
         # Once updated, we verify them and let it fail raising an
         # assertion if something is wrong
@@ -1603,7 +1827,10 @@ class test_target(object):
             allocdb = self._allocdb_get()
             if allocdb:
                 ts = allocdb.timestamp_get()
-                self.fsdb.set('timestamp', ts)
+                # don't write if not changed, it'd change the
+                # generation (see to_json())
+                if self.fsdb.get('timestamp') != ts:
+                    self.fsdb.set('timestamp', ts)
                 return ts
             # if there is no timestamp, forge the Epoch
             return self.fsdb.get('timestamp', "19700101000000")
@@ -1625,11 +1852,12 @@ class test_target(object):
         return self.fsdb.get('_alloc.id')
 
     def _allocid_wipe(self):
-        self.fsdb.set('_alloc.id', None)
-        self.fsdb.set('_alloc.queue_preemption', None)
-        self.fsdb.set('_alloc.priority', None)
-        self.fsdb.set('_alloc.ts_start', None)
-        self.fsdb.set('owner', None)
+        with self.fsdb.transaction():
+            self.fsdb.set('_alloc.id', None)
+            self.fsdb.set('_alloc.queue_preemption', None)
+            self.fsdb.set('_alloc.priority', None)
+            self.fsdb.set('_alloc.ts_start', None)
+            self.fsdb.set('owner', None)
 
     def _allocid_get(self):
         # return the allocid, if valid, None otherwise
@@ -1827,10 +2055,12 @@ class test_target(object):
         # See ttbl.test_target.to_dict(): these properties are
         # generated, not allowed to set them
 
-        for prop, value in props_and_values:
-            if prop in self.properties_forbidden:
-                raise RuntimeError("property '%s' cannot be set" % prop)
-        self.fsdb.set_keys(props_and_values)
+        # sorted, so a.b is set before a.b.c, like fsdb.set_keys()
+        with self.fsdb.transaction():
+            for prop, value in sorted(props_and_values, key = lambda t: t[0]):
+                if prop in self.properties_forbidden:
+                    raise RuntimeError("property '%s' cannot be set" % prop)
+                self.fsdb.set(prop, value)
 
 
 
@@ -1844,10 +2074,7 @@ class test_target(object):
         """
         assert isinstance(who, str)
         with self.target_owned_and_locked(who):
-            for prop, value in props_and_values:
-                if prop in self.properties_forbidden:
-                    raise RuntimeError("property '%s' cannot be set" % prop)
-            self.fsdb.set_keys(props_and_values)
+            self.properties_flat_set(props_and_values)
 
 
 
@@ -2050,6 +2277,8 @@ class test_target(object):
                     allocdb.guest_remove(user.get_id())
                 else:
                     raise test_target_release_denied_e(self)
+            # let the scheduler give it to whoever is waiting
+            ttbl.allocation.event_post("release", self.id)
         except acquirer_c.cant_release_not_owner_e:
             raise test_target_release_denied_e(self)
         except acquirer_c.cant_release_not_acquired_e:
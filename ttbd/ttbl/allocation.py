@@ -60,10 +60,14 @@ Preemption use cases
 
 """
 
-import bisect
+import calendar
 import collections
+import concurrent.futures
+import contextlib
 import datetime
 import errno
+import fcntl
+import heapq
 import json
 import logging
 import numbers
@@ -72,6 +76,7 @@ import os
 import re
 import shutil
 import tempfile
+import threading
 import time
 import uuid
 import werkzeug
@@ -119,38 +124,43 @@ audit = None
 
 class lru_aged_c(object):
     # very basic, different types not considered, neither kwargs
+    #
+    # thread safe; the lock is not held while calling fn, so two
+    # threads missing the same entry at the same time will both call
+    # it and the last one wins
     
     def __init__(self, fn, ttl, maxsize):
         self.cache = collections.OrderedDict()
         self.fn = fn
         self.ttl = ttl
         self.maxsize = maxsize
+        self.lock = threading.Lock()
 
     def __call__(self, *args):	# FIXME: support kwargs
         timestamp = time.time()
-        if args in self.cache:
-            result, result_timestamp = self.cache[args]
-            if result_timestamp - timestamp <= self.ttl:                
-                # FIXME: python 3 self.cache.move_to_end(args)
-                item = self.cache.pop(args)
-                self.cache[args] = item
-                return self.cache[args][0]
-            # fallthrough, item is too old, refresh
+        with self.lock:
+            if args in self.cache:
+                result, result_timestamp = self.cache[args]
+                if result_timestamp - timestamp <= self.ttl:
+                    self.cache.move_to_end(args)
+                    return result
+                # fallthrough, item is too old, refresh
         result = self.fn(*args)
-        self.cache[args] = (result, timestamp)
-        if len(self.cache) > self.maxsize:
-            self.cache.popitem(last = False)
+        with self.lock:
+            self.cache[args] = (result, timestamp)
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last = False)
         return result
 
     def cache_hit(self, args):
         return args in self.cache
     
     def invalidate(self, entry = None):
-        if entry == None:
-            del self.cache
-            self.cache = collections.OrderedDict()
-        elif entry in self.cache:
-            del self.cache[entry]
+        with self.lock:
+            if entry == None:
+                self.cache.clear()
+            elif entry in self.cache:
+                del self.cache[entry]
     
 class allocation_c(commonl.fsdb_symlink_c):
     """
@@ -166,8 +176,10 @@ class allocation_c(commonl.fsdb_symlink_c):
         # protects writing to most fields
         # - group
         # - state
+        # allocations come and go, so account all their locks
+        # together in ttbl.lock_stats
         self.lock = ttbl.process_posix_file_lock_c(
-            os.path.join(dirname, "lockfile"))
+            os.path.join(dirname, "lockfile"), name = "allocation")
         self.targets_all = None
         self.groups = None
         self.target_info_reload()
@@ -224,9 +236,20 @@ class allocation_c(commonl.fsdb_symlink_c):
                         # steps are the same
                         target._state_cleanup(True)
                         target._allocid_wipe()
+                    if backfill:
+                        ts_start = self.get("timestamp_start", None)
+                        if ts_start != None:
+                            _duration_record(self.get("user", None),
+                                             _time() - ts_start)
                 else:
                     targets = self.targets_all
         finally:
+            try:
+                _index_allocation(self, _index_remove)
+            except Exception as e:
+                # query() will clean up once the allocation is gone
+                logging.warning("ALLOC: %s: can't remove from indexes: %s",
+                                self.allocid, e)
             # wipe the whole tree--this will render all the records that point
             # to it invalid and the next _run() call will clean them
             shutil.rmtree(self.location, True)
@@ -236,6 +259,8 @@ class allocation_c(commonl.fsdb_symlink_c):
         # release all queueing/owning targets to it
         if targets:
             _run(targets.values(), False)
+            for target_name in targets:
+                event_post("release", target_name)
 
     def set(self, *args, force = True, **kwargs):
         # we default to forcing
@@ -248,7 +273,11 @@ class allocation_c(commonl.fsdb_symlink_c):
           else
         """
         assert new_state in states
+        state = self.get('state', None)
         self.set('state', new_state, force = True)
+        if state != new_state:
+            _index_remove("state", state, self.allocid)
+            _index_add("state", new_state, self.allocid)
 
     def state_get(self):
         return self.get('state')
@@ -281,11 +310,13 @@ class allocation_c(commonl.fsdb_symlink_c):
             # it
             # ts_now is datetime.datetime.now(), let's get endtime
             # datetime format
+            # note endtime is in UTC (see request())
             ts_endtime = datetime.datetime.strptime(endtime, "%Y%m%d%H%M%S")
-            if ts_endtime > ts_now:
-                logging.info(
-                    "ALLOC: allocation %s expired @%s, deleting",
-                    self.allocid, endtime)
+            if ts_endtime > datetime.datetime.utcnow():
+                return		# not yet
+            logging.info(
+                "ALLOC: allocation %s expired @%s, deleting",
+                self.allocid, endtime)
             if audit:
                 # FIXME: this is really messy -- audit.record needs to be better
                 _auditor = audit("unused")
@@ -328,11 +359,40 @@ class allocation_c(commonl.fsdb_symlink_c):
         # FIXME: define well how are we going to define the TTL
         ttl = self.get("ttl", 0)
         if ttl > 0:
-            ts_start = int(self.get('_alloc.timestamp_start'))
-            if ts_now - ts_start > ttl:
+            # set in calculate_stuff()
+            ts_start = self.get('timestamp_start', None)
+            if ts_start != None and _time() - ts_start > ttl:
                 self.delete('overtime')
                 return
 
+    def deadline_get(self):
+        """
+        Return when :meth:`maintenance` might have something to do
+        next for this allocation (eg: expire it, time it out)
+
+        Note the allocation might be kept alive in the meantime, so
+        once the deadline is reached, :meth:`maintenance` has to be
+        called to check and then the deadline has to be recalculated.
+
+        :returns float: time in seconds since the epoch; *None* if
+          never
+        """
+        endtime = self.get("endtime", None)
+        if endtime == "static":
+            return None
+        if endtime != None:		# in UTC, see request()
+            return calendar.timegm(time.strptime(endtime, "%Y%m%d%H%M%S"))
+        # timestamps are in local time, with one second resolution;
+        # maintenance() times out when idle > target_max_idle
+        ts = time.mktime(time.strptime(self.timestamp_get(), "%Y%m%d%H%M%S"))
+        deadline = ts + ttbl.config.target_max_idle + 1
+        ttl = self.get("ttl", 0)
+        if ttl > 0:
+            ts_start = self.get('timestamp_start', None)
+            if ts_start != None:
+                deadline = min(deadline, ts_start + ttl)
+        return deadline
+
     def calculate_stuff(self):
         # lock so we don't have two processes doing the same
         # processing after acquiring diffrent targets of our group the
@@ -373,8 +433,8 @@ class allocation_c(commonl.fsdb_symlink_c):
                     # value, then we have it allocated
                     # Sort here because everywhere else we need a set
                     self.set("group_allocated", ",".join(sorted(group)))
-                    self.set("timestamp_start", time.time())
-                    self.set("ts_start", time.time())	# COMPAT
+                    self.set("timestamp_start", _time())
+                    self.set("ts_start", _time())	# COMPAT
                     self.state_set("active")
                     #logging.error("DEBUG: %s: group %s complete, state %s",
                     #              self.allocid, group_name,
@@ -456,12 +516,15 @@ class allocation_c(commonl.fsdb_symlink_c):
         # collissions. FLWs.
         guestid = commonl.mkid(userid, l = 4)
         self.set("guest." + guestid, userid)
+        _index_add("user", userid, self.allocid)
 
     def guest_remove(self, userid):
         # a guest is trying to delete, which just removes the user
         guestid = commonl.mkid(userid, l = 4)
         # same as guest_remove()
         self.set("guest." + guestid, None)
+        if userid not in ( self.get("user"), self.get("creator") ):
+            _index_remove("user", userid, self.allocid)
 
 
     def guest_list(self):
@@ -513,7 +576,13 @@ def get_from_cache(allocid):
         # cache and return invalid
         lru_aged_cache_allocation_c.invalidate(allocid)
         raise allocation_c.invalid_e("%s: invalid allocation" % allocid)
-    return lru_aged_cache_allocation_c(allocid)
+    try:
+        return lru_aged_cache_allocation_c(allocid)
+    except allocation_c.invalid_e:
+        # the database is there but can't be used (eg: a target in
+        # it was removed); index it so query() shows it to everyone
+        _index_add("state", "invalid", allocid)
+        raise
 
 
 def init(state_path):
@@ -526,6 +595,175 @@ def init(state_path):
     global allocid_uuid_db
     commonl.makedirs_p(allocid_uuid_db_path)
     allocid_uuid_db = commonl.fs_cache_c(allocid_uuid_db_path)
+    global events_path
+    events_path = os.path.join(state_path, "allocation-events")
+    commonl.makedirs_p(events_path)
+    global _durations_db
+    durations_path = os.path.join(state_path, "allocation-durations")
+    commonl.makedirs_p(durations_path)
+    _durations_db = commonl.fsdb_symlink_c(durations_path)
+    global index_path
+    index_path = os.path.join(state_path, "allocation-index")
+    commonl.makedirs_p(index_path, 0o2770)
+    _index_rebuild()
+
+
+
+#
+# Allocation indexes
+#
+# To find the allocations a user can see or those in a given state
+# without loading all of them, indexes are kept in
+# STATEDIR/allocation-index:
+#
+#   user/ID/ALLOCID -> USERID	for the user, creator and guests
+#   state/STATE/ALLOCID -> STATE
+#
+# (ID is commonl.mkid(USERID), since user IDs can contain any
+# character). Entries are symlinks, so adding or removing one is a
+# single system call and they are shared by all the server's
+# processes; they are updated when allocations are created, deleted
+# or change state, or guests are added or removed.
+#
+# Entries might go stale (eg: if a process dies half way through
+# deleting an allocation), so query() verifies them against the
+# allocation and drops those of allocations that no longer exist.
+#
+
+#: Path where the allocation indexes are kept, set by :func:`init`
+index_path = None
+
+def _index_dir(kind, key):
+    if kind == "user":
+        key = commonl.mkid(key)
+    return os.path.join(index_path, kind, key)
+
+def _index_add(kind, key, allocid):
+    if index_path == None or not key:
+        return
+    dirname = _index_dir(kind, key)
+    try:
+        os.symlink(key, os.path.join(dirname, allocid))
+    except FileExistsError:
+        pass
+    except FileNotFoundError:
+        commonl.makedirs_p(dirname, 0o2770)
+        try:
+            os.symlink(key, os.path.join(dirname, allocid))
+        except FileExistsError:
+            pass
+
+def _index_remove(kind, key, allocid):
+    if index_path == None or not key:
+        return
+    try:
+        os.unlink(os.path.join(_index_dir(kind, key), allocid))
+    except FileNotFoundError:
+        pass
+
+def _index_list(kind, key):
+    try:
+        return os.listdir(_index_dir(kind, key))
+    except FileNotFoundError:
+        return []
+
+def _index_allocation(allocdb, index_fn):
+    # add or remove all the index entries for an allocation
+    d = allocdb.get_as_dict("user", "creator", "state")
+    for userid in [ d.get("user", None), d.get("creator", None) ] \
+        + allocdb.guest_list():
+        index_fn("user", userid, allocdb.allocid)
+    index_fn("state", d.get("state", None), allocdb.allocid)
+
+def _index_rebuild():
+    # index the allocations that exist, from before there were
+    # indexes; if we die half way, we'll be redoing it next time
+    marker = os.path.join(index_path, "complete")
+    if os.path.exists(marker):
+        return
+    count = 0
+    for allocid in os.listdir(path):
+        try:
+            _index_allocation(get_from_cache(allocid), _index_add)
+            count += 1
+        except Exception as e:
+            logging.warning("ALLOC: %s: can't index: %s", allocid, e)
+    with open(marker, "w") as f:
+        f.write("")
+    logging.info("ALLOC: indexed %d allocations", count)
+
+
+#
+# Scheduling events
+#
+# When something happens that might need the scheduler to act (eg:
+# a target is released, so it can be given to a waiter), the process
+# where it happened posts an event, which the scheduler process
+# (see scheduler_c) picks up.
+#
+# Events are symlinks in the events directory, named with the time
+# they were posted so they are processed in order and pointing to
+# KIND:NAME; creating one is a single system call.
+#
+
+#: Path where the scheduling events are posted, set by :func:`init`
+events_path = None
+
+_events_tls = threading.local()
+_events_count = 0
+
+@contextlib.contextmanager
+def _events_muted():
+    # don't post events for what is done inside the block; used by
+    # the scheduler when it allocates targets for its own purposes
+    # (eg: to power them off when idle), so it doesn't wake itself up
+    muted = getattr(_events_tls, "muted", False)
+    _events_tls.muted = True
+    try:
+        yield
+    finally:
+        _events_tls.muted = muted
+
+def event_post(kind, name):
+    """
+    Post an event for the allocation scheduler
+
+    :param str kind: kind of event:
+
+      - *request*: an allocation (*name*) was created
+
+      - *release*: a target (*name*) was released, so it might be
+        given to someone waiting for it
+
+    :param str name: name of the allocation or target the event
+      refers to
+    """
+    global _events_count
+    if events_path == None or not ttbl.config.allocation_scheduler_events \
+       or getattr(_events_tls, "muted", False):
+        return
+    _events_count += 1
+    os.symlink(kind + ":" + name,
+               os.path.join(events_path, "%020d-%d-%d" % (
+                   time.time_ns(), os.getpid(), _events_count)))
+
+def _events_read():
+    # return a list of the events posted [ ( KIND, NAME ) ], in order,
+    # removing them
+    events = []
+    for filename in sorted(os.listdir(events_path)):
+        location = os.path.join(events_path, filename)
+        try:
+            kind, name = os.readlink(location).split(":", 1)
+            os.unlink(location)
+        except FileNotFoundError:
+            continue
+        except ValueError:		# bad event, ignore it
+            logging.error("ALLOC: %s: removing invalid event", filename)
+            commonl.rm_f(location)
+            continue
+        events.append(( kind, name ))
+    return events
 
 
 
@@ -578,26 +816,438 @@ def _waiter_validate(target, waiter_string, value):
     target.fsdb.set(waiter_string, None)	# invalid entry, wipe
     return None, None, None, None
 
+#
+# Per-target waiter queues
+#
+# The allocations waiting for a target are recorded in an append-only
+# journal (STATEDIR/TARGETNAME/queue/journal), one line per waiter
+# added to the queue:
+#
+#   + PRIORITY TIMESTAMP FLAGS ALLOCID
+#
+# and one per waiter removed:
+#
+#   - ALLOCID
+#
+# (see request() for the meaning of the fields). Each process keeps
+# the queue in memory, as a heap sorted by priority and timestamp,
+# and when it needs it, applies only the lines appended since the
+# last time, so the queue is not re-read and re-sorted every time
+# the scheduler runs on the target.
+#
+# When the journal has many more lines than waiters, it is compacted
+# (rewritten with only the current waiters and atomically replaced);
+# appends and compactions are serialized with flock() on the journal.
+# A compacted journal starts with a header line counting the
+# compactions:
+#
+#   # compaction COUNT
+#
+# so a process can tell it was replaced even if the new file got the
+# same inode number as the old one.
+#
+
+#: Compact a target's waiter journal when it has this many times
+#: more lines than waiters (and at least
+#: :data:`waiter_journal_compact_min` lines)
+waiter_journal_compact_ratio = 4
+
+#: Minimum number of lines in a waiter journal before considering
+#: compacting it
+waiter_journal_compact_min = 64
+
+class _waiter_queue_c:
+    # queue of waiters for a target, see above
+
+    def __init__(self, target):
+        self.target_id = target.id
+        self.path = os.path.join(target.state_dir, "queue", "journal")
+        # protects the in-memory state, for threads that share it
+        self.lock = threading.Lock()
+        # heap of waiters ( PRIORITY, TIMESTAMP, FLAGS, ALLOCID,
+        # NAME ); entries for waiters that have been removed are
+        # left in the heap until it is rebuilt, so those not in
+        # self.waiters are ignored
+        self.heap = []
+        # ALLOCID -> waiter
+        self.waiters = {}
+        self._reset(None)
+        self._migrate(target)
+
+    def _reset(self, ident):
+        self.heap = []
+        self.waiters = {}
+        # ( INODE, COMPACTIONS ) of the journal we have applied
+        self.ident = ident
+        self.offset = 0
+        self.lines = 0
+        # ( INODE, SIZE, MTIME ) of the journal when we applied all
+        # of it, to skip reading it if it didn't change
+        self.stat_last = None
+
+    @staticmethod
+    def _compactions_read(f):
+        # read how many times the journal was compacted from its
+        # header; journals that were never compacted have none
+        f.seek(0)
+        header = f.readline()
+        if header.startswith(b"# compaction ") and header.endswith(b"\n"):
+            try:
+                return int(header.split()[2])
+            except ValueError:
+                pass
+        return 0
+
+    def _migrate(self, target):
+        # COMPAT: move waiters recorded in the target's FSDB as
+        # _alloc.queue.PRIO-TIMESTAMP-FLAGS-ALLOCID by older versions
+        # to the journal
+        for waiter_string, value in target.fsdb.get_as_slist("_alloc.queue.*"):
+            prio, ts, flags, allocid = \
+                _waiter_validate(target, waiter_string, value)
+            if prio == None:	# bad entry, killed
+                continue
+            self.add(prio, ts, flags, allocid)
+            target.fsdb.set(waiter_string, None)
+
+    def _apply(self, line):
+        if line.startswith("#"):
+            return			# header
+        self.lines += 1
+        fields = line.split()
+        if len(fields) == 5 and fields[0] == "+" \
+           and len(fields[1]) == 6 and fields[1].isdigit() \
+           and len(fields[2]) == 14 and fields[2].isdigit() \
+           and len(fields[3]) == 2 and fields[3][0] in "PN" \
+           and fields[3][1] in "SE":
+            prio = int(fields[1])
+            allocid = fields[4]
+            waiter = ( prio, fields[2], fields[3], allocid,
+                       "%06d-%s-%s-%s" % (prio, fields[2], fields[3], allocid) )
+            if self.waiters.get(allocid, None) != waiter:
+                self.waiters[allocid] = waiter
+                heapq.heappush(self.heap, waiter)
+        elif len(fields) == 2 and fields[0] == "-":
+            self.waiters.pop(fields[1], None)
+        else:
+            logging.error("ALLOC: %s: ignoring invalid waiter journal"
+                          " entry: %s", self.target_id, line)
+
+    def _refresh(self):
+        # apply what has been appended to the journal since the last
+        # time; needs self.lock taken
+        try:
+            s = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset(None)
+            return
+        if ( s.st_ino, s.st_size, s.st_mtime_ns ) == self.stat_last:
+            return			# nothing new
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            self._reset(None)
+            return
+        with f:
+            s = os.fstat(f.fileno())
+            ident = ( s.st_ino, self._compactions_read(f) )
+            if ident != self.ident or s.st_size < self.offset:
+                self._reset(ident)	# compacted, start over
+            f.seek(self.offset)
+            data = f.read()
+        # a line might being written right now, take only full ones
+        end = data.rfind(b"\n")
+        if end >= 0:
+            for line in data[:end].decode('utf-8').split("\n"):
+                self._apply(line)
+            self.offset += end + 1
+        if self.offset == s.st_size:
+            self.stat_last = ( s.st_ino, s.st_size, s.st_mtime_ns )
+        else:				# partial line or appended meanwhile
+            self.stat_last = None
+        if len(self.heap) > 2 * len(self.waiters) + 16:
+            # too many removed waiters in the heap, rebuild it
+            self.heap = list(self.waiters.values())
+            heapq.heapify(self.heap)
+
+    def _append(self, line):
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         0o660)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                if os.fstat(fd).st_ino != os.stat(self.path).st_ino:
+                    continue	# compacted while we waited, retry
+                os.write(fd, line.encode('utf-8'))
+                return
+            finally:
+                os.close(fd)		# also releases the flock
+
+    def _compact(self):
+        # rewrite the journal with only the current waiters; needs
+        # self.lock taken
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)	# no one can append now
+            if os.fstat(fd).st_ino != os.stat(self.path).st_ino:
+                return		# someone else compacted it
+            self._refresh()
+            compactions = self.ident[1] + 1
+            path_new = self.path + ".%d" % os.getpid()
+            with open(path_new, "w") as f:
+                f.write("# compaction %d\n" % compactions)
+                for waiter in sorted(self.waiters.values()):
+                    f.write("+ %06d %s %s %s\n" % waiter[:4])
+            os.replace(path_new, self.path)
+            s = os.stat(self.path)
+            self.ident = ( s.st_ino, compactions )
+            self.offset = s.st_size
+            self.stat_last = ( s.st_ino, s.st_size, s.st_mtime_ns )
+            self.lines = len(self.waiters)
+        finally:
+            os.close(fd)
+
+    def add(self, prio, ts, flags, allocid):
+        """
+        Add a waiter to the queue
+        """
+        self._append("+ %06d %s %s %s\n" % (prio, ts, flags, allocid))
+
+    def remove(self, allocid):
+        """
+        Remove a waiter from the queue
+        """
+        self._append("- %s\n" % allocid)
+        with self.lock:
+            self.waiters.pop(allocid, None)
+
+    def load(self):
+        """
+        Get the current waiters
+
+        :returns tuple: *( WAITERS, PREEMPT )*: list of waiters
+          *( PRIORITY, TIMESTAMP, FLAGS, ALLOCID, NAME )* sorted by
+          priority (highest, numerically lower, first) and timestamp;
+          *PREEMPT* is *True* if any of them requested preemption
+        """
+        with self.lock:
+            self._refresh()
+            if self.lines > waiter_journal_compact_min \
+               and self.lines > waiter_journal_compact_ratio * len(self.waiters):
+                self._compact()
+            heap = list(self.heap)
+            waiters = self.waiters
+            preempt = False
+            l = []
+            seen = set()
+            while heap:
+                waiter = heapq.heappop(heap)
+                if waiters.get(waiter[3], None) != waiter:
+                    continue	# removed
+                if waiter[3] in seen:
+                    # removed and added again the same; both copies
+                    # are in the heap
+                    continue
+                seen.add(waiter[3])
+                if 'P' in waiter[2]:
+                    preempt = True
+                l.append(waiter)
+            return l, preempt
+
+    def version(self):
+        """
+        Return a value that changes when the queue changes
+        """
+        try:
+            s = os.stat(self.path)
+            # the inode number might be reused after compacting, with
+            # the same size; the modification time will differ
+            return ( s.st_ino, s.st_size, s.st_mtime_ns )
+        except FileNotFoundError:
+            return None
+
+
+_waiter_queues = {}
+_waiter_queues_lock = threading.Lock()
+
+def _waiter_queue_get(target):
+    with _waiter_queues_lock:
+        queue = _waiter_queues.get(target.id, None)
+        if queue == None:
+            queue = _waiter_queue_c(target)
+            _waiter_queues[target.id] = queue
+        return queue
+
 def _target_queue_load(target):
     # Load the target's queue
-    waiters = []
-    preempt = False
-    for waiter_string, value in target.fsdb.get_as_slist("_alloc.queue.*"):
-        # get_as_slist returns an alphabetical sort by key
-        # alphabetical sort by the
-        # prio/ts/flags/allocid/waiter_sstring gives us the highest
-        # prio first and within the same prio, sorted by the
-        # allocation creation time.  could use a regex to validate
-        # this, but the fields are so simple...
-        prio, ts, flags, allocid = \
-            _waiter_validate(target, waiter_string, value)
-        if prio == None:	# bad entry, killed
+    return _waiter_queue_get(target).load()
+
+def _target_queue_version(target):
+    # Return a value that changes when the target's queue changes
+    return _waiter_queue_get(target).version()
+
+#
+# Backfill
+#
+# When a target is released and the highest priority waiter is an
+# allocation that needs more targets (a group) which are still busy,
+# giving it the target would leave it idle until the rest of the
+# group is available. With backfill enabled, the target is instead
+# given to a lower priority waiter that can use it right away and is
+# expected to be done before the group can start, so the group is
+# not delayed.
+#
+# When allocations will end is estimated from their *endtime* (if
+# requested) or from how long the allocations of the same user took
+# in the past (an exponentially weighted average recorded when they
+# are deleted); if it can't be estimated, there is no backfill.
+#
+# The estimate of when the group can start assumes its other targets
+# will be given to it as soon as they are released.
+#
+
+#: Enable backfilling targets (see above)
+backfill = False
+
+#: Weight given to the last duration when updating the average
+#: allocation duration of a user
+backfill_duration_weight = 0.3
+
+#: Statistics on backfill decisions made by this process
+#:
+#: - *backfilled*: targets given to a lower priority waiter
+#: - *no_estimate*: a group was waiting but it couldn't be estimated
+#:   when it will start
+#: - *no_candidate*: no lower priority waiter was expected to finish
+#:   in time
+backfill_stats = collections.Counter()
+
+# database of average allocation durations per user, set by init()
+_durations_db = None
+
+# time source for the backfill estimates, the allocation start
+# times and the TTL checks against them; the simulator
+# (ttbl.allocation_sim) replaces it with its clock
+_time = time.time
+
+def _duration_record(userid, duration):
+    if _durations_db == None or not userid:
+        return
+    key = commonl.mkid(userid)
+    average = _durations_db.get(key, None)
+    if average == None:
+        average = duration
+    else:
+        average += backfill_duration_weight * (duration - average)
+    _durations_db.set(key, average)
+
+def _duration_estimate(userid):
+    if _durations_db == None or not userid:
+        return None
+    return _durations_db.get(commonl.mkid(userid), None)
+
+def _allocation_end_estimate(allocdb, ts_now):
+    # when is an allocation expected to end; None if unknown
+    d = allocdb.get_as_dict("state", "endtime", "timestamp_start", "user")
+    endtime = d.get("endtime", None)
+    if endtime == "static":
+        return None
+    if endtime != None:		# in UTC, see request()
+        return calendar.timegm(time.strptime(endtime, "%Y%m%d%H%M%S"))
+    duration = _duration_estimate(d.get("user", None))
+    if duration == None:
+        return None
+    if d.get("state", None) != "active":
+        # not started, so it'd run from now
+        return ts_now + duration
+    ts_start = d.get("timestamp_start", None)
+    if ts_start == None:
+        return None
+    # if it is overdue, it could end any moment
+    return max(ts_now, ts_start + duration)
+
+def _target_free_estimate(target, allocid, ts_now):
+    # when is *target* expected to be available to *allocid*
+    allocid_owner = target.allocid_get_bare()
+    if allocid_owner == None or allocid_owner == allocid:
+        return ts_now
+    try:
+        allocdb_owner = get_from_cache(allocid_owner)
+    except allocation_c.invalid_e:
+        return ts_now		# will be cleaned up
+    if allocdb_owner.state_get() != "active":
+        return None		# owner waiting for its group, can't tell
+    return _allocation_end_estimate(allocdb_owner, ts_now)
+
+def _group_start_estimate(allocdb, target, ts_now):
+    # when can any group of *allocdb* that needs *target* start, if
+    # it is given *target*; None if it can't be estimated
+    ts_start = None
+    for group in allocdb.groups.values():
+        if target.id not in group:
+            continue
+        ts_group = ts_now
+        for target_name in group:
+            if target_name == target.id:
+                continue
+            ts_target = _target_free_estimate(
+                allocdb.targets_all[target_name], allocdb.allocid, ts_now)
+            if ts_target == None:
+                ts_group = None
+                break
+            ts_group = max(ts_group, ts_target)
+        if ts_group != None and ( ts_start == None or ts_group < ts_start ):
+            ts_start = ts_group
+    return ts_start
+
+def _backfill_candidate_ready(allocdb, target):
+    # can *allocdb* become active just by getting *target*? (so it
+    # won't sit on it waiting for more targets)
+    for group in allocdb.groups.values():
+        if target.id not in group:
             continue
-        if 'P' in flags:
-            preempt = True
-        bisect.insort(waiters, ( prio, ts, flags, allocid,
-                                 waiter_string ))
-    return waiters, preempt
+        for target_name in group:
+            if target_name == target.id:
+                continue
+            if allocdb.targets_all[target_name].allocid_get_bare() \
+               != allocdb.allocid:
+                break
+        else:
+            return True
+    return False
+
+def _backfill_pick(target, allocdb, waiters):
+    # *allocdb* is the highest priority waiter for the free *target*;
+    # if it can't use it now, return a lower priority waiter from
+    # *waiters* that can use *target* and is expected to be done
+    # before *allocdb* can start, as ( WAITER, ALLOCDB ); None otherwise
+    ts_now = _time()
+    ts_group_start = _group_start_estimate(allocdb, target, ts_now)
+    if ts_group_start == None:
+        backfill_stats['no_estimate'] += 1
+        return None
+    if ts_group_start <= ts_now:
+        return None		# it can start now, no need
+    for waiter in waiters:
+        try:
+            allocdb_candidate = get_from_cache(waiter[3])
+        except allocation_c.invalid_e:
+            continue		# will be cleaned up later
+        if not _backfill_candidate_ready(allocdb_candidate, target):
+            continue
+        ts_end = _allocation_end_estimate(allocdb_candidate, ts_now)
+        if ts_end != None and ts_end <= ts_group_start:
+            backfill_stats['backfilled'] += 1
+            logging.info("ALLOC: %s: backfilling %s, expected to end"
+                         " %.0fs before %s can start", target.id,
+                         allocdb_candidate.allocid, ts_group_start - ts_end,
+                         allocdb.allocid)
+            return waiter, allocdb_candidate
+    backfill_stats['no_candidate'] += 1
+    return None
 
 def _target_starvation_recalculate(allocdb, target, score):
     # FIXME: don't print FIXME bc then it drives nuts all the unit
@@ -629,7 +1279,7 @@ def _target_allocate_locked(target, current_allocdb, waiters, preempt):
     # have been removed while we were getting here)
     waiter = None
     allocdb = None
-    for waiter in waiters:
+    for index, waiter in enumerate(waiters):
         try:
             allocdb = get_from_cache(waiter[3])
             # valid highest prio waiter!
@@ -639,18 +1289,24 @@ def _target_allocate_locked(target, current_allocdb, waiters, preempt):
         except allocation_c.invalid_e as e:
             #logging.error("DEBUG:ALLOC: %s: waiter %s: invalid: %s",
             #              target.id, waiter, e)
-            target.fsdb.set(waiter[4], None)	# invalid, remove it, try next
+            # invalid, remove it, try next
+            _waiter_queue_get(target).remove(waiter[3])
     else:
         #logging.error("DEBUG:ALLOC: %s: no waiters", target.id)
         return None	        # no valid waiter, nothing to dox
 
+    if backfill and current_allocdb == None and len(allocdb.targets_all) > 1:
+        r = _backfill_pick(target, allocdb, waiters[index + 1:])
+        if r:
+            waiter, allocdb = r
+
     # waiter at this point is
     #
     # #0: priority of this waiter for this target
     # #1: timestamp when the waiter started waiting
     # #2: flags
     # #3: allocid
-    # #4: name of original queue file
+    # #4: name of the waiter (PRIO-TIMESTAMP-FLAGS-ALLOCID)
 
     priority_waiter = waiter[0]	# get prio, maybe boosted
     if current_allocdb:
@@ -693,16 +1349,18 @@ def _target_allocate_locked(target, current_allocdb, waiters, preempt):
 
     # The target is not allocated either because it was free, the
     # allocation was invalid and got cleaned up or it got preempted;
-    # let's latch on it
-    target.fsdb.set("_alloc.priority", priority_waiter)
-    target.fsdb.set("owner", allocdb.get('user'))
-    target.fsdb.set("_alloc.id", allocdb.allocid)
+    # let's latch on it, committing it all together (see
+    # commonl.fsdb_c.transaction() for how atomic that is)
     ts = time.strftime("%Y%m%d%H%M%S")
-    target.fsdb.set("_alloc.ts_start", ts)	# COMPAT
-    target.fsdb.set("_alloc.timestamp_start", ts)
-    target.fsdb.set("timestamp", ts)
+    with target.fsdb.transaction():
+        target.fsdb.set("_alloc.priority", priority_waiter)
+        target.fsdb.set("owner", allocdb.get('user'))
+        target.fsdb.set("_alloc.id", allocdb.allocid)
+        target.fsdb.set("_alloc.ts_start", ts)	# COMPAT
+        target.fsdb.set("_alloc.timestamp_start", ts)
+        target.fsdb.set("timestamp", ts)
     # remove the waiter from the queue
-    target.fsdb.set(waiter[4], None)
+    _waiter_queue_get(target).remove(waiter[3])
     # ** This waiter is the owner now **
     #logging.error("DEBUG: %s: target allocated to %s",
     #              target.id, allocdb.allocid)
@@ -757,6 +1415,7 @@ def _run_target(target, preempt):
                 target = ttbl.test_target.get(target_name)
                 with target.lock:
                     target._deallocate_simple(allocdb.allocid)
+                event_post("release", target_name)
             # we still need to allocate targets, maybe boost them
             for target_name, score in targets_to_boost.items():
                 _target_starvation_recalculate(allocdb, target, score)
@@ -1058,6 +1717,8 @@ def request(groups, calling_user, obo_user, guests,
     allocdb.set("priority", priority)
     allocdb.set("user", obo_user)
     allocdb.set("creator", calling_user.get_id())
+    _index_add("user", obo_user, allocid)
+    _index_add("user", calling_user.get_id(), allocid)
     if endtime != None:
         allocdb.set("endtime", endtime)
     if reason:
@@ -1090,8 +1751,8 @@ def request(groups, calling_user, obo_user, guests,
     # Add waiting record to each target; maybe we add
     #
     #
-    # on each target, enter in the queue a link to the timestamp file;
-    # name it PRIORITY-TIMESTAMP-FLAGS-ALLOCID
+    # on each target, enter in the queue (see _waiter_queue_c) a
+    # waiter PRIORITY-TIMESTAMP-FLAGS-ALLOCID
     #
     # PRIORITY is what help us short who will get it first; highest
     # (0) wins, always 6 characters -- 0-999 * 1000 is the user given
@@ -1136,9 +1797,7 @@ def request(groups, calling_user, obo_user, guests,
         # so besides the second level granularity timestamp (which is
         # not enough), add the allocation ID -- since there will be
         # ONE entry per allocation ID only.
-        target.fsdb.set(
-            "_alloc.queue.%06d-%s-%s-%s" % (priority, ts, flags, allocid),
-            allocid)
+        _waiter_queue_get(target).add(priority, ts, flags, allocid)
 
     _run(targets_all.values(), preempt)
 
@@ -1162,22 +1821,56 @@ def request(groups, calling_user, obo_user, guests,
     if state == 'active':
         # group_allocated set in calculate_stuff()
         result['group_allocated'] = allocdb.get("group_allocated")
+    # let the scheduler know, so it tracks when it expires
+    event_post("request", allocid)
     return result
 
 
-def query(calling_user):
+def query(calling_user, state = None):
+    """
+    Return the allocations a user can see
+
+    :param ttbl.user_control.User calling_user: user asking; admins
+      see all the allocations, other users those they are the user,
+      creator or a guest of plus those whose database is invalid
+    :param str state: (optional) return only allocations in this state
+    :returns dict: dictionary of allocation data (see
+      :meth:`allocation_c.to_dict`) keyed by allocation ID
+    """
     assert isinstance(calling_user, ttbl.user_control.User)
+    assert state == None or state in states, \
+        f"state: unknown state '{state}'"
+    # allocid -> index it was found in (None if not from an index)
+    if calling_user.is_admin():
+        if state == None:
+            allocids = dict.fromkeys(os.listdir(path))
+        else:
+            index = ( "state", state )
+            allocids = dict.fromkeys(_index_list(*index), index)
+    else:
+        # everyone sees the allocations whose database is invalid
+        index = ( "state", "invalid" )
+        allocids = dict.fromkeys(_index_list(*index), index)
+        index = ( "user", calling_user.get_id() )
+        allocids.update(dict.fromkeys(_index_list(*index), index))
     result = {}
-    for _rootname, allocids, _filenames in os.walk(path):
-        for allocid in allocids:
-            try:
-                allocdb = get_from_cache(allocid)
-                if not allocdb.check_query_permission(calling_user):
-                    continue
-                result[allocid] = allocdb.to_dict()
-            except allocation_c.invalid_e:
-                result[allocid] = { "state" : "invalid" }
-        return result	# only want the toplevel, thanks
+    for allocid, index in allocids.items():
+        try:
+            allocdb = get_from_cache(allocid)
+            if index == ( "state", "invalid" ):
+                _index_remove(*index, allocid)	# valid again
+            if not allocdb.check_query_permission(calling_user):
+                continue	# ID collision or stale guest entry
+            d = allocdb.to_dict()
+        except allocation_c.invalid_e:
+            if index and not os.path.isdir(os.path.join(path, allocid)):
+                _index_remove(*index, allocid)	# stale entry
+                continue
+            d = { "state" : "invalid" }
+        if state != None and d['state'] != state:
+            continue
+        result[allocid] = d
+    return result
 
 
 def get(allocid, calling_user):
@@ -1191,6 +1884,24 @@ def get(allocid, calling_user):
     return allocdb.to_dict()
 
 
+def _keepalive(allocdb, expected_state, calling_user):
+    # read all the fields we need in one go, instead of one by one
+    d = allocdb.get_as_dict("user", "creator", "state", "group_allocated")
+    userid = calling_user.get_id()
+    if userid != d.get("user", None) and userid != d.get("creator", None) \
+       and not calling_user.is_admin():
+        # guests are *NOT* allowed to keepalive
+        return dict(state = "rejected", _message = states['rejected'])
+
+    allocdb.timestamp()				# first things first
+    state = d.get('state', None)
+    r = dict(state = state)
+    if state == "active" and expected_state != 'active':
+        # set in calculate_stuff()
+        r['group_allocated'] = d.get("group_allocated", None)
+    return r
+
+
 def keepalive(allocid, expected_state, _pressure, calling_user):
     """
     :param int pressure: how my system is doing so I might be able or
@@ -1206,20 +1917,62 @@ def keepalive(allocid, expected_state, _pressure, calling_user):
         allocdb = get_from_cache(allocid)
     except allocation_c.invalid_e:
         return dict(state = "invalid", _message = states['invalid'])
-    if not allocdb.check_user_is_creator_admin(calling_user):
-        # guests are *NOT* allowed to keepalive
-        return dict(state = "rejected", _message = states['rejected'])
+    return _keepalive(allocdb, expected_state, calling_user)
 
-    allocdb.timestamp()				# first things first
-    state = allocdb.state_get()
-    r = dict(state = state)
-    if state == "active" and expected_state != 'active':
-        # set in calculate_stuff()
-        r['group_allocated'] = allocdb.get("group_allocated")
-    return r
+
+#: Maximum number of allocations a :func:`keepalive_many` call
+#: will refresh in parallel
+keepalive_threads = 8
+
+def keepalive_many(expected_states, pressure, calling_user):
+    """
+    Keepalive multiple allocations
+
+    Same as calling :func:`keepalive` for each allocation, but
+    loading them all first and then refreshing them in parallel
+    (each allocation's record is independent from the others).
+
+    :param dict expected_states: dictionary keyed by allocation ID
+      of the state the caller expects each allocation to be in
+    :param int pressure: see :func:`keepalive`
+    :param ttbl.user_control.User calling_user: user doing the call
+
+    :returns dict: dictionary keyed by allocation ID of what
+      :func:`keepalive` returns for it
+    """
+    assert isinstance(calling_user, ttbl.user_control.User), \
+        "calling_user is unexpected type %s" % type(calling_user)
+    result = {}
+    allocdbs = {}
+    # the allocation cache is not thread safe, so load them all
+    # first from here
+    for allocid in expected_states:
+        try:
+            allocdbs[allocid] = get_from_cache(allocid)
+        except allocation_c.invalid_e:
+            result[allocid] = dict(state = "invalid",
+                                   _message = states['invalid'])
+
+    if len(allocdbs) < 2 or keepalive_threads < 2:
+        for allocid, allocdb in allocdbs.items():
+            result[allocid] = _keepalive(allocdb, expected_states[allocid],
+                                         calling_user)
+        return result
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers = min(len(allocdbs), keepalive_threads),
+            thread_name_prefix = "keepalive") as executor:
+        futures = {
+            allocid: executor.submit(_keepalive, allocdb,
+                                     expected_states[allocid], calling_user)
+            for allocid, allocdb in allocdbs.items()
+        }
+        for allocid, future in futures.items():
+            result[allocid] = future.result()
+    return result
 
 def _idle_power_off(target, calling_user,
-                    idle_power_off, idle_power_fully_off):
+                    idle_power_off, idle_power_fully_off, ts = None):
     assert isinstance(target, ttbl.test_target)
     assert isinstance(idle_power_off, int)
     assert isinstance(idle_power_fully_off, int)
@@ -1228,7 +1981,8 @@ def _idle_power_off(target, calling_user,
     # allocating it will update the timestamp; then allocate it and
     # get its power state; turn it off it it has been on for too
     # long
-    ts = target.timestamp_get()
+    if ts == None:
+        ts = target.timestamp_get()
 
     r = request(
         { "target": [ target.id ] },
@@ -1269,17 +2023,18 @@ def _idle_power_off(target, calling_user,
     finally:
         allocdb.delete("removed")
 
-def _maintain_released_target(target, calling_user):
-    # a target that is released is not being used, so we power it all
-    # off...unless it is configured to be left on
+def _idle_power_limits(target):
+    # return ( IDLE_POWER_OFF, IDLE_POWER_FULLY_OFF ), seconds after
+    # which a released target has to be powered off (0 to disable)
+    # or None if it doesn't have to be powered off at all
     if not hasattr(target, "power"):	# does it have power control?
-        return
+        return None
 
     # configured to be left on? okie
     skip_cleanup = target.property_get('skip_cleanup', False)
     if skip_cleanup:
         target.log.debug("ALLOC: skiping powering off, skip_cleanup defined")
-        return
+        return None
 
     idle_power_off = target.property_get(
         'idle_power_off',
@@ -1292,8 +2047,150 @@ def _maintain_released_target(target, calling_user):
         'idle_power_fully_off',
         ttbl.config.target_max_idle_power_fully_off)
     if idle_power_off > 0 or idle_power_fully_off > 0:
-        _idle_power_off(target, calling_user,
-                        idle_power_off, idle_power_fully_off)
+        return idle_power_off, idle_power_fully_off
+    return None
+
+def _maintain_released_target(target, calling_user, ts = None):
+    # a target that is released is not being used, so we power it all
+    # off...unless it is configured to be left on
+    limits = _idle_power_limits(target)
+    if limits:
+        _idle_power_off(target, calling_user, limits[0], limits[1], ts = ts)
+
+
+#: Number of threads to maintain targets with
+#:
+#: Checking if a released target has to be powered off for being
+#: idle can take long (eg: talking to PDUs, running power sequences),
+#: so :func:`maintenance` and :class:`scheduler_c` do it on up to
+#: this many targets in parallel.
+maintenance_threads = 16
+
+#: Maximum time the maintenance of a single target can take (seconds)
+#:
+#: After this, the maintenance pass stops waiting for the target and
+#: finishes with the rest; its maintenance is left running in the
+#: background and the target is skipped by later passes until done.
+maintenance_target_budget = 60
+
+#: Statistics of the last maintenance pass (see :func:`maintenance`)
+maintenance_stats = {}
+
+_maintenance_executor = None
+_maintenance_lock = threading.Lock()
+# TARGETNAME -> timestamp its maintenance started, for those whose
+# maintenance is queued (timestamp None) or running
+_maintenance_in_flight = {}
+
+def _maintenance_overbudget_done(target_id, ts_start, future):
+    # Called when a target's maintenance we left running in the
+    # background (see _maintenance_run()) finishes, so its outcome
+    # is not lost
+    duration = time.time() - ts_start
+    e = future.exception()
+    if e:
+        logging.error("%s: maintenance left running in the background"
+                      " failed after %.2fs: %s", target_id, duration, e,
+                      exc_info = e)
+    else:
+        logging.warning("%s: maintenance left running in the background"
+                        " finished after %.2fs", target_id, duration)
+
+
+def _maintenance_run(targets, fn, keepalive_fn = None,
+                     keepalive_period = 1):
+    # Run fn(target) for each target in a bounded pool of threads;
+    # return ( STATS, UNFINISHED ), where UNFINISHED is the set of
+    # names of the targets whose maintenance didn't finish (running
+    # over budget, skipped because still running from a previous
+    # pass or cancelled because the pool is full of those)
+    #
+    # The pool is not shut down after each pass, since threads
+    # running over budget are left to finish on their own (there is
+    # no way to interrupt them)
+    global _maintenance_executor
+    ts_start = time.time()
+    stats = collections.Counter()
+    unfinished = set()
+
+    def _fn(target):
+        with _maintenance_lock:
+            _maintenance_in_flight[target.id] = time.time()
+        try:
+            fn(target)
+        finally:
+            with _maintenance_lock:
+                del _maintenance_in_flight[target.id]
+
+    pending = {}
+    with _maintenance_lock:
+        if _maintenance_executor == None:
+            _maintenance_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers = maintenance_threads,
+                thread_name_prefix = "maintenance")
+        for target in targets:
+            stats['targets'] += 1
+            if target.id in _maintenance_in_flight:
+                stats['skipped'] += 1
+                unfinished.add(target.id)
+                continue
+            _maintenance_in_flight[target.id] = None
+            pending[_maintenance_executor.submit(_fn, target)] = target
+
+    while pending:
+        # keepalive while waiting, some targets might take a long time
+        if keepalive_fn:
+            keepalive_fn()
+        done, _ = concurrent.futures.wait(
+            pending, timeout = keepalive_period,
+            return_when = concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            target = pending.pop(future)
+            try:
+                future.result()
+                stats['done'] += 1
+            except Exception as e:
+                stats['errors'] += 1
+                logging.exception("%s: exception in cleanup: %s",
+                                  target.id, e)
+        ts_now = time.time()
+        with _maintenance_lock:
+            overbudget = 0
+            for ts in _maintenance_in_flight.values():
+                if ts != None and ts_now - ts > maintenance_target_budget:
+                    overbudget += 1
+            for future, target in list(pending.items()):
+                ts = _maintenance_in_flight.get(target.id, None)
+                if ts != None and ts_now - ts > maintenance_target_budget:
+                    logging.error(
+                        "%s: maintenance taking more than %ss, leaving"
+                        " it running in the background",
+                        target.id, maintenance_target_budget)
+                    stats['overbudget'] += 1
+                    future.add_done_callback(
+                        lambda future, target_id = target.id, ts = ts:
+                        _maintenance_overbudget_done(target_id, ts, future))
+                elif ts == None and overbudget >= maintenance_threads \
+                     and future.cancel():
+                    # all the threads are stuck with targets over
+                    # budget, this would never start
+                    del _maintenance_in_flight[target.id]
+                    stats['cancelled'] += 1
+                else:
+                    continue
+                del pending[future]
+                unfinished.add(target.id)
+
+    stats['duration'] = time.time() - ts_start
+    if stats['overbudget'] or stats['cancelled'] or stats['skipped']:
+        log_fn = logging.warning
+    else:
+        # runs every few seconds, only worth noting when not smooth
+        log_fn = logging.debug
+    log_fn("ALLOC: maintained %(targets)d targets in %(duration).2fs"
+           " (%(errors)d errors, %(overbudget)d over budget,"
+           " %(skipped)d skipped, %(cancelled)d cancelled)", stats)
+    return stats, unfinished
 
 
 def maintenance(ts_now, calling_user, keepalive_fn = None):
@@ -1307,9 +2204,14 @@ def maintenance(ts_now, calling_user, keepalive_fn = None):
     # - increase effective priorities to avoid starvation
     # - when priorities change, maybe reassign ownerships if
     #   preemption
+    #
+    # returns a dict with the statistics of the pass (also kept in
+    # maintenance_stats): *duration* (seconds), *targets*, *done*,
+    # *errors*, *overbudget*, *skipped* and *cancelled*
     #logging.error("DEBUG: maint %s", ts_now)
     assert isinstance(calling_user, ttbl.user_control.User)
     assert keepalive_fn == None or callable(keepalive_fn)
+    ts_start = time.time()
 
     # allocations: run maintenance (expire, check overtimes)
     for _rootname, allocids, _filenames in os.walk(path):
@@ -1322,24 +2224,287 @@ def maintenance(ts_now, calling_user, keepalive_fn = None):
         break	# only want the toplevel, thanks
 
     # targets: starvation control, check overtimes
-    for target in ttbl.test_target.known_targets():
-        # FIXME: paralellize
-        # Always keepalive first in case someting crashes and we need to skip
-        if keepalive_fn:   	# run keepalives in between targets..
-            keepalive_fn()	# ... some targets might take a long time
-        try:
-            owner = target.owner_get()
-            if owner:
-                _target_starvation_recalculate(None, target, 0)
-            else:
-                _maintain_released_target(target, calling_user)
-        except Exception as e:
-            logging.exception("%s: exception in cleanup: %s\n"
-                              % (target.id, e))
-            # fallthrough, continue running other targets
+    def _maintain_target(target):
+        owner = target.owner_get()
+        if owner:
+            _target_starvation_recalculate(None, target, 0)
+        else:
+            _maintain_released_target(target, calling_user)
+
+    # in parallel, since some targets might take a long time; one
+    # that hangs doesn't block the rest
+    stats, _unfinished = _maintenance_run(
+        ttbl.test_target.known_targets(), _maintain_target, keepalive_fn)
 
     # Finally, do an schedule run on all the targets, see what has to move
     _run(ttbl.test_target.known_targets(), False)
+    stats['duration'] = time.time() - ts_start
+    global maintenance_stats
+    maintenance_stats = dict(stats)
+    return maintenance_stats
+
+
+class scheduler_c:
+    """
+    Event driven allocation scheduler
+
+    Instead of periodically scanning all the allocations and targets
+    (as :func:`maintenance` does), keep a priority queue of the
+    deadlines at which something might have to be done:
+
+    - allocations: when they might expire, time out for being idle
+      or go overtime (see :meth:`allocation_c.deadline_get`)
+
+    - released targets: when they have to be powered off for being
+      idle (see :data:`ttbl.config.target_max_idle` and
+      :data:`ttbl.config.target_max_idle_power_fully_off`)
+
+    and act on the events posted with :func:`event_post` (new
+    allocations, released targets), looking only at the allocations
+    and targets affected.
+
+    Keepalives don't post events, as they are very frequent; when an
+    allocation's deadline is reached, :meth:`allocation_c.maintenance`
+    checks if it was kept alive in the meantime and if so, a new
+    deadline is calculated.
+
+    Everything is scanned only once, in :meth:`init`; from there on
+    call :meth:`tick` in a loop.
+
+    :param ttbl.user_control.User calling_user: user to use when
+      allocating targets (eg: to power them off)
+    :param callable keepalive_fn: (optional) function to call in
+      between operations that might take long (eg: to keep a watchdog
+      happy)
+    """
+    def __init__(self, calling_user, keepalive_fn = None):
+        assert isinstance(calling_user, ttbl.user_control.User)
+        assert keepalive_fn == None or callable(keepalive_fn)
+        self.calling_user = calling_user
+        self.keepalive_fn = keepalive_fn
+        # heap of ( TIMESTAMP, KIND, NAME ); entries are not removed
+        # when a deadline is changed, so those that don't match
+        # self.deadlines are ignored
+        self.deadline_heap = []
+        # ( KIND, NAME ) -> TIMESTAMP
+        self.deadlines = {}
+        # TARGETNAME -> timestamp the target has been idle since
+        self.targets_idle = {}
+        self.watch = None
+        #: Count of operations done, by type (*events*,
+        #: *allocation_checks*, *target_runs*, *target_power_checks*,
+        #: *target_power_unfinished*)
+        self.stats = collections.Counter()
+
+    def _keepalive(self):
+        if self.keepalive_fn:
+            self.keepalive_fn()
+
+    def deadline_set(self, kind, name, ts):
+        """
+        Set or clear the deadline for an allocation or target
+
+        :param str kind: *allocation* or *target*
+        :param str name: allocation ID or target name
+        :param float ts: time (seconds since the epoch); *None* to
+          clear it
+        """
+        key = ( kind, name )
+        if ts == None:
+            self.deadlines.pop(key, None)
+            return
+        self.deadlines[key] = ts
+        heapq.heappush(self.deadline_heap, ( ts, kind, name ))
+
+    def deadline_next(self):
+        """
+        :returns float: time of the next deadline (seconds since the
+          epoch); *None* if there are none
+        """
+        while self.deadline_heap:
+            ts, kind, name = self.deadline_heap[0]
+            if self.deadlines.get(( kind, name ), None) == ts:
+                return ts
+            heapq.heappop(self.deadline_heap)	# changed since
+        return None
+
+    def _allocation_track(self, allocid, ts_now):
+        try:
+            deadline = get_from_cache(allocid).deadline_get()
+        except allocation_c.invalid_e:
+            deadline = None
+        if deadline != None and deadline <= ts_now:
+            # we already acted on it and it decided there was nothing
+            # to do (eg: timestamps are only accurate to the second);
+            # don't loop on it
+            deadline = ts_now + 1
+        self.deadline_set("allocation", allocid, deadline)
+
+    @staticmethod
+    def _target_deadline(ts, limits, ts_after):
+        # time when a target idle since ts has to be checked next for
+        # powering off, after ts_after (if not None); _idle_power_off()
+        # acts when idle for more than the limit
+        ts_idle = time.mktime(time.strptime(ts, "%Y%m%d%H%M%S"))
+        deadlines = [
+            ts_idle + limit + 1 for limit in limits
+            if limit > 0 and ( ts_after == None
+                               or ts_idle + limit + 1 > ts_after )
+        ]
+        if deadlines:
+            return min(deadlines)
+        return None
+
+    def _target_track(self, target):
+        # if the target is released, arm its deadline for powering off
+        limits = None
+        if not target.owner_get():
+            limits = _idle_power_limits(target)
+        if limits == None:
+            self.targets_idle.pop(target.id, None)
+            self.deadline_set("target", target.id, None)
+            return
+        ts = target.timestamp_get()
+        self.targets_idle[target.id] = ts
+        self.deadline_set("target", target.id,
+                          self._target_deadline(ts, limits, None))
+
+    def init(self):
+        """
+        Scan all the allocations and targets and set their deadlines
+
+        Also run the scheduler on each target, in case something was
+        missed while the daemon was not running.
+        """
+        ts_now = time.time()
+        for allocid in os.listdir(path):
+            if os.path.isdir(os.path.join(path, allocid)):
+                self._allocation_track(allocid, ts_now)
+        for target in ttbl.test_target.known_targets():
+            self._keepalive()
+            try:
+                _run_target(target, False)
+                self._target_track(target)
+            except Exception as e:
+                logging.exception("%s: exception in scheduler: %s",
+                                  target.id, e)
+        self.watch = commonl.dir_watch_c(events_path)
+
+    def _event_process(self, kind, name):
+        self.stats['events'] += 1
+        if kind == "request":
+            self._allocation_track(name, time.time())
+        elif kind == "release":
+            target = ttbl.test_target.get(name)
+            if target == None:
+                return
+            self.stats['target_runs'] += 1
+            _run_target(target, False)
+            self._target_track(target)
+        else:
+            logging.error("ALLOC: %s:%s: ignoring unknown event", kind, name)
+
+    def _deadline_process(self, kind, name, ts_now, targets_check):
+        if kind == "allocation":
+            try:
+                allocdb = get_from_cache(name)
+            except allocation_c.invalid_e:
+                return
+            self.stats['allocation_checks'] += 1
+            # this might remove it, which releases its targets
+            allocdb.maintenance(datetime.datetime.now())
+            self._allocation_track(name, ts_now)
+            return
+        # kind == target
+        target = ttbl.test_target.get(name)
+        ts = self.targets_idle.pop(name, None)
+        if target == None or ts == None or target.owner_get():
+            return	# if in use, we'll get an event when released
+        limits = _idle_power_limits(target)
+        if limits == None:
+            return
+        self.stats['target_power_checks'] += 1
+        # checked in parallel with the rest, see _targets_check()
+        targets_check[name] = ( target, ts, limits )
+
+    def _targets_check(self, targets_check, ts_now):
+        # power off the targets in targets_check that have been idle
+        # for too long
+
+        def _target_check(target):
+            _target, ts, _limits = targets_check[target.id]
+            # _idle_power_off() allocates the target to check its
+            # power; don't get events from that
+            with _events_muted():
+                _maintain_released_target(target, self.calling_user,
+                                          ts = ts)
+
+        _stats, unfinished = _maintenance_run(
+            [ target for target, _ts, _limits in targets_check.values() ],
+            _target_check, self.keepalive_fn)
+        self.stats['target_power_unfinished'] += len(unfinished)
+        for name, ( _target, ts, limits ) in targets_check.items():
+            if name in unfinished:
+                # still at it, check again later
+                deadline = ts_now + maintenance_target_budget
+            else:
+                deadline = self._target_deadline(ts, limits, ts_now)
+            if deadline != None:
+                self.targets_idle[name] = ts
+                self.deadline_set("target", name, deadline)
+
+    def tick(self, timeout):
+        """
+        Process the pending events and deadlines
+
+        If there are none, wait up to *timeout* seconds for new events
+        or for the next deadline to be reached.
+
+        :param float timeout: maximum time to wait (seconds)
+        :returns collections.Counter: operations done (see
+          :data:`stats`)
+        """
+        stats = collections.Counter(self.stats)
+        ts_end = time.time() + timeout
+        while True:
+            self._keepalive()
+            done = False
+            for kind, name in _events_read():
+                done = True
+                try:
+                    self._event_process(kind, name)
+                except Exception as e:
+                    logging.exception("ALLOC: %s:%s: exception processing"
+                                      " event: %s", kind, name, e)
+                self._keepalive()
+            ts_now = time.time()
+            targets_check = {}
+            while True:
+                ts = self.deadline_next()
+                if ts == None or ts > ts_now:
+                    break
+                _, kind, name = heapq.heappop(self.deadline_heap)
+                del self.deadlines[( kind, name )]
+                done = True
+                try:
+                    self._deadline_process(kind, name, ts_now,
+                                           targets_check)
+                except Exception as e:
+                    logging.exception("ALLOC: %s:%s: exception processing"
+                                      " deadline: %s", kind, name, e)
+                self._keepalive()
+            if targets_check:
+                self._targets_check(targets_check, ts_now)
+            if done:
+                break
+            remaining = ts_end - time.time()
+            if remaining <= 0:
+                break
+            ts = self.deadline_next()
+            if ts != None:
+                remaining = min(remaining, max(0, ts - time.time()))
+            self.watch.wait(remaining)
+        return self.stats - stats
 
 
 def delete(allocid, calling_user):
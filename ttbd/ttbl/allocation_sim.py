@@ -0,0 +1,504 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Allocation scheduler simulator
+------------------------------
+
+Replay a trace of allocation requests, keepalives and releases against
+the allocator (:mod:`ttbl.allocation`) on a fleet of simulated
+targets (:class:`ttbl.test_target` with :class:`ttbl.power.fake_c`
+power control), to measure how it behaves with big fleets and long
+queues without hardware or a server running; see
+*ttbd-allocation-sim*::
+
+  $ ttbd-allocation-sim --targets 1000 --requests 10000 --json > before.json
+  $ ttbd-allocation-sim --targets 1000 --requests 10000 --json > after.json
+
+The trace is a list of events, one JSON dictionary per line, sorted
+by *time* (in simulated seconds):
+
+- *{ "time": T, "op": "request", "name": NAME, "groups": { GROUP:
+  [ TARGET, ...], ... }, "duration": D, "priority": P, "patience":
+  W, "user": USER }*: request an allocation (*NAME* identifies it in
+  the trace) for *USER*; once active, it is released *D* seconds
+  later (unless there is a *release* event for it before). If still
+  queued after *W* seconds, it is released, as a client would give
+  up. *priority*, *patience* and *user* are optional.
+
+- *{ "time": T, "op": "release", "name": NAME }*: release the
+  allocation (or cancel it, if still queued)
+
+- *{ "time": T, "op": "keepalive" }*: send a keepalive for all the
+  current allocations (as clients do periodically)
+
+Events are run one after another, as fast as possible, and the time
+each allocator call takes is measured; simulated time is only used to
+order the events and to compute the queue wait and utilisation
+metrics and as the clock for backfill (see
+:data:`ttbl.allocation.backfill`). The allocator still uses the real
+time for the allocation timestamps.
+
+The simulator takes over the process' allocator and target state
+(:data:`ttbl.config.targets`, :data:`ttbl.test_target.state_path`,
+:data:`ttbl.allocation.path`...); it is meant to be run on its own.
+"""
+import collections
+import contextlib
+import heapq
+import json
+import os
+import random
+import time
+
+import commonl
+import ttbl
+import ttbl.allocation
+import ttbl.config
+import ttbl.power
+import ttbl.user_control
+
+# ( KIND, "wait"|"hold" ) -> list of seconds, filled by _lock_timed_c
+_lock_stats = collections.defaultdict(list)
+
+class _lock_timed_c(ttbl.process_posix_file_lock_c):
+    # records each time it takes to acquire the lock and it is held
+    # (ttbl.lock_stats only keeps totals and we want percentiles), by
+    # kind of lock (allocation or target); replaces
+    # ttbl.process_posix_file_lock_c while simulating, see
+    # _locks_timed()
+
+    def __init__(self, lockfile, *args, **kwargs):
+        super().__init__(lockfile, *args, **kwargs)
+        self.kind = "allocation" if self.name == "allocation" else "target"
+        self.ts_acquired = None
+
+    def acquire(self):
+        ts0 = time.perf_counter()
+        super().acquire()
+        self.ts_acquired = time.perf_counter()
+        _lock_stats[self.kind, "wait"].append(self.ts_acquired - ts0)
+
+    def release(self):
+        if self.ts_acquired != None:
+            _lock_stats[self.kind, "hold"].append(
+                time.perf_counter() - self.ts_acquired)
+            self.ts_acquired = None
+        super().release()
+
+@contextlib.contextmanager
+def _locks_timed():
+    # the targets and allocations create their locks with
+    # ttbl.process_posix_file_lock_c
+    lock_class = ttbl.process_posix_file_lock_c
+    try:
+        ttbl.process_posix_file_lock_c = _lock_timed_c
+        yield
+    finally:
+        ttbl.process_posix_file_lock_c = lock_class
+
+
+def percentiles(values, percentiles_list = ( 50, 90, 99 )):
+    """
+    Summarize a list of values
+
+    :param list values: numbers to summarize
+    :param list percentiles_list: (optional) percentiles to compute
+    :returns dict: with fields *count*, *mean*, *max* and *pN* for
+      each percentile (nearest rank); empty if there are no values
+    """
+    if not values:
+        return {}
+    values = sorted(values)
+    count = len(values)
+    r = dict(count = count, mean = sum(values) / count, max = values[-1])
+    for percentile in percentiles_list:
+        index = max(0, -(-percentile * count // 100) - 1)
+        r[f"p{percentile}"] = values[index]
+    return r
+
+
+def trace_synthetic(target_names, requests, group_size = 1,
+                    arrival_rate = 10.0, duration_mean = 60.0,
+                    keepalive_period = 5.0, patience = 0,
+                    large_share = 0.0, large_group_size = 4,
+                    large_duration_mean = None, seed = 0):
+    """
+    Generate a synthetic trace
+
+    :param list(str) target_names: names of the targets to request
+    :param int requests: number of allocation requests
+    :param int group_size: (optional) number of targets each
+      allocation requests (picked at random)
+    :param float arrival_rate: (optional) average number of requests
+      per (simulated) second; requests arrive as a Poisson process
+    :param float duration_mean: (optional) average number of seconds
+      an allocation keeps the targets once active (exponentially
+      distributed)
+    :param float keepalive_period: (optional) seconds between
+      keepalives (0 to disable)
+    :param float patience: (optional) seconds after which requests
+      that are still queued are released (0 to wait forever)
+    :param float large_share: (optional) fraction of the requests
+      (0 to 1) that are *large*: they request *large_group_size*
+      targets for *large_duration_mean* seconds on average (by
+      default, the same as *duration_mean*) and are made by user
+      *sim-large*, so their durations are accounted separately for
+      backfill
+    :param int seed: (optional) random seed, so the same trace can be
+      generated again
+    :returns list(dict): trace, as described in
+      :mod:`ttbl.allocation_sim`
+    """
+    assert group_size <= len(target_names), \
+        f"group_size: {group_size} bigger than number of targets" \
+        f" {len(target_names)}"
+    assert large_share == 0 or large_group_size <= len(target_names), \
+        f"large_group_size: {large_group_size} bigger than number of" \
+        f" targets {len(target_names)}"
+    if large_duration_mean == None:
+        large_duration_mean = duration_mean
+    rng = random.Random(seed)
+    trace = []
+    ts = 0.0
+    for count in range(requests):
+        ts += rng.expovariate(arrival_rate)
+        if large_share > 0 and rng.random() < large_share:
+            trace.append(dict(
+                time = ts, op = "request", name = f"r{count}",
+                groups = {
+                    "group": rng.sample(target_names, large_group_size)
+                },
+                duration = rng.expovariate(1 / large_duration_mean),
+                user = "sim-large"))
+        else:
+            trace.append(dict(
+                time = ts, op = "request", name = f"r{count}",
+                groups = { "group": rng.sample(target_names, group_size) },
+                duration = rng.expovariate(1 / duration_mean)))
+        if patience > 0:
+            trace[-1]['patience'] = patience
+    if keepalive_period > 0:
+        ts_end = ts
+        ts = keepalive_period
+        while ts < ts_end:
+            trace.append(dict(time = ts, op = "keepalive"))
+            ts += keepalive_period
+        trace.sort(key = lambda event: event['time'])
+    return trace
+
+
+def trace_load(filename):
+    """
+    Load a trace from a file
+
+    :param str filename: name of the file; one JSON dictionary per line
+      (see :mod:`ttbl.allocation_sim`)
+    :returns list(dict): trace
+    """
+    trace = []
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                trace.append(json.loads(line))
+    return trace
+
+
+def trace_save(filename, trace):
+    """
+    Save a trace to a file, one JSON dictionary per line
+
+    :param str filename: name of the file
+    :param list(dict) trace: trace
+    """
+    with open(filename, "w") as f:
+        for event in trace:
+            f.write(json.dumps(event) + "\n")
+
+
+def trace_target_names(trace):
+    """
+    Return the names of the targets a trace uses
+
+    :param list(dict) trace: trace
+    :returns list(str): target names, sorted
+    """
+    target_names = set()
+    for event in trace:
+        for group in event.get('groups', {}).values():
+            target_names.update(group)
+    return sorted(target_names)
+
+
+class simulator_c:
+    """
+    Simulate a fleet of targets and replay traces against the
+    allocator
+
+    :param list(str) target_names: names of the targets to create
+    :param str state_dir: directory where to keep the allocator and
+      target state (will be created)
+
+    >>> sim = ttbl.allocation_sim.simulator_c(
+    >>>     [ f"t{i}" for i in range(100) ], "/tmp/sim")
+    >>> trace = ttbl.allocation_sim.trace_synthetic(sim.target_names, 1000)
+    >>> metrics = sim.run(trace)
+    """
+    def __init__(self, target_names, state_dir):
+        self.target_names = list(target_names)
+        self.state_dir = state_dir
+        commonl.makedirs_p(state_dir)
+        ttbl.test_target.state_path = os.path.join(state_dir, "targets")
+        ttbl.allocation.path = os.path.join(state_dir, "allocations")
+        ttbl.allocation.init(state_dir)
+        ttbl.allocation._waiter_queues.clear()
+        # no scheduler runs, so there is no one to consume the events
+        ttbl.config.allocation_scheduler_events = False
+        ttbl.user_control.User.state_dir = os.path.join(state_dir, "users")
+        ttbl.user_control.User.state_dir_secondary = \
+            ttbl.user_control.User.state_dir
+        self.user = ttbl.user_control.User("sim")
+        ttbl.config.targets.clear()
+        with _locks_timed():
+            for target_name in self.target_names:
+                target = ttbl.test_target(target_name)
+                target.acquirer = ttbl.symlink_acquirer_c(target)
+                target.interface_add(
+                    "power", ttbl.power.interface(ttbl.power.fake_c()))
+                ttbl.config.targets[target_name] = target
+        self._reset()
+
+    def _reset(self):
+        # NAME -> dict(allocid, target_names, duration, ts_request,
+        # ts_start, targets_held)
+        self.allocations = {}
+        self.allocids = {}		# ALLOCID -> NAME
+        self.events = []		# heap ( TIME, SEQUENCE, EVENT )
+        self.sequence = 0
+        self.latencies = collections.defaultdict(list)
+        self.waits = []
+        self.busy = 0.0			# target-seconds
+        self.rejected = 0
+        self.cancelled = 0
+        self.given_up = 0
+        self.ts = 0.0
+
+    def _event_push(self, ts, event):
+        heapq.heappush(self.events, ( ts, self.sequence, event ))
+        self.sequence += 1
+
+    def _call(self, kind, fn, *args, **kwargs):
+        ts0 = time.perf_counter()
+        r = fn(*args, **kwargs)
+        self.latencies[kind].append(time.perf_counter() - ts0)
+        return r
+
+    def _started(self, name):
+        # the allocation became active, record the wait and schedule
+        # its release
+        allocation = self.allocations[name]
+        allocation['ts_start'] = self.ts
+        self.waits.append(self.ts - allocation['ts_request'])
+        allocdb = ttbl.allocation.get_from_cache(allocation['allocid'])
+        allocation['targets_held'] = \
+            len(allocdb.get("group_allocated").split(","))
+        duration = allocation['duration']
+        if duration != None:
+            self._event_push(self.ts + duration,
+                             dict(op = "release", name = name))
+
+    def _owners_check(self, target_names):
+        # after targets were released, see which allocations got them
+        # and are now complete
+        for target_name in target_names:
+            target = ttbl.config.targets[target_name]
+            name = self.allocids.get(target.allocid_get_bare(), None)
+            if name == None:
+                continue
+            allocation = self.allocations[name]
+            if allocation['ts_start'] != None:
+                continue
+            allocdb = ttbl.allocation.get_from_cache(allocation['allocid'])
+            if allocdb.state_get() == "active":
+                self._started(name)
+
+    def _request(self, event):
+        name = event['name']
+        r = self._call("request", ttbl.allocation.request,
+                       event['groups'], self.user,
+                       event.get('user', self.user.get_id()), [],
+                       priority = event.get('priority', None), queue = True)
+        if r['state'] not in ( "active", "queued" ):
+            self.rejected += 1
+            return
+        target_names = set()
+        for group in event['groups'].values():
+            target_names.update(group)
+        self.allocations[name] = dict(
+            allocid = r['allocid'], target_names = target_names,
+            duration = event.get('duration', None),
+            ts_request = self.ts, ts_start = None, targets_held = 0)
+        self.allocids[r['allocid']] = name
+        if r['state'] == "active":
+            self._started(name)
+        elif event.get('patience', None):
+            self._event_push(self.ts + event['patience'],
+                             dict(op = "give_up", name = name))
+
+    def _release(self, event):
+        allocation = self.allocations.pop(event['name'], None)
+        if allocation == None:
+            return		# rejected or already released
+        del self.allocids[allocation['allocid']]
+        self._call("release", ttbl.allocation.delete,
+                   allocation['allocid'], self.user)
+        if allocation['ts_start'] == None:
+            self.cancelled += 1
+        else:
+            self.busy += allocation['targets_held'] \
+                * (self.ts - allocation['ts_start'])
+        self._owners_check(allocation['target_names'])
+
+    def _give_up(self, event):
+        allocation = self.allocations.get(event['name'], None)
+        if allocation == None or allocation['ts_start'] != None:
+            return		# released or got it
+        self.given_up += 1
+        self._release(event)
+
+    def _keepalive(self, _event):
+        expected_states = {}
+        for allocation in self.allocations.values():
+            expected_states[allocation['allocid']] = \
+                "queued" if allocation['ts_start'] == None else "active"
+        if expected_states:
+            self._call("keepalive", ttbl.allocation.keepalive_many,
+                       expected_states, 0, self.user)
+
+    def run(self, trace):
+        """
+        Replay a trace
+
+        Allocations still active at the end of the trace are released
+        when their duration expires; those still queued are left
+        (and counted as *pending*).
+
+        :param list(dict) trace: trace to replay (see
+          :mod:`ttbl.allocation_sim`)
+        :returns dict: metrics:
+
+          - *targets*, *requests*: number of targets and requests
+          - *rejected*, *cancelled*, *given_up*, *pending*:
+            requests rejected, released before becoming active (of
+            those, how many because they ran out of patience) or
+            still waiting at the end (eg: deadlocked)
+          - *wall_time*: seconds it took to replay
+          - *throughput*: allocator calls per second of wall time
+          - *latency*: dictionary keyed by call (*request*,
+            *release*, *keepalive*) of statistics of the time each
+            call took (see :func:`percentiles`), in seconds
+          - *queue_wait*: statistics of the simulated seconds
+            allocations waited to become active
+          - *utilisation*: fraction of the simulated time the targets
+            were allocated
+          - *locks*: dictionary keyed by lock kind (*allocation*,
+            *target*) and *wait* or *hold* of statistics of the
+            seconds spent waiting to acquire and holding them
+          - *backfill*: if :data:`ttbl.allocation.backfill` is
+            enabled, :data:`ttbl.allocation.backfill_stats`
+        """
+        self._reset()
+        _lock_stats.clear()
+        ttbl.allocation.backfill_stats.clear()
+        ts_base = time.time()
+        for event in trace:
+            self._event_push(event['time'], event)
+        handlers = dict(request = self._request, release = self._release,
+                        give_up = self._give_up, keepalive = self._keepalive)
+        ts0 = time.perf_counter()
+        clock = ttbl.allocation._time
+        try:
+            ttbl.allocation._time = lambda: ts_base + self.ts
+            with _locks_timed():
+                while self.events:
+                    self.ts, _, event = heapq.heappop(self.events)
+                    handlers[event['op']](event)
+        finally:
+            ttbl.allocation._time = clock
+        wall_time = time.perf_counter() - ts0
+        ts_end = self.ts
+
+        calls = sum(len(latencies) for latencies in self.latencies.values())
+        if ts_end > 0 and self.target_names:
+            utilisation = self.busy / (ts_end * len(self.target_names))
+        else:
+            utilisation = 0
+        return dict(
+            targets = len(self.target_names),
+            requests = sum(1 for event in trace
+                           if event['op'] == "request"),
+            rejected = self.rejected,
+            cancelled = self.cancelled,
+            given_up = self.given_up,
+            pending = len(self.allocations),
+            wall_time = wall_time,
+            throughput = calls / wall_time if wall_time > 0 else 0,
+            latency = {
+                kind: percentiles(latencies)
+                for kind, latencies in self.latencies.items()
+            },
+            queue_wait = percentiles(self.waits),
+            utilisation = utilisation,
+            locks = {
+                f"{kind}.{what}": percentiles(values)
+                for ( kind, what ), values in sorted(_lock_stats.items())
+            },
+            backfill = dict(ttbl.allocation.backfill_stats)
+            if ttbl.allocation.backfill else None,
+        )
+
+
+def metrics_format(metrics):
+    """
+    Format the metrics returned by :meth:`simulator_c.run` for
+    human consumption
+
+    :param dict metrics: metrics
+    :returns str: multi-line text
+    """
+    s = ""
+    s += f"targets:     {metrics['targets']}\n"
+    s += f"requests:    {metrics['requests']}" \
+        f" ({metrics['rejected']} rejected, {metrics['cancelled']} cancelled" \
+        f" [{metrics['given_up']} gave up], {metrics['pending']} pending)\n"
+    s += f"wall time:   {metrics['wall_time']:.2f}s\n"
+    s += f"throughput:  {metrics['throughput']:.1f} calls/s\n"
+    s += f"utilisation: {metrics['utilisation'] * 100:.1f}%\n"
+    if metrics['backfill'] != None:
+        s += "backfill:    " + " ".join(
+            f"{key}={value}"
+            for key, value in sorted(metrics['backfill'].items())) + "\n"
+
+    def _stats(name, stats, unit, scale):
+        if not stats:
+            return f"  {name:20} -\n"
+        return f"  {name:20} n={stats['count']:<7}" \
+            f" mean={stats['mean'] * scale:.2f}{unit}" \
+            f" p50={stats['p50'] * scale:.2f}{unit}" \
+            f" p90={stats['p90'] * scale:.2f}{unit}" \
+            f" p99={stats['p99'] * scale:.2f}{unit}" \
+            f" max={stats['max'] * scale:.2f}{unit}\n"
+
+    s += "queue wait (simulated):\n"
+    s += _stats("wait", metrics['queue_wait'], "s", 1)
+    s += "call latency:\n"
+    for kind, stats in sorted(metrics['latency'].items()):
+        s += _stats(kind, stats, "ms", 1000)
+    s += "locks:\n"
+    for kind, stats in sorted(metrics['locks'].items()):
+        s += _stats(kind, stats, "ms", 1000)
+    return s
@@ -174,6 +174,8 @@ class pc(ttbl.power.impl_c):
         self._destination = pysnmp.entity.rfc3413.oneliner.cmdgen.UdpTransportTarget((hostname, 161))
         self.outlets = self._outlet_count()
         self.host = hostname
+        if self.throttle_group == None:
+            self.throttle_group = f"apc:{hostname}"
         self.outlet = outlet
         if oid:
             self.oid = oid
@@ -215,22 +217,9 @@ class pc(ttbl.power.impl_c):
         # worked, so be it.
         return int(varl[0][1])
 
-    def get(self, target, component):
-        #
-        # So get returns:
-        #
-        # (None, 0, 0, [ObjectType(ObjectIdentity(ObjectName('1.3.6.1.4.1.318.1.1.4.4.2.1.3.1')), Integer(2))])
-        ( errors, status, _index, varl ) = \
-            pysnmp.entity.rfc3413.oneliner.cmdgen.CommandGenerator().getCmd(
-                self._authdata, self._destination,
-                (self.oid + self.pdu_outlet_ctl)
-            )
-        if errors != None:
-            raise RuntimeError("%s#%d: error getting PDU outlet state: %s" %
-                               (self.host, self.outlet, status))
-        # we only expect one variable, so we are going to shorcircuit
-        # and get it's value right away
-        state = int(varl[0][1])
+    @staticmethod
+    def _state_decode(value):
+        state = int(value)
         if state == 1:
             return True		# on
         elif state == 2:
@@ -238,6 +227,42 @@ class pc(ttbl.power.impl_c):
         else:
             return None		# no idea
 
+    def _states_fetch(self):
+        # Walk the outlet control table to get the state of all the
+        # outlets in a single go
+        #
+        # So nextCmd returns a row per outlet:
+        #
+        # (None, 0, 0, [
+        #   [ObjectType(ObjectIdentity(ObjectName('1.3.6.1.4.1.318.1.1.4.4.2.1.3.1')), Integer(2))],
+        #   [ObjectType(ObjectIdentity(ObjectName('1.3.6.1.4.1.318.1.1.4.4.2.1.3.2')), Integer(1))],
+        #   ...
+        # ])
+        ( errors, status, _index, table ) = \
+            pysnmp.entity.rfc3413.oneliner.cmdgen.CommandGenerator().nextCmd(
+                self._authdata, self._destination,
+                (self.oid + self.pdu_outlet_ctl_prefix)
+            )
+        if errors != None:
+            raise RuntimeError("%s: error getting PDU outlet states: %s" %
+                               (self.host, status))
+        states = {}
+        for row in table:
+            for name, value in row:
+                # the last digit of the OID is the outlet number
+                states[int(tuple(name)[-1])] = self._state_decode(value)
+        return states
+
+    def _poller(self):
+        # all the outlets in the PDU share the state read from it
+        return ttbl.power.pdu_poller_get(f"apc:{self.host}",
+                                         self._states_fetch)
+
+    def get(self, target, component):
+        # the state of all the outlets is read at once and shared for
+        # a short time, see ttbl.power.pdu_poller_c
+        return self._poller().state_get(self.outlet)
+
     def on(self, target, component):
         ( errors, status, _index, _varl ) = \
             pysnmp.entity.rfc3413.oneliner.cmdgen.CommandGenerator().setCmd(
@@ -250,6 +275,7 @@ class pc(ttbl.power.impl_c):
         if errors != None:
             raise RuntimeError("%s#%d: error turning PDU outlet on: %s" %
                                (self.host, self.outlet, status))
+        self._poller().invalidate(self.outlet, True)
 
     def off(self, target, component):
         ( errors, status, _index, _varl ) = \
@@ -263,3 +289,4 @@ class pc(ttbl.power.impl_c):
         if errors != None:
             raise RuntimeError("%s#%d: error turning PDU outlet off: %s" %
                                (self.host, self.outlet, status))
+        self._poller().invalidate(self.outlet, False)
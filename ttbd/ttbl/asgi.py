@@ -0,0 +1,249 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Serve the daemon's WSGI application from an asyncio event loop
+--------------------------------------------------------------
+
+With *ttbd --server asgi* (or *ttbl.config.server = "asgi"*), a
+single process runs an asyncio event loop (with `uvicorn
+<https://www.uvicorn.org>`_) that accepts the connections and parses
+the requests; the (blocking) WSGI application is run in a bounded
+pool of threads (:data:`ttbl.config.asgi_threads`).
+
+Requests that can wait for a long time for data to come (console
+reads long-polling or following, see :data:`wait_path_regex`) are run
+in their own bounded pool (:data:`ttbl.config.asgi_wait_threads`),
+so a lot of them waiting can't starve the rest.
+
+Thus connections that are just waiting (eg: streaming big files or
+waiting for data to come) don't need a whole process each, and long
+synchronous calls (flashing, power sequences) only tie up a thread;
+concurrency is no longer capped by :data:`ttbl.config.processes`.
+
+Responses are sent as the application yields them, so streamed
+responses (eg: the inventory, see *_targets_gets()*) keep flowing
+chunk by chunk.
+
+Note the requests are thus served by multiple threads of the same
+process, so the per-process state they use (eg: the caches in
+:func:`ttbl.allocation.get_from_cache`, :meth:`commonl.fsdb_c.get`
+or :meth:`ttbl.test_target.to_json` and the locks in
+:class:`ttbl.process_posix_file_lock_c`) has to be thread safe.
+"""
+import asyncio
+import concurrent.futures
+import logging
+import re
+import sys
+import tempfile
+
+import ttbl.config
+
+#: Software name reported in *SERVER_SOFTWARE*
+server_software = "ttbd-asgi"
+
+#: Regular expression matching the paths of requests that can block
+#: waiting for data (eg: console reads with *wait* or *follow*)
+#:
+#: These are run in the *wait_executor* given to :class:`wsgi_app_c`.
+wait_path_regex = re.compile(r"/targets/[^/]+/console/read$")
+
+_end = object()
+
+class wsgi_app_c:
+    """
+    ASGI application that runs a WSGI application in a thread pool
+
+    :param wsgi_app: WSGI application (eg: a :class:`flask.Flask`)
+    :param concurrent.futures.Executor executor: executor where to
+      run the WSGI application (and get each chunk of the response it
+      produces)
+    :param int body_max_memory: (optional) request bodies bigger than
+      this are spooled to disk before passing them to the WSGI
+      application
+    :param concurrent.futures.Executor wait_executor: (optional)
+      executor where to run instead requests whose path matches
+      :data:`wait_path_regex`; by default, *executor*
+    """
+    def __init__(self, wsgi_app, executor, body_max_memory = 1024 * 1024,
+                 wait_executor = None):
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+        self.body_max_memory = body_max_memory
+        self.wait_executor = wait_executor
+
+    @staticmethod
+    def _environ(scope, body):
+        # https://peps.python.org/pep-3333/#environ-variables
+        # PEP 3333 strings are bytes decoded as latin-1
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', "")\
+                .encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_PROTOCOL': "HTTP/" + scope.get('http_version', "1.1"),
+            'SERVER_SOFTWARE': server_software,
+            'wsgi.version': ( 1, 0 ),
+            'wsgi.url_scheme': scope.get('scheme', "http"),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        server = scope.get('server', None)
+        if server:
+            environ['SERVER_NAME'] = server[0]
+            environ['SERVER_PORT'] = str(server[1])
+        else:
+            environ['SERVER_NAME'] = "localhost"
+            environ['SERVER_PORT'] = "80"
+        client = scope.get('client', None)
+        if client:
+            environ['REMOTE_ADDR'] = client[0]
+            environ['REMOTE_PORT'] = str(client[1])
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace("-", "_")
+            value = value.decode('latin-1')
+            if name in ( "CONTENT_TYPE", "CONTENT_LENGTH" ):
+                key = name
+            else:
+                key = "HTTP_" + name
+            if key in environ:
+                # repeated headers are folded
+                separator = "; " if key == "HTTP_COOKIE" else ","
+                environ[key] += separator + value
+            else:
+                environ[key] = value
+        return environ
+
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({ 'type': 'lifespan.startup.complete' })
+            elif message['type'] == 'lifespan.shutdown':
+                await send({ 'type': 'lifespan.shutdown.complete' })
+                return
+
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise RuntimeError(f"{scope['type']}: unsupported ASGI scope")
+
+        loop = asyncio.get_running_loop()
+        if self.wait_executor != None \
+           and wait_path_regex.search(scope['path']):
+            executor = self.wait_executor
+        else:
+            executor = self.executor
+        body = tempfile.SpooledTemporaryFile(max_size = self.body_max_memory)
+        iterable = None
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'http.disconnect':
+                    return
+                data = message.get('body', b"")
+                if data:
+                    body.write(data)
+                if not message.get('more_body', False):
+                    break
+            body.seek(0)
+            environ = self._environ(scope, body)
+
+            response = {}
+            def _start_response(status, headers, exc_info = None):
+                if exc_info and response.get('started', False):
+                    raise exc_info[1].with_traceback(exc_info[2])
+                response['status'] = int(status.split(" ", 1)[0])
+                response['headers'] = [
+                    ( name.lower().encode('latin-1'), value.encode('latin-1') )
+                    for name, value in headers
+                ]
+                return self._write_unsupported
+
+            # the WSGI application might call start_response() only
+            # when we get the first chunk, so get it before starting
+            iterable = await loop.run_in_executor(
+                executor, self.wsgi_app, environ, _start_response)
+            iterator = iter(iterable)
+            chunk = await loop.run_in_executor(
+                executor, next, iterator, _end)
+            response['started'] = True
+            await send({
+                'type': 'http.response.start',
+                'status': response['status'],
+                'headers': response['headers'],
+            })
+            while chunk is not _end:
+                if chunk:
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+                chunk = await loop.run_in_executor(
+                    executor, next, iterator, _end)
+            await send({ 'type': 'http.response.body', 'body': b"" })
+        finally:
+            if iterable != None and hasattr(iterable, "close"):
+                # closes files, finalizes generators...
+                await loop.run_in_executor(executor, iterable.close)
+            body.close()
+
+    @staticmethod
+    def _write_unsupported(_data):
+        raise RuntimeError("WSGI write() callable not supported,"
+                           " return an iterable")
+
+
+
+def serve(wsgi_app, host, port, certfile = None, keyfile = None,
+          keyfile_password = None):
+    """
+    Serve a WSGI application from an asyncio event loop
+
+    :param wsgi_app: WSGI application (eg: a :class:`flask.Flask`)
+    :param str host: address to listen on
+    :param int port: port to listen on
+    :param str certfile: (optional) SSL certificate file; if given,
+      serve HTTPS
+    :param str keyfile: (optional) SSL key file
+    :param str keyfile_password: (optional) password for *keyfile*
+    """
+    try:
+        import uvicorn
+    except ImportError as e:
+        raise RuntimeError(
+            "server 'asgi' needs uvicorn, install it (eg:"
+            " pip install uvicorn, dnf install python3-uvicorn)") from e
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers = ttbl.config.asgi_threads,
+        thread_name_prefix = "ttbd-asgi")
+    wait_executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers = ttbl.config.asgi_wait_threads,
+        thread_name_prefix = "ttbd-asgi-wait")
+    config = uvicorn.Config(
+        wsgi_app_c(wsgi_app, executor, wait_executor = wait_executor),
+        host = host, port = port,
+        ssl_certfile = certfile, ssl_keyfile = keyfile,
+        ssl_keyfile_password = keyfile_password,
+        # we report via our own logging
+        access_log = False, log_config = None,
+        # we can't interrupt the WSGI app, so let it finish calls
+        # (which can take long, eg: flashing) before quitting
+        timeout_graceful_shutdown = 1200)
+    logging.info("asgi: serving on %s:%s with %d threads (%d for"
+                 " waiting requests)", host, port,
+                 ttbl.config.asgi_threads, ttbl.config.asgi_wait_threads)
+    uvicorn.Server(config).run()
@@ -75,6 +75,22 @@ default_qemu_count = 4
 #: spawn them more dynamically).
 processes = 20
 
+#: Number of threads to run requests with the *asgi* server
+#:
+#: With *ttbd --server asgi* (see :mod:`ttbl.asgi`), a single process
+#: serves all the connections and runs up to this many requests in
+#: parallel, each in a thread; long calls (flashing, power
+#: sequences...) tie up a thread until done.
+asgi_threads = 64
+
+#: Number of threads to run waiting requests with the *asgi* server
+#:
+#: Requests that can block waiting for data for a long time (console
+#: reads with *wait* or *follow*, see :data:`ttbl.asgi.wait_path_regex`)
+#: are run in a separate pool of this many threads, so they can't tie
+#: up all of :data:`asgi_threads` and starve the rest of the calls.
+asgi_wait_threads = 64
+
 #: Name of the current *ttbd* instance
 #:
 #: Multiple separate instances of the daemon can be started, each
@@ -92,13 +108,27 @@ instance_suffix = ""
 #: Maximum length of the reason given to an allocation
 reason_len_max = 128
 
-#: Server implementation to use: gunicorn, tornado, flask
+#: Server implementation to use: gunicorn, tornado, asgi, flask
 #:
 #: (defaults to Tornado) Set in any serverconfiguration file:
 #:
 #: >>> ttbl.config.server = "gunicorn"
+#:
+#: *asgi* needs `uvicorn <https://www.uvicorn.org>`_ (see
+#: :mod:`ttbl.asgi`).
 server = None
 
+#: Backend for the targets' databases (:attr:`ttbl.test_target.fsdb`)
+#:
+#: Name of any of the backends in :data:`commonl.fsdb_c.backends`;
+#: *None* (default) picks :class:`commonl.fsdb_symlink_c`. Set in any
+#: server configuration file (before targets are created):
+#:
+#: >>> ttbl.config.fsdb_backend = "log"
+#:
+#: Existing databases can be converted with *ttbd-fsdb-migrate*.
+fsdb_backend = None
+
 def _nested_list_flatten(l):
     for e in l:
         if isinstance(e, collections.abc.Iterable):
@@ -234,6 +264,16 @@ target_max_idle = 30  # .5 min
 #: (see :ref:`power states <ttbd_power_states>`)
 target_max_idle_power_fully_off = 10 * target_max_idle
 
+#: Use the event driven allocation scheduler
+#:
+#: If *True*, the cleanup process runs a
+#: :class:`ttbl.allocation.scheduler_c`, which acts when an
+#: allocation or target reaches a deadline (eg: idle for too long)
+#: or when notified something changed (eg: a target was released);
+#: otherwise, every :data:`target_max_idle` / 2 seconds it scans all
+#: the allocations and targets (:func:`ttbl.allocation.maintenance`).
+allocation_scheduler_events = True
+
 #: Maximum time an acquired target is idle before it is released (seconds)
 target_owned_max_idle = 5 * 60  # 5 min
 
@@ -252,3 +292,17 @@ cleanup_files_maxage = 86400 #  1day, count is in seconds, 24x60x60 sec
 #: Note you want normally this in a range that allows ports that fit
 #: in some preallocated range (eg: VNC requires >= 5900).
 tcp_port_range = (1025, 65530)
+
+#: Let the HTTP server send files with *sendfile()*
+#:
+#: Files streamed to clients (console reads, store and capture
+#: downloads...) are handed to the WSGI server's *wsgi.file_wrapper*
+#: when it is known to honour the *Content-Length* (gunicorn), so
+#: when possible it sends them with :func:`os.sendfile`, without
+#: copying them through userspace. Set to *False* to always read and
+#: send them in chunks.
+stream_file_sendfile = True
+
+#: Size of the chunks in which files are read when they are streamed
+#: to clients without *sendfile()*
+stream_file_chunk_size = 64 * 1024
@@ -461,6 +461,8 @@ class interface(ttbl.tt_interface):
 
     - allows setting general channel parameters
 
+    - allows clients to wait for new data instead of polling (see
+      :meth:`get_read`)
 
     """
     def __init__(self, *impls, **kwimpls):
@@ -468,6 +470,18 @@ class interface(ttbl.tt_interface):
         # the implementations for the console need to be of type impl_c
         self.impls_set(impls, kwimpls, impl_c)
 
+    #: Maximum time (in seconds) a read can wait for new data
+    #:
+    #: Clients can ask a read to wait until there is new data
+    #: (*wait*) or to keep sending data as it arrives (*follow*) for
+    #: up to this many seconds; see :meth:`get_read`.
+    #:
+    #: Note that with servers that use a process per request
+    #: (*gunicorn*, *tornado*), each waiting client ties up a
+    #: process; lower it (*0* disables waiting) if there are too
+    #: many.
+    read_wait_max = 30
+
     def _pre_off_disable_all(self, target):
         for console, impl in self.impls.items():
             target.log.info("%s: disabling console before powering off",
@@ -628,8 +642,32 @@ class interface(ttbl.tt_interface):
         return False
 
     def get_read(self, target, who, args, _files, _user_path):
+        """
+        Read from a console, from a given offset on
+
+        Arguments:
+
+        - *component*: console to read from
+        - *offset*: offset from which to read
+        - *wait*: (optional, seconds) if there is no data past
+          *offset*, wait for up to this long for some to arrive
+          (long-poll)
+        - *follow*: (optional, seconds) keep streaming data as it
+          arrives for up to this long
+        - *generation*: (optional) generation the client knows the
+          stream for; waiting or following stops when the stream's
+          generation changes (eg: the target was power cycled). If
+          not given, the current one.
+
+        *wait* and *follow* are capped to :data:`read_wait_max`.
+        """
         impl, component = self.arg_impl_get(args, "component")
         offset = int(args.get('offset', 0))
+        wait = min(self.arg_get(args, 'wait', numbers.Real, True, 0),
+                   self.read_wait_max)
+        follow = min(self.arg_get(args, 'follow', numbers.Real, True, 0),
+                     self.read_wait_max)
+        generation = self.arg_get(args, 'generation', None, True, None)
         if target.target_is_owned_and_locked(who):
             target.timestamp()	# only if the reader owns it
         last_enable_check = target.property_get("interfaces.console." + component + ".check_ts", 0)
@@ -641,6 +679,25 @@ class interface(ttbl.tt_interface):
             target.property_set("interfaces.console." + component + ".check_ts", ts_now)
         r = impl.read(target, component, offset)
         stream_file = r.get('stream_file', None)
+        if stream_file and ( wait > 0 or follow > 0 ):
+            if generation == None:
+                generation = r.get('stream_generation', 0)
+
+            def _generation_changed():
+                r_new = impl.read(target, component, offset)
+                # some report it as str, some as int
+                return str(r_new.get('stream_generation', 0)) \
+                    != str(generation)
+
+            if wait > 0 and offset >= 0 \
+               and commonl.file_wait_grow(stream_file, offset, wait,
+                                          check = _generation_changed):
+                # new data or new generation
+                r = impl.read(target, component, offset)
+            if follow > 0:
+                # the daemon will keep sending what is appended
+                r['stream_follow'] = follow
+                r['stream_follow_check'] = _generation_changed
         if stream_file and not os.path.exists(stream_file):
             # no file yet, no console output
             return {
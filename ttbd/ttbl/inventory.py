@@ -0,0 +1,268 @@
+#! /usr/bin/python3
+#
+# Copyright (c) 2024 Intel Corporation
+#
+# SPDX-License-Identifier: Apache-2.0
+#
+"""
+Server-wide inventory generation
+--------------------------------
+
+Clients poll the inventory (*GET targets/*) very often and in most
+cases, nothing has changed since the last time. To allow them to
+ask only for what changed, the server keeps:
+
+- an inventory *generation*, a number that increases every time
+  the data of any target is seen to have changed
+
+- for each target, the generation at which its data was last seen to
+  change (its *stamp*) and a hash of said data, so we can tell when
+  it changes again
+
+- for each target that was removed from the configuration, the
+  generation at which it was removed (a *tombstone*)
+
+so when a client says *I have everything up to generation N*
+(*GET targets/?since=N*), we can reply with only the targets stamped
+after *N* and the tombstones after *N*; see :func:`stamps_update` and
+:func:`tombstones`.
+
+The data is kept in an FSDB in *STATEDIR/inventory*, so it is shared
+by all the server's processes and survives restarts.
+
+Since each user can see a different set of targets, what a client
+echoes back is not the bare generation but a *cursor* (see
+:func:`cursor`) that also carries a hash of the targets it could see;
+if those changed (eg: the user lost or gained access to some), it
+gets a full listing instead of a delta.
+
+The generation starts at the time the database is created (in
+microseconds), so if the state is wiped, it will still be higher than
+anything clients have seen; clients asking with a generation older
+than that get a full listing, since we lost the tombstones.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import commonl
+import ttbl
+
+#: Path where the inventory database is kept, set by :func:`init`
+path = None
+
+_fsdb = None
+_lock = None
+
+# in-process cache of the hash of each target's data, keyed by
+# target ID -> ( ttbl.test_target._json_cache_key(), HASH ), so we
+# only hash when the target's data might have changed
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+def _key(prefix, target_id):
+    # target IDs might contain periods, which the FSDB key space
+    # considers field separators; in the DB we can't have "stamp.a"
+    # and "stamp.a.b" (setting the later would wipe the first)
+    return prefix + "-" + target_id.replace("%", "%25").replace(".", "%2E")
+
+def _key_id(key):
+    return key.split("-", 1)[1].replace("%2E", ".").replace("%25", "%")
+
+
+def init(state_path, targets):
+    """
+    Initialize the inventory generation subsystem
+
+    Shall be called once the configuration is loaded and before
+    starting to serve requests; targets that were known in a previous
+    run and are no longer configured get a tombstone, so clients
+    know to remove them.
+
+    :param str state_path: server's state directory
+    :param list targets: list of :class:`ttbl.test_target` currently
+      configured
+    """
+    global path
+    global _fsdb
+    global _lock
+    path = os.path.join(state_path, "inventory")
+    commonl.makedirs_p(path)
+    _fsdb = commonl.fsdb_symlink_c(path)
+    # the lock lives outside of the DB's directory, so it is not
+    # considered a key
+    _lock = ttbl.process_posix_file_lock_c(path + ".lock")
+    with _hashes_lock:
+        _hashes.clear()
+    with _lock:
+        generation = _fsdb.get("generation", None)
+        if generation == None:
+            generation = int(time.time() * 1000000)
+            _fsdb.set_keys([ ( "generation", generation ),
+                             ( "origin", generation ) ])
+        target_ids = set(target.id for target in targets)
+        removed = []
+        for key in _fsdb.keys("stamp-*"):
+            target_id = _key_id(key)
+            if target_id not in target_ids:
+                removed.append(target_id)
+        if not removed:
+            return
+        generation += 1
+        with _fsdb.transaction():
+            for target_id in removed:
+                _fsdb.set(_key("stamp", target_id), None)
+                _fsdb.set(_key("tombstone", target_id), generation)
+            _fsdb.set("generation", generation)
+        logging.info("inventory: generation %d: removed targets %s",
+                     generation, " ".join(removed))
+
+
+def generation():
+    """
+    Return the current inventory generation
+
+    :returns int: current generation; *None* if not initialized
+    """
+    if _fsdb == None:
+        return None
+    return _fsdb.get("generation", None)
+
+
+def origin():
+    """
+    Return the generation at which the inventory database was created
+
+    Tombstones of targets removed before that are lost, so deltas
+    can't be computed for generations older than this.
+
+    :returns int: origin generation; *None* if not initialized
+    """
+    if _fsdb == None:
+        return None
+    return _fsdb.get("origin", None)
+
+
+def _hash_get(target):
+    key = target._json_cache_key()
+    if key != None:
+        with _hashes_lock:
+            cached = _hashes.get(target.id, None)
+        if cached and cached[0] == key:
+            return cached[1]
+    data = target.to_json([])
+    if data == None:
+        data = b""
+    h = hashlib.sha256(data).hexdigest()
+    if key != None:
+        with _hashes_lock:
+            _hashes[target.id] = ( key, h )
+    return h
+
+
+def stamps_update(targets):
+    """
+    Stamp with a new generation the targets whose data changed
+
+    Note a target's data changes when anything it reports changes
+    (eg: its owner, the keepalive timestamp of the allocation that
+    owns it, its power state...).
+
+    :param list targets: list of :class:`ttbl.test_target` to check
+    :returns tuple: *( GENERATION, STAMPS )*; the current generation
+      and a dictionary keyed by target ID of the generation at which
+      each target was last seen to change.
+    """
+    hashes = {}
+    for target in targets:
+        hashes[target.id] = _hash_get(target)
+
+    def _changed(d):
+        changed = []
+        for target_id, h in hashes.items():
+            value = d.get(_key("stamp", target_id), None)
+            if value == None or value.split(" ", 1)[1] != h:
+                changed.append(target_id)
+        return changed
+
+    # most of the times nothing changed, so we check before taking
+    # the lock -- read is served from the FSDB cache
+    d = _fsdb.get_as_dict()
+    changed = _changed(d)
+    if changed:
+        with _lock:
+            d = _fsdb.get_as_dict()
+            changed = _changed(d)	# another process might have done it
+            if changed:
+                generation = d['generation'] + 1
+                with _fsdb.transaction():
+                    for target_id in changed:
+                        value = "%d %s" % (generation, hashes[target_id])
+                        d[_key("stamp", target_id)] = value
+                        _fsdb.set(_key("stamp", target_id), value)
+                        # if removed and readded, no longer dead
+                        if _key("tombstone", target_id) in d:
+                            _fsdb.set(_key("tombstone", target_id), None)
+                    _fsdb.set("generation", generation)
+                d['generation'] = generation
+    stamps = {}
+    for target_id in hashes:
+        stamps[target_id] = int(d[_key("stamp", target_id)].split(" ", 1)[0])
+    return d['generation'], stamps
+
+
+def tombstones(since):
+    """
+    List targets removed after a given generation
+
+    :param int since: generation
+    :returns list: list of IDs of targets removed after *since*
+    """
+    l = []
+    for key, value in _fsdb.get_as_slist("tombstone-*"):
+        if value > since:
+            l.append(_key_id(key))
+    return l
+
+
+# bits of the cursor used for the hash of the targets allowed
+_cursor_hash_bits = 32
+
+def _allowed_hash(target_ids):
+    h = hashlib.sha256(" ".join(sorted(target_ids)).encode('utf-8'))
+    return int.from_bytes(h.digest()[:_cursor_hash_bits // 8], "big")
+
+
+def cursor(generation, target_ids):
+    """
+    Return the cursor to give a client for a listing
+
+    The client echoes it back (*GET targets/?since=CURSOR*) to ask
+    for what changed since; see :func:`cursor_check`.
+
+    :param int generation: generation the listing corresponds to
+    :param list(str) target_ids: IDs of the targets the client is
+      allowed to see
+    :returns int: cursor
+    """
+    return ( generation << _cursor_hash_bits ) | _allowed_hash(target_ids)
+
+
+def cursor_check(cursor_value, target_ids):
+    """
+    Check a cursor a client echoed back
+
+    :param int cursor_value: cursor as given by :func:`cursor`
+    :param list(str) target_ids: IDs of the targets the client is
+      allowed to see now
+    :returns int: generation the cursor corresponds to; 0 if the
+      targets the client can see have changed since (and thus it
+      needs a full listing)
+    """
+    if cursor_value <= 0 \
+       or cursor_value & ( ( 1 << _cursor_hash_bits ) - 1 ) \
+          != _allowed_hash(target_ids):
+        return 0
+    return cursor_value >> _cursor_hash_bits
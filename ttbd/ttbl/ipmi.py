@@ -13,18 +13,372 @@ target's power or serial console via IPMI.
 
 """
 
+import collections
 import logging
 import numbers
 import os
 import pprint
 import re
+import shutil
 import subprocess
+import threading
 import time
 
 import commonl
 import ttbl.power
 import ttbl.console
 
+#: Keep a persistent IPMI session to each BMC
+#:
+#: Instead of starting *ipmitool* for each command (which negotiates
+#: a new RMCP+ session with the BMC every time), the power, boot mode
+#: and SoL components run their commands in an *ipmitool shell*
+#: process kept running for each BMC (see :class:`bmc_session_c`),
+#: which is shared by all the components talking to the same BMC
+#: with the same user.
+#:
+#: Set to *False* to start *ipmitool* for each command.
+persistent_sessions = True
+
+#: Seconds a persistent IPMI session can be idle before being
+#: restarted
+#:
+#: BMCs close sessions that have been inactive for a while (usually
+#: around a minute); instead of finding out when the next command
+#: fails, a new session is started when the last command was run this
+#: long ago.
+session_idle_max = 30
+
+#: Regular expression matching *ipmitool* output that means the
+#: command failed
+#:
+#: In an *ipmitool shell* there is no exit code telling if a command
+#: succeeded, so the output is scanned for this.
+session_error_regex = re.compile(
+    rb"^(Error|Unable to |Invalid |Set .* failed|.* command failed)",
+    re.MULTILINE)
+
+#: Regular expression matching *ipmitool* output that means the
+#: session with the BMC is broken and a new one has to be started
+session_broken_regex = re.compile(
+    rb"(Unable to establish (IPMI v2 / RMCP\+|LAN) session"
+    rb"|No response from remote controller"
+    rb"|Session timed out"
+    rb"|Invalid [Ss]ession)")
+
+#: Commands that can be run again in a new session when the session
+#: breaks or times out while running them
+#:
+#: When that happens, there is no way to know if the BMC executed
+#: the command or not, so only commands for which doing it twice
+#: makes no difference are retried; others (eg: *chassis power
+#: cycle*) fail. Any command is retried if it never made it to the
+#: session.
+#:
+#: Each entry is a list of the first arguments of the command.
+session_retry_commands = [
+    [ "chassis", "power", "status" ],
+    [ "chassis", "power", "on" ],
+    [ "chassis", "power", "off" ],
+    [ "sol", "deactivate" ],
+]
+
+class bmc_session_c:
+    """
+    Persistent IPMI session to a BMC
+
+    Runs *ipmitool ... shell*, which negotiates the session with the
+    BMC once and then executes each command line written to its
+    standard input. Commands from multiple threads are pipelined:
+    they are written to the shell as they come and their output is
+    collected in order by a reader thread, delimited by a marker
+    written after each command (an invalid command whose error
+    message and listing of valid commands are recognized and
+    removed).
+
+    If the shell dies, the session breaks or a command times out, the
+    shell is restarted and the command run again, once, if it is safe
+    to do so (see :data:`session_retry_commands`).
+
+    Use :func:`bmc_session_get` to get the session for a BMC, shared
+    with other components.
+
+    :param str name: name of the session, for messages
+    :param list(str) cmdline: *ipmitool* command line to access the
+      BMC, to which *shell* is appended
+    :param dict env: environment for *ipmitool* (eg: with
+      *IPMI_PASSWORD*)
+    :param float timeout: seconds to wait for a command to complete
+    """
+    # marks the end of a command's output
+    marker_prefix = b"__tcf_sync_"
+
+    def __init__(self, name: str, cmdline: list, env: dict,
+                 timeout: float):
+        assert isinstance(name, str)
+        commonl.assert_list_of_strings(cmdline, "cmdline", "argument")
+        assert isinstance(env, dict)
+        assert isinstance(timeout, numbers.Real) and timeout > 0
+        self.name = name
+        self.cmdline = cmdline
+        self.env = env
+        self.timeout = timeout
+        self.pid = os.getpid()
+        #: Statistics (sessions started, commands run, retries...)
+        self.stats = collections.Counter()
+        self._lock = threading.Lock()
+        self._process = None
+        self._pending = None
+        self._sequence = 0
+        self._ts_last = 0
+
+
+    def _start(self):
+        # start a new ipmitool shell; self._lock held
+        env = dict(os.environ)
+        env.update(self.env)
+        # ipmitool's stdout would be fully buffered to a pipe, mixing
+        # up its ordering with stderr (where the markers show up)
+        self._process = subprocess.Popen(
+            [ "stdbuf", "-oL", "-eL" ] + self.cmdline + [ "shell" ],
+            stdin = subprocess.PIPE, stdout = subprocess.PIPE,
+            stderr = subprocess.STDOUT, env = env, shell = False)
+        self._pending = collections.deque()
+        self._ts_last = time.time()
+        self.stats['sessions'] += 1
+        logging.info("IPMI session %s: started (PID %d)",
+                     self.name, self._process.pid)
+        threading.Thread(
+            target = self._reader, args = ( self._process, self._pending ),
+            name = f"ipmi-session-{self.name}", daemon = True).start()
+
+
+    def _stop(self, process, why: str):
+        # kill process, if still the current one; self._lock held
+        if process == self._process:
+            self._process = None
+        if process.poll() == None:
+            logging.info("IPMI session %s: stopping (PID %d): %s",
+                         self.name, process.pid, why)
+            process.kill()
+
+
+    def _reader(self, process, pending):
+        # collect the output of each command pending in the session
+        # run by process, until it dies
+        #
+        # The marker is an invalid command, so after it (or its echo)
+        # ipmitool prints an error message and the list of valid
+        # commands, which ends with an empty line:
+        #
+        #   Invalid command: __tcf_sync_3
+        #   Commands:
+        #   <TAB>raw           Send a RAW IPMI request and print response
+        #   ...
+        #   <empty line>
+        #
+        # that is not output of the next command, so skip it.
+        skipping = False
+        for line in process.stdout:
+            # remove prompts, which are printed without a newline
+            line = re.sub(rb"^(ipmitool> )+", b"", line.rstrip())
+            with self._lock:
+                if self.marker_prefix in line:
+                    skipping = True
+                    if pending and pending[0]['marker'] in line:
+                        entry = pending.popleft()
+                        entry['event'].set()
+                    continue
+                if skipping:
+                    if line == b"":
+                        skipping = False	# end of the command list
+                        continue
+                    if not pending or line != pending[0]['command']:
+                        continue		# command list
+                    skipping = False	# echo of the next command
+                if not pending:		# banners, etc
+                    continue
+                entry = pending[0]
+                if line == entry['command'] and not entry['output']:
+                    continue		# echo of the command
+                entry['output'].append(line)
+        process.wait()
+        with self._lock:
+            if process == self._process:
+                self._process = None
+            while pending:
+                entry = pending.popleft()
+                entry['error'] = \
+                    f"session closed (exit code {process.returncode})"
+                entry['event'].set()
+
+
+    def _run(self, command: list):
+        # queue command in the session, wait for its output
+        command = " ".join(command).encode('utf-8')
+        entry = dict(command = command, output = [], error = None,
+                     event = threading.Event(), written = False)
+        with self._lock:
+            if self._process \
+               and time.time() - self._ts_last > session_idle_max:
+                self._stop(self._process, "idle")
+            if self._process == None:
+                self._start()
+            process = self._process
+            entry['process'] = process
+            self._sequence += 1
+            entry['marker'] = b"%s%d" % (self.marker_prefix, self._sequence)
+            self._pending.append(entry)
+            try:
+                process.stdin.write(command + b"\n" + entry['marker'] + b"\n")
+                process.stdin.flush()
+                entry['written'] = True
+            except OSError as e:
+                # the reader will flag the pending commands
+                self._stop(process, f"can't write: {e}")
+            self._ts_last = time.time()
+        if not entry['event'].wait(self.timeout):
+            with self._lock:
+                self._stop(process, "command timed out")
+            entry['event'].wait()
+            entry['error'] = f"command timed out after {self.timeout}s"
+        return entry
+
+
+    def run(self, command: list) -> bytes:
+        """
+        Run an *ipmitool* command in the session
+
+        :param list(str) command: command and arguments (eg:
+          *[ "chassis", "power", "status" ]*)
+
+        :returns bytes: output of the command
+
+        :raises subprocess.CalledProcessError: if the command failed
+          (as :func:`subprocess.check_output` would)
+        """
+        commonl.assert_list_of_strings(command, "command", "argument")
+        self.stats['commands'] += 1
+        entry = self._run(command)
+        output = b"\n".join(entry['output'])
+        broken = entry['error'] or session_broken_regex.search(output)
+        if broken \
+           and ( not entry['written'] or self._retry_safe(command) ):
+            # transparently try again on a new session
+            self.stats['retries'] += 1
+            logging.warning("IPMI session %s: retrying '%s' on a new"
+                            " session: %s", self.name, " ".join(command),
+                            entry['error'] or output)
+            with self._lock:
+                self._stop(entry['process'], "broken")
+            entry = self._run(command)
+            output = b"\n".join(entry['output'])
+            broken = entry['error'] or session_broken_regex.search(output)
+        if broken:
+            # we don't know if the BMC executed it; start over next time
+            self.stats['errors'] += 1
+            with self._lock:
+                self._stop(entry['process'], "broken")
+            if entry['error']:
+                output += b"\n" + entry['error'].encode('utf-8')
+            raise subprocess.CalledProcessError(
+                1, self.cmdline + command, output = output)
+        if session_error_regex.search(output):
+            self.stats['errors'] += 1
+            raise subprocess.CalledProcessError(
+                1, self.cmdline + command, output = output)
+        return output
+
+
+    @staticmethod
+    def _retry_safe(command: list):
+        for prefix in session_retry_commands:
+            if command[:len(prefix)] == prefix:
+                return True
+        return False
+
+
+    def close(self):
+        """
+        Stop the session's *ipmitool shell*, if running
+        """
+        with self._lock:
+            if self._process:
+                self._stop(self._process, "closed")
+
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+def bmc_session_get(hostname: str, user: str, cmdline: list, env: dict,
+                    timeout: float):
+    """
+    Get the persistent session to a BMC, creating it if needed
+
+    All the components that access the same BMC with the same
+    *ipmitool* command line and environment (eg: same user, interface
+    and password) share the session; the *timeout* of the first is
+    used to create it.
+
+    :param str hostname: BMC's hostname
+    :param str user: user name to log in to the BMC
+    :param list(str) cmdline: *ipmitool* command line to access the
+      BMC; verbosity options are removed
+    :param dict env: environment for *ipmitool*
+    :param float timeout: seconds to wait for a command to complete
+
+    :returns bmc_session_c: session
+    """
+    cmdline = [ i for i in cmdline if i != "-v" ]
+    key = ( tuple(cmdline), tuple(sorted(env.items())) )
+    with _sessions_lock:
+        session = _sessions.get(key, None)
+        # a session from before forking can't be used, its reader
+        # thread doesn't exist here
+        if session == None or session.pid != os.getpid():
+            session = bmc_session_c(
+                f"{user}@{hostname}" if user else hostname,
+                cmdline, env, timeout)
+            _sessions[key] = session
+        return session
+
+
+
+def _ipmitool_run(hostname: str, user: str, cmdline: list, env: dict,
+                  command: list, timeout: float):
+    # Run an ipmitool command, in the BMC's persistent session if
+    # enabled; raises subprocess.CalledProcessError on failure
+    if persistent_sessions and shutil.which("stdbuf"):
+        session = bmc_session_get(hostname, user, cmdline, env, timeout)
+        return session.run(command)
+    return subprocess.check_output(
+        cmdline + command, env = env, shell = False,
+        stderr = subprocess.STDOUT)
+
+
+
+def _sol_deactivate(target, hostname: str, user: str,
+                    ipmi_timeout: float, ipmi_retries: int, env: dict):
+    # deactivate the BMC's SoL, kicking out whoever is using it
+    try:
+        _ipmitool_run(
+            hostname, user,
+            [
+                "/usr/bin/ipmitool",
+                "-N", str(ipmi_timeout),
+                "-R", str(ipmi_retries),
+                "-H", hostname,
+                "-U", user, "-E",
+                "-I", "lanplus",
+            ],
+            env, [ "sol", "deactivate" ], ipmi_timeout * (ipmi_retries + 1))
+    except subprocess.CalledProcessError as e:
+        # don't check, we don't really care (eg: it was not active)
+        target.log.info("IPMI SoL deactivate failed, ignoring: %s",
+                        e.output.decode('utf-8', errors = 'backslashreplace'))
+
+
 class pci(ttbl.power.impl_c):
     """
     Power controller to turn on/off a server via IPMI
@@ -71,6 +425,8 @@ class pci(ttbl.power.impl_c):
         self.user = user
         self.bmc = None
         self.env = dict()
+        self.ipmi_timeout = ipmi_timeout
+        self.ipmi_retries = ipmi_retries
         # If I change the argument order, -E doesn't work ok and I get
         # password asked in the command line
         self.cmdline = [
@@ -100,9 +456,9 @@ class pci(ttbl.power.impl_c):
 
     def _run(self, target, command):
         try:
-            result = subprocess.check_output(
-                self.cmdline + command, env = self.env, shell = False,
-                stderr = subprocess.STDOUT)
+            result = _ipmitool_run(
+                self.hostname, self.user, self.cmdline, self.env, command,
+                self.ipmi_timeout * (self.ipmi_retries + 1))
         except subprocess.CalledProcessError as e:
             if self.lenient_runtime:
                 target.log.exception(
@@ -219,6 +575,8 @@ class pos_mode_c(ttbl.power.impl_c):
         self.user = user
         self.bmc = None
         self.env = dict()
+        self.ipmi_timeout = ipmi_timeout
+        self.ipmi_retries = ipmi_retries
         # If I change the argument order, -E doesn't work ok and I get
         # password asked in the command line
         self.cmdline = [
@@ -246,9 +604,9 @@ class pos_mode_c(ttbl.power.impl_c):
 
     def _run(self, target, command):
         try:
-            result = subprocess.check_output(
-                self.cmdline + command, env = self.env, shell = False,
-                stderr = subprocess.STDOUT)
+            result = _ipmitool_run(
+                self.hostname, self.user, self.cmdline, self.env, command,
+                self.ipmi_timeout * (self.ipmi_retries + 1))
         except subprocess.CalledProcessError as e:
             target.log.error("ipmitool %s failed: %s",
                              " ".join(command), e.output)
@@ -413,22 +771,8 @@ class sol_console_pc(ttbl.power.socat_pc, ttbl.console.generic_c):
             self.lenient)
         env = dict(os.environ)
         env.update(self.env_add)
-        subprocess.call(	# don't check, we don't really care
-            [
-                "/usr/bin/ipmitool",
-                "-N", str(self.ipmi_timeout),
-                "-R", str(self.ipmi_retries),
-                "-H", self.kws['hostname'],
-                "-U", self.kws['username'], "-E",
-                "-I", "lanplus", "sol", "deactivate",
-                #"-N", "10", "usesolkeepalive" # dies frequently
-            ],
-            stderr = subprocess.STDOUT,
-            bufsize = 0,
-            shell = False,
-            universal_newlines = False,
-            env = env,
-        )
+        _sol_deactivate(target, self.kws['hostname'], self.kws['username'],
+                        self.ipmi_timeout, self.ipmi_retries, env)
         try:
             ttbl.power.socat_pc.on(self, target, component)
             ttbl.console.generation_set(target, component)
@@ -536,18 +880,9 @@ class sol_ssh_console_pc(ttbl.console.ssh_pc):
         env = dict(os.environ)
         env.update(self.env_add)
         try:
-            subprocess.call(	# don't check, we don't really care
-                [
-                    "/usr/bin/ipmitool",
-                    "-N", str(self.ipmi_timeout),
-                    "-R", str(self.ipmi_retries),
-                    "-H", self.kws['hostname'],
-                    "-U", self.kws['username'], "-E",
-                    "-I", "lanplus", "sol", "deactivate",
-                ],
-                stderr = subprocess.STDOUT,
-                env = env,
-            )
+            _sol_deactivate(target, self.kws['hostname'],
+                            self.kws['username'],
+                            self.ipmi_timeout, self.ipmi_retries, env)
             ttbl.console.ssh_pc.on(self, target, component)
         except ( subprocess.CalledProcessError, ttbl.power.impl_c.power_on_e ) as e:
             if self.lenient_runtime:
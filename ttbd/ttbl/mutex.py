@@ -10,6 +10,8 @@ import os
 import errno
 import time
 
+import commonl
+
 class mutex_symlink(object):
     """
     The lamest file-system based mutex ever
@@ -22,6 +24,11 @@ class mutex_symlink(object):
     already acquired, it can spin busy wait on it (if given a timeout)
     or just fail. You can only release if you own it.
 
+    When waiting, it sleeps until the directory where the mutex is
+    changes (eg: the owner removes it), rather than retrying every
+    *wait_period* seconds, where the platform supports it (see
+    :class:`commonl.dir_watch_c`).
+
     Why like this? We'll have multiple processes doing this on behalf
     of remote clients (so it makes no sense to track owner by PID. The
     caller decides who gets to override and all APIs agree to use it
@@ -106,20 +113,32 @@ class mutex_symlink(object):
         if current_owner != None and current_owner == self.owner:
             return False
         t0 = time.time()
-        while True:
-            try:
-                t = time.time()
-                os.symlink(self.owner, self.location)
-                return True
-            except OSError as e:
-                if e.errno == errno.EEXIST:
-                    if timeout == None:
-                        raise self.mutex_busy_e(self)
-                    if t - t0 > timeout:
-                        raise self.timeout_e(self)
-                    time.sleep(wait_period)
-                else:
-                    raise
+        watch = None
+        try:
+            while True:
+                try:
+                    t = time.time()
+                    os.symlink(self.owner, self.location)
+                    return True
+                except OSError as e:
+                    if e.errno == errno.EEXIST:
+                        if timeout == None:
+                            raise self.mutex_busy_e(self)
+                        if t - t0 > timeout:
+                            raise self.timeout_e(self)
+                        if watch == None:
+                            # watch and try again, so we don't miss
+                            # a release in between
+                            watch = commonl.dir_watch_c(
+                                os.path.dirname(self.location) or ".",
+                                poll_period = wait_period)
+                            continue
+                        watch.wait(t0 + timeout - t)
+                    else:
+                        raise
+        finally:
+            if watch != None:
+                watch.close()
 
     def release(self, force = False):
         if force:
@@ -400,6 +400,11 @@ class dlwps7(ttbl.power.impl_c):
         self.reboot_wait_s = reboot_wait_s
         self.url = "%s://%s" % (url.scheme, url.netloc)
         self.url_no_password = "%s://%s" % (url.scheme, url.hostname)
+        # identifies the unit (with the port), to share the state
+        # read from it with the other outlets
+        self.unit = "%s://%s" % (url.scheme, url.netloc.rsplit("@", 1)[-1])
+        if self.throttle_group == None:
+            self.throttle_group = self.unit
         outlet = url.path[1:]
         if outlet == "":
             raise Exception("%s: URL missing outlet number" % _url)
@@ -417,17 +422,23 @@ class dlwps7(ttbl.power.impl_c):
                 self.url_no_password, self.outlet),
             url = self.url_no_password, outlet = self.outlet)
 
+    def _poller(self):
+        # all the outlets in the unit share the state read from it
+        return ttbl.power.pdu_poller_get(self.unit, self._states_fetch)
+
     def on(self, target, component):
         r = requests.get(self.url + "/outlet?%d=ON" % self.outlet)
         commonl.request_response_maybe_raise(r)
+        self._poller().invalidate(self.outlet, True)
 
     def off(self, target, _component):
         r = requests.get(self.url + "/outlet?%d=OFF" % self.outlet)
         commonl.request_response_maybe_raise(r)
+        self._poller().invalidate(self.outlet, False)
 
     state_regex = re.compile(b"<!-- state=(?P<state>[0-9a-z][0-9a-z]) lock=[0-9a-z][0-9a-z] -->")
-    def get(self, target, component):
-        """Get the power status for the outlet
+    def _states_fetch(self):
+        """Get the power status for all the outlets
 
         The unit returns the power state when querying the
         ``/index.htm`` path...as a comment inside the HTML body of the
@@ -450,7 +461,17 @@ class dlwps7(ttbl.power.impl_c):
                             % self.state_regex.pattern)
         state = int(m.group('state'), base = 16)
         # Note outlet numbers are base-1...
-        if state & (1 << self.outlet - 1) == 0:
-            return False
-        else:
-            return True
+        return {
+            outlet: state & (1 << outlet - 1) != 0
+            for outlet in range(1, 9)
+        }
+
+    def get(self, target, component):
+        """Get the power status for the outlet
+
+        The state of all the outlets is read at once and shared by
+        all the outlets in the same unit for a short time (see
+        :class:`ttbl.power.pdu_poller_c`), so reading the state of
+        all the targets connected to it takes a single request.
+        """
+        return self._poller().state_get(self.outlet)
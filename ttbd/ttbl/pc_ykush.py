@@ -83,6 +83,8 @@ class ykush(ttbl.power.impl_c, ttbl.things.impl_c):
         ttbl.things.impl_c.__init__(self)
         self.port = port
         self.ykush_serial = ykush_serial
+        if self.throttle_group == None:
+            self.throttle_group = f"ykush:{ykush_serial}"
         self.retries = 10
         self.soft_retries = 4
         self.upid_set("Yepkit YKUSH power control hub %s, port #%d" % (
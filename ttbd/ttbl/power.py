@@ -208,7 +208,6 @@ import collections
 import concurrent.futures
 import errno
 import json
-import multiprocessing.process
 import numbers
 import os
 import re
@@ -218,10 +217,40 @@ import types
 import shutil
 import subprocess
 import logging
+import threading
 
 import commonl
 import ttbl
 
+#: Maximum number of power components whose state is read in parallel
+#:
+#: When getting the state of a power rail that enables it (with the
+#: *get_parallel* argument to :class:`interface`; eg: for *tcf ls -v*
+#: or *power/list*), the state of each component is read in a
+#: separate thread, so it takes as long as the slowest component and
+#: not the sum of all; set to 1 to read them one after another.
+get_threads = 16
+
+#: Maximum number of power components powered on or off in parallel
+#:
+#: When the components of a power rail declare which other components
+#: they depend on (see the *depends* argument to :class:`impl_c`),
+#: those that don't depend on each other are powered on (or off) at
+#: the same time, in up to this many threads; set to 1 to always
+#: power them on and off one after another in the rail's order.
+sequence_threads = 8
+
+#: Default time a power component's state is cached (seconds)
+#:
+#: Components that are slow to query (eg: PDUs over the network) can
+#: cache the state they report when the power rail's state is read,
+#: so it is not read again for this long; powering on or off a
+#: component invalidates its cached state.
+#:
+#: *0* disables caching; can be set for each component with
+#: the *get_cache_ttl* argument to :class:`impl_c`.
+get_cache_ttl = 0
+
 class impl_c(ttbl.tt_interface_impl_c):
     """Implementation interface to drive a  power component
 
@@ -287,15 +316,58 @@ class impl_c(ttbl.tt_interface_impl_c):
       that implement some kind of access control that should not be
       used once a machine is released.
 
+    :param float get_cache_ttl: (optional; default
+      :data:`ttbl.power.get_cache_ttl`) time in seconds the state
+      reported by :meth:`get` is cached when reading the power rail's
+      state; *0* to disable.
+
+    :param list depends: (optional; default *None*) names of the
+      components in the power rail that have to be powered on before
+      this one (and powered off after it).
+
+      By default, a component depends on the one before it in the
+      rail, so they are all powered on in order, one after
+      another. Components that declare their dependencies (even if
+      none, with an empty list) are powered on in parallel with those
+      they don't depend on (see :data:`ttbl.power.sequence_threads`),
+      eg: a few daemons that can start at the same time and the
+      power to the target, once they are all up:
+
+      >>> target.interface_add("power", ttbl.power.interface(
+      >>>     ( "dhcp", ttbl.dhcp.pci(..., depends = []) ),
+      >>>     ( "serial0", ttbl.socat.pci(..., depends = []) ),
+      >>>     ( "serial1", ttbl.socat.pci(..., depends = []) ),
+      >>>     ( "AC", ttbl.pc.dlwps7(...,
+      >>>                           depends = [ "dhcp", "serial0", "serial1" ]) ),
+      >>> ))
+
+    :param str throttle_group: (optional; default *None*) name of
+      the piece of hardware (PDU, USB hub...) this component acts
+      on. When the server starts, the deferred power actions of
+      targets whose components share a group are throttled together
+      (see :func:`execute_defer_list`). Drivers for PDUs and USB hubs
+      default it to a name for the unit they control; set it to put
+      other components in the same group (eg: USB devices connected to
+      the same hub).
+
     """
     def __init__(self, paranoid = False, explicit = None,
                  ignore_get = False, ignore_get_errors = False,
-                 off_on_release = False):
+                 off_on_release = False, get_cache_ttl: float = None,
+                 depends: list = None, throttle_group: str = None):
         assert isinstance(paranoid, bool)
         assert isinstance(ignore_get, bool)
         assert isinstance(ignore_get_errors, bool)
         assert isinstance(off_on_release, bool)
         assert explicit in ( None, 'on', 'off', 'both' )
+        assert get_cache_ttl == None \
+            or isinstance(get_cache_ttl, numbers.Real) and get_cache_ttl >= 0
+        assert depends == None \
+            or isinstance(depends, list) \
+            and all(isinstance(i, str) for i in depends), \
+            f"depends: expected list of component names; got {depends}"
+        assert throttle_group == None or isinstance(throttle_group, str), \
+            f"throttle_group: expected str; got {type(throttle_group)}"
         #: If the power on fails, automatically retry it by powering
         #: first off, then on again
         self.power_on_recovery = False
@@ -306,6 +378,9 @@ class impl_c(ttbl.tt_interface_impl_c):
         self.ignore_get = ignore_get
         self.ignore_get_errors = ignore_get_errors
         self.off_on_release = off_on_release
+        self.get_cache_ttl = get_cache_ttl
+        self.depends = depends
+        self.throttle_group = throttle_group
         #: for paranoid power getting, now many samples we need to get
         #: that are the same for the value to be considered stable
         self.paranoid_get_samples = 6
@@ -329,6 +404,8 @@ class impl_c(ttbl.tt_interface_impl_c):
             assert wait == None or wait > 0
             Exception.__init__(self)
             self.wait = wait
+            #: component that raised it, filled in by the power interface
+            self.component = None
 
     class error_e(Exception):
         "generic power implementation error"
@@ -362,10 +439,11 @@ class impl_c(ttbl.tt_interface_impl_c):
 
         Same parameters as :meth:`on`
 
-        WARNING! This function can be called fro multiple *processes*
-        (not threads, we never do threads) at the same time, so if
-        there is common resource access, you might have to protect it,
-        eg: to access a serial port
+        WARNING! This function can be called from multiple *processes*
+        and threads (the states of the components in a power rail can
+        be read in parallel, see :data:`ttbl.power.get_threads`) at the
+        same time, so if there is common resource access, you might
+        have to protect it, eg: to access a serial port
 
         >>> tty_dev_base = os.path.basename(tty_dev)
         >>> try:
@@ -403,16 +481,217 @@ class impl_c(ttbl.tt_interface_impl_c):
                                   % (target.id, component))
 
 
+#: Time the state of the outlets in a PDU read in bulk is valid (seconds)
+#:
+#: See :class:`pdu_poller_c`.
+pdu_state_freshness = 2
 
-def _impl_get_trampoline(fn_impl_get: callable, impl: impl_c,
-                         target: ttbl.test_target, component: str) -> tuple:
-    try:
-        return fn_impl_get(impl, target, component), None, None
-    except Exception as e:
-        # we can't pickle tracebacks, so we send them as a
-        # formated traceback so we can at least do some debugging
-        tb = traceback.format_exception(type(e), e, e.__traceback__)
-        return None, e, tb
+#: Maximum time to wait for a PDU to report an outlet in the state
+#: it was set to (seconds)
+#:
+#: See :meth:`pdu_poller_c.invalidate`.
+pdu_state_expect_timeout = 30
+
+class pdu_poller_c:
+    """
+    Read the state of all the outlets of a PDU at once and share it
+
+    Drivers for PDUs that can report the state of all their outlets
+    in one call (eg: one HTTP request, one SNMP walk) use one of these
+    per PDU (see :func:`pdu_poller_get`) instead of querying each
+    outlet in :meth:`impl_c.get`; thus getting the state of all the
+    targets powered by a PDU (eg: refreshing the inventory, maintaining
+    the targets) is a single round trip to it:
+
+    - the state of all the outlets is read with *fetch_fn* and used to
+      answer queries for *freshness* seconds
+
+    - if the state is being read when a query comes, the query waits
+      for it instead of reading it again
+
+    >>> class my_pdu_pc(ttbl.power.impl_c):
+    >>>     ...
+    >>>     def _states_fetch(self):
+    >>>         # return { OUTLET: STATE } for all the outlets
+    >>>         ...
+    >>>
+    >>>     def get(self, target, component):
+    >>>         poller = ttbl.power.pdu_poller_get(self.hostname,
+    >>>                                            self._states_fetch)
+    >>>         return poller.state_get(self.outlet)
+    >>>
+    >>>     def on(self, target, component):
+    >>>         ...
+    >>>         ttbl.power.pdu_poller_get(self.hostname, self._states_fetch)\\
+    >>>             .invalidate(self.outlet, True)
+
+    Note the state is shared only by the threads in a process.
+
+    :param str name: name of the PDU (eg: its hostname)
+    :param callable fetch_fn: function that takes no arguments and
+      returns a dictionary keyed by outlet with the state of each
+      (*True* on, *False* off, *None* unknown)
+    :param float freshness: (optional; default
+      :data:`pdu_state_freshness`) seconds the state read is valid
+    """
+    def __init__(self, name, fetch_fn, freshness = None):
+        assert isinstance(name, str)
+        assert callable(fetch_fn)
+        assert freshness == None \
+            or isinstance(freshness, numbers.Real) and freshness >= 0
+        self.name = name
+        self.fetch_fn = fetch_fn
+        self.freshness = freshness
+        self.pid = os.getpid()
+        #: Count of operations: *fetches* (bulk reads from the PDU),
+        #: *hits* (queries answered from the last bulk read),
+        #: *coalesced* (queries that waited for a bulk read in
+        #: progress), *errors*
+        self.stats = collections.Counter()
+        self._cond = threading.Condition()
+        self._snapshot = None
+        self._ts = None
+        # bumped on invalidate(), so a bulk read in progress when
+        # invalidated is not used
+        self._generation = 0
+        self._fetching = False
+        self._fetch_count = 0
+        self._error = None
+        # OUTLET -> ( STATE, TIMESTAMP ), see invalidate()
+        self._expected = {}
+
+    def _snapshot_valid(self, outlet, ts_now):
+        if self._snapshot == None:
+            return False
+        freshness = self.freshness
+        if freshness == None:
+            freshness = pdu_state_freshness
+        if ts_now - self._ts >= freshness:
+            return False
+        expected = self._expected.get(outlet, None)
+        if expected == None:
+            return True
+        state, ts = expected
+        if self._snapshot.get(outlet, None) == state \
+           or ts_now - ts > pdu_state_expect_timeout:
+            del self._expected[outlet]
+            return True
+        return False	# not yet there, read it again
+
+    def state_get(self, outlet):
+        """
+        Get the state of an outlet
+
+        :param outlet: outlet, as reported by *fetch_fn*
+        :returns: the outlet's state as reported by *fetch_fn* (*None*
+          if not reported)
+        :raises: any exception *fetch_fn* raised
+        """
+        fetch_count = None
+        with self._cond:
+            while True:
+                if self._snapshot_valid(outlet, time.time()):
+                    self.stats['hits'] += 1
+                    return self._snapshot.get(outlet, None)
+                if fetch_count != None and fetch_count != self._fetch_count \
+                   and self._error != None:
+                    # the read we waited for failed, don't retry
+                    raise self._error
+                if not self._fetching:
+                    break
+                # someone else is reading, wait for it
+                fetch_count = self._fetch_count
+                self.stats['coalesced'] += 1
+                self._cond.wait()
+            self._fetching = True
+            generation = self._generation
+
+        ts = time.time()
+        snapshot = None
+        error = None
+        try:
+            snapshot = self.fetch_fn()
+        except Exception as e:
+            error = e
+        with self._cond:
+            self._fetching = False
+            self._fetch_count += 1
+            self._error = error
+            self.stats['fetches'] += 1
+            if error != None:
+                self.stats['errors'] += 1
+            elif generation == self._generation:
+                self._snapshot = snapshot
+                self._ts = ts
+            self._cond.notify_all()
+        if error != None:
+            raise error
+        return snapshot.get(outlet, None)
+
+    def invalidate(self, outlet = None, state = None):
+        """
+        Invalidate the state read from the PDU
+
+        Call after changing the state of an outlet, so the next
+        queries read it again from the PDU.
+
+        :param outlet: (optional) outlet whose state was changed
+        :param bool state: (optional) state *outlet* was set to; as
+          some PDUs take a while to report changes, until the state
+          read shows it (or :data:`pdu_state_expect_timeout` seconds
+          pass), queries for *outlet* read it again from the PDU
+        """
+        with self._cond:
+            self._generation += 1
+            self._snapshot = None
+            if outlet != None and state != None:
+                self._expected[outlet] = ( state, time.time() )
+
+
+def _tls_wrap(fn):
+    # Return a function that runs fn with the thread-local context of
+    # the calling thread (eg: the interface being called, used to
+    # decide if the inventory is updated), to run it in another thread
+    interface = getattr(ttbl.tls, "interface", None)
+    iface = getattr(ttbl.tls, "iface", None)
+
+    def _fn(*args, **kwargs):
+        ttbl.tls.interface = interface
+        ttbl.tls.iface = iface
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            ttbl.tls.interface = None
+            ttbl.tls.iface = None
+
+    return _fn
+
+
+_pdu_pollers = {}
+_pdu_pollers_lock = threading.Lock()
+
+def pdu_poller_get(name, fetch_fn, freshness = None):
+    """
+    Get the poller for a PDU, creating it if needed
+
+    :param str name: name of the PDU (eg: its hostname); needs to be
+      unique
+    :param callable fetch_fn: function to read the state of all the
+      outlets (see :class:`pdu_poller_c`); it replaces the one given
+      in previous calls (eg: in case the credentials changed)
+    :param float freshness: (optional) see :class:`pdu_poller_c`
+    :returns pdu_poller_c: poller
+    """
+    with _pdu_pollers_lock:
+        poller = _pdu_pollers.get(name, None)
+        # a poller from before forking the process can't be used, its
+        # condition might be held by a thread that doesn't exist here
+        if poller == None or poller.pid != os.getpid():
+            poller = pdu_poller_c(name, fetch_fn, freshness = freshness)
+            _pdu_pollers[name] = poller
+        else:
+            poller.fetch_fn = fetch_fn
+        return poller
 
 
 
@@ -424,6 +703,17 @@ class interface(ttbl.tt_interface):
     target, which can be a single switch or a whole power rail of
     components that have to be powered on and off in an specific
     sequence.
+
+    :param bool get_parallel: (optional; default *False*) read the
+      state of the components in parallel (up to
+      :data:`ttbl.power.get_threads` at the same time); otherwise
+      read them one after another.
+
+      Components acting on the same piece of hardware (those with the
+      same *throttle_group*, see :class:`impl_c`) are still read one
+      after another, as their drivers might not support concurrent
+      access. Enable only if the rest of the components' drivers
+      do.
     """
 
     def __init__(self, *impls, get_parallel: bool = False, **kwimpls):
@@ -435,12 +725,26 @@ class interface(ttbl.tt_interface):
         # each rail component matters.
         self.impls_set(impls, kwimpls, impl_c)
         self.get_parallel = get_parallel
+        # TARGETNAME -> name of this interface in the target, to
+        # name the cached states (eg: the same component name can be
+        # in the *power* and *buttons* interfaces)
+        self._iface_names = {}
+        # TARGETNAME -> fsdb where the cached states are kept
+        self._cache_fsdbs = {}
+        #: Timeline of the last power on or off done in parallel, by
+        #: target name (for diagnostics): dictionary with fields *op*
+        #: (*on* or *off*), *timeline* (dictionary of ( START, END )
+        #: times in seconds, relative to the start, keyed by component
+        #: name, for those powered on/off) and *critical_path* (list
+        #: of the components that determined how long it took)
+        self.timelines = {}
 
 
 
     def _target_setup(self, target, iface_name):
         # Called when the interface is added to a target to initialize
         # the needed target aspect (such as adding tags/metadata)
+        self._iface_names[target.id] = iface_name
         for name, impl in self.impls.items():
             # check this here so if the impl doesn't inherit
             # ttbl.power.impl_c, it is still checked
@@ -451,6 +755,22 @@ class interface(ttbl.tt_interface):
                 "power component '%s': impls' explicit value is %s;" \
                 " expected None, 'on', 'off' or 'both'" % (name, impl.implicit)
             impl.target_setup(target, iface_name, name)
+        # the components have to depend on existing components and
+        # not on each other in a loop
+        deps = self._graph_deps(list(self.impls.items()))
+        for name, impl in self.impls.items():
+            for dep in getattr(impl, "depends", None) or []:
+                assert dep in self.impls, \
+                    f"power component '{name}': depends on unknown" \
+                    f" component '{dep}'"
+        done = set()
+        while len(done) < len(deps):
+            ready = [ name for name, name_deps in deps.items()
+                      if name not in done and name_deps <= done ]
+            assert ready, \
+                "power components depend on each other in a loop: " \
+                + " ".join(sorted(set(deps) - done))
+            done.update(ready)
 
     def _release_hook(self, target, _force):
         # nothing to do on target release
@@ -459,7 +779,10 @@ class interface(ttbl.tt_interface):
         for component, impl in self.impls.items():
             if impl.off_on_release:
                 target.log.info(f"{component}: powering off upon release")
-                impl.off(target, component)
+                try:
+                    impl.off(target, component)
+                finally:
+                    self._cache_invalidate(impl, target, component)
                 target.log.info(f"{component}: powered off upon release")
 
 
@@ -467,68 +790,76 @@ class interface(ttbl.tt_interface):
         # calls the implementation function to do the ON operation,
         # being sure to check if it has actually accomplished it if
         # the paranoid flag is set
-        if not impl.paranoid:
-            impl.on(target, component)
-            return
-
-        ts0 = ts = time.time()
-        while ts - ts0 < impl.timeout:
-            try:
+        try:
+            if not impl.paranoid:
                 impl.on(target, component)
-            except impl.error_e as e:
-                target.log.error("%s: impl failed powering on +%.1f;"
-                                 " powering off and retrying: %s",
-                                 component, ts - ts0, e)
+                return
+
+            ts0 = ts = time.time()
+            while ts - ts0 < impl.timeout:
                 try:
-                    self._impl_off(impl, target, component)
+                    impl.on(target, component)
                 except impl.error_e as e:
-                    target.log.exception(
-                        "%s: impl failed recovery power off +%.1f;"
-                        " ignoring for retry: %s",
-                        component, ts - ts0, e)
-            else:
-                target.log.info("%s: impl powered on +%.1fs",
+                    target.log.error("%s: impl failed powering on +%.1f;"
+                                     " powering off and retrying: %s",
+                                     component, ts - ts0, e)
+                    try:
+                        self._impl_off(impl, target, component)
+                    except impl.error_e as e:
+                        target.log.exception(
+                            "%s: impl failed recovery power off +%.1f;"
+                            " ignoring for retry: %s",
+                            component, ts - ts0, e)
+                else:
+                    target.log.info("%s: impl powered on +%.1fs",
+                                    component, ts - ts0)
+                # let's check the status, because sometimes with
+                # transitions on its own
+                new_state = self._impl_get(impl, target, component)
+                if new_state == None or new_state == True: # check
+                    return
+                target.log.info("%s: impl didn't power on +%.1f retrying",
                                 component, ts - ts0)
-            # let's check the status, because sometimes with
-            # transitions on its own
-            new_state = self._impl_get(impl, target, component)
-            if new_state == None or new_state == True: # check
-                return
-            target.log.info("%s: impl didn't power on +%.1f retrying",
-                            component, ts - ts0)
-            time.sleep(impl.wait)
-            ts = time.time()
-        raise RuntimeError("%s: impl power-on timed out after %.1fs"
-                           % (component, ts - ts0))
+                time.sleep(impl.wait)
+                ts = time.time()
+            raise RuntimeError("%s: impl power-on timed out after %.1fs"
+                               % (component, ts - ts0))
+        finally:
+            # whatever happened, what we knew of its state is stale
+            self._cache_invalidate(impl, target, component)
 
     def _impl_off(self, impl, target, component):
         # calls the implementation function to do the OFF operation,
         # being sure to check if it has actually accomplished it if
         # the paranoid flag is set
-        if not impl.paranoid:
-            impl.off(target, component)
-            return
-
-        ts0 = ts = time.time()
-        while ts - ts0 < impl.timeout:
-            try:
+        try:
+            if not impl.paranoid:
                 impl.off(target, component)
-            except impl.error_e as e:
-                target.log.error("%s: impl failed powering off +%.1f;"
-                                 " retrying: %s", component, ts - ts0, e)
-            else:
-                target.log.info("%s: impl powered off +%.1fs",
-                                component, ts - ts0)
-            # maybe it worked, let's checked
-            new_state = self._impl_get(impl, target, component)
-            if new_state == None or new_state == False: # check
                 return
-            target.log.info("%s: ipmi didn't power off +%.1f retrying",
-                                component, ts - ts0)
-            time.sleep(impl.wait)
-            ts = time.time()
-        raise RuntimeError("%s: impl power-off timed out after %.1fs"
-                           % (component, ts - ts0))
+
+            ts0 = ts = time.time()
+            while ts - ts0 < impl.timeout:
+                try:
+                    impl.off(target, component)
+                except impl.error_e as e:
+                    target.log.error("%s: impl failed powering off +%.1f;"
+                                     " retrying: %s", component, ts - ts0, e)
+                else:
+                    target.log.info("%s: impl powered off +%.1fs",
+                                    component, ts - ts0)
+                # maybe it worked, let's checked
+                new_state = self._impl_get(impl, target, component)
+                if new_state == None or new_state == False: # check
+                    return
+                target.log.info("%s: ipmi didn't power off +%.1f retrying",
+                                    component, ts - ts0)
+                time.sleep(impl.wait)
+                ts = time.time()
+            raise RuntimeError("%s: impl power-off timed out after %.1fs"
+                               % (component, ts - ts0))
+        finally:
+            # whatever happened, what we knew of its state is stale
+            self._cache_invalidate(impl, target, component)
 
     @staticmethod
     def _impl_get(impl, target, component):
@@ -570,6 +901,125 @@ class interface(ttbl.tt_interface):
             % (component, ts - ts0, " ".join(str(r) for r in results)))
 
 
+    @staticmethod
+    def _impl_cache_ttl(impl):
+        ttl = getattr(impl, "get_cache_ttl", None)
+        if ttl == None:
+            return get_cache_ttl
+        return ttl
+
+    def _cache_fsdb(self, target):
+        # the cache is kept on disk, so it is shared by all the
+        # daemon's processes and invalidated for all of them
+        fsdb = self._cache_fsdbs.get(target.id, None)
+        if fsdb == None:
+            dirname = os.path.join(target.state_dir, "power-cache")
+            commonl.makedirs_p(dirname)
+            fsdb = commonl.fsdb_symlink_c(dirname)
+            self._cache_fsdbs[target.id] = fsdb
+        return fsdb
+
+    def _cache_key(self, target, component):
+        return self._iface_names.get(target.id, "power") + "." + component
+
+    def _cache_invalidate(self, impl, target, component):
+        # Invalidate the cached state of a component by changing its
+        # generation
+        #
+        # Done after powering it on or off, so a state read while we
+        # were at it is not used either
+        if self._impl_cache_ttl(impl) <= 0:
+            return
+        key = self._cache_key(target, component)
+        self._cache_fsdb(target).set(
+            key + ".generation", "%x-%x" % (time.time_ns(), os.getpid()))
+
+    def _impl_get_cached(self, impl, target, component):
+        # _impl_get(), but use the cached state if fresh enough
+        ttl = self._impl_cache_ttl(impl)
+        if ttl <= 0:
+            return self._impl_get(impl, target, component)
+        fsdb = self._cache_fsdb(target)
+        key = self._cache_key(target, component)
+        # get the generation before reading, so if it is powered on
+        # or off while reading, what we read is not used
+        generation = fsdb.get(key + ".generation", "0")
+        cached = fsdb.get(key, None)
+        if cached:
+            cached_generation, ts, state = cached.split(" ")
+            if cached_generation == generation \
+               and time.time() - float(ts) < ttl:
+                return json.loads(state)
+        state = self._impl_get(impl, target, component)
+        if state == None or isinstance(state, bool):
+            fsdb.set(key, f"{generation} {time.time()} {json.dumps(state)}")
+        return state
+
+    def _get_component(self, target, component, impl):
+        try:
+            return self._impl_get_cached(impl, target, component)
+        except impl.error_e as e:
+            if not impl.ignore_get_errors:
+                raise
+            # if this is an explicit component, ignore any errors
+            # and just assume we are not using this for real power
+            # control
+            target.log.error(
+                "%s: ignoring power state error from explicit power component: %s"
+                % (component, e))
+            return None
+
+    def _get_components_serial(self, target, impls):
+        return [
+            ( component, impl, self._get_component(target, component, impl) )
+            for component, impl in impls
+        ]
+
+    def _get_components(self, target, impls_non_aliased):
+        # get the state of each component; return a list of
+        # (COMPONENT, IMPL, STATE) in the same order
+        if not self.get_parallel or get_threads <= 1 \
+           or len(impls_non_aliased) <= 1:
+            return self._get_components_serial(
+                target, impls_non_aliased.items())
+
+        # components that act on the same piece of hardware
+        # (throttle_group) are read serially in the same thread
+        groups = collections.OrderedDict()
+        for component, impl in impls_non_aliased.items():
+            if impl.throttle_group == None:
+                group = ( None, component )
+            else:
+                group = impl.throttle_group
+            groups.setdefault(group, []).append(( component, impl ))
+        if len(groups) <= 1:
+            return self._get_components_serial(
+                target, impls_non_aliased.items())
+
+        # Run in parallel all the get operations: this way very large
+        # power rails (which can happen once you add different
+        # components and detectors and retries) take as long as
+        # the slowest component.
+        #
+        # The get() operations are mostly I/O bound, so threads work
+        # fine; they can't be processes, since targets and impls
+        # can't always be pickled (eg: SSL contexts).
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers = min(len(groups), get_threads),
+                thread_name_prefix = "power-get") as executor:
+            futures = [
+                executor.submit(_tls_wrap(self._get_components_serial),
+                                target, impls)
+                for impls in groups.values()
+            ]
+            # result() raises the get()'s exception, if any
+            states = {}
+            for future in futures:
+                for component, impl, state in future.result():
+                    states[component] = ( component, impl, state )
+            return [ states[component] for component in impls_non_aliased ]
+
+
     def _get(self, target, impls = None, whole_rail: bool = True):
         # get the power state for the target's given power components,
         # keep data ordered, makes more sense
@@ -588,129 +1038,27 @@ class interface(ttbl.tt_interface):
                 component = self.aliases[component]
             impls_non_aliased[component] = impl
 
-        # ugly trick: remove current processes's daemon setting to
-        # fake the concurrent futures processpoolexecutor, which
-        # as of Pyhton 3.11 doesn't allow them for unknown reaosns
-        # and in Stackoverflow everyone and their mum just fakes
-        # it. Note we'll reset it later  in the finally block
-        current_process = multiprocessing.process.current_process()
-        _config = getattr(current_process, "_config", None)
-        daemon_orig = _config.get('daemon', None)
-        _config['daemon'] = False
-
-
-        if not self.get_parallel:
-            # Run serially all the get operations
-            #
-            # We still default to this since we are having issues in
-            # parallelizing / pickling, it trips in SSLcontexts which
-            # we are not sure where it comes from.
-            for component, impl in impls_non_aliased.items():
-                # need to get state for the real one!
-                if component in self.aliases:
-                    component_real = self.aliases[component]
-                else:
-                    component_real = component
-                try:
-                    state = self._impl_get(impl, target, component_real)
-                except impl.error_e as e:
-                    if not impl.ignore_get_errors:
-                        raise
-                    # if this is an explicit component, ignore any errors
-                    # and just assume we are not using this for real power
-                    # control
-                    target.log.error(
-                        "%s: ignoring power state error from explicit power component: %s"
-                        % (component, e))
-                    state = None
-                self.assert_return_type(state, bool, target,
-                                        component, "power.get", none_ok = True)
-                data[component] = {
-                    "state": state
-                }
-                if impl.explicit:
-                    data[component]['explicit'] = impl.explicit
-                if impl.explicit == None:
-                    normal[component] = state
-                elif impl.explicit == 'both':
-                    explicit[component] = state
-                elif impl.explicit == 'on':
-                    explicit_on[component] = state
-                elif impl.explicit == 'off':
-                    explicit_off[component] = state
-                else:
-                    raise AssertionError(
-                        "BUG! component %s: unknown explicit tag '%s'" %
-                        (component, impl.explicit))
-
-        else:
-            # Run in parallel all the get operations: this way very large
-            # power rails (which can happen once you add different
-            # components and detectors and retries) are not that painful
-            # to run frequently.
-            #
-            # Note the get() operations are mostly I/O bound, but still we
-            # use processes rather than threads, so we are not contenting
-            # for the Python GIL and they are truly running in parallel
-            executor = concurrent.futures.ProcessPoolExecutor(len(impls_non_aliased))
-            try:
-
-                futures = {
-                    # for each target id, queue a thread that will call
-                    # _run_on_by_targetid(), who will call fn taking care
-                    # of exceptions
-
-                    # self.aliases.get(component, component): gets the real
-                    # component name if there is an alias; if there is no alias, we just use
-                    # the component name we got
-                    component: executor.submit(_impl_get_trampoline, self._impl_get,
-                                               impl, target, component)
-                    for component, impl in impls_non_aliased.items()
-                }
-
-                for component in futures:
-                    impl = self.impls[component]
-                    try:
-                        state, e, tb = futures[component].result()
-                    except Exception as e:
-                        target.log.error(
-                            "BUG!? %s: exception getting _get() result: %s",
-                            component, e, exc_info = True)
-                        continue
-                    if e:
-                        # if the call to _get() for the driver got an issue
-                        if not impl.ignore_get_errors:
-                            raise
-                        # if this is an explicit component, ignore any errors
-                        # and just assume we are not using this for real power
-                        # control
-                        target.log.error(
-                            "%s: ignoring power state error from explicit"
-                            " power component: %s: %s",
-                            component, e, tb)
-                        state = None
-                    self.assert_return_type(state, bool, target,
-                                            component, "power.get", none_ok = True)
-                    data[component] = {
-                        "state": state
-                    }
-                    if impl.explicit:
-                        data[component]['explicit'] = impl.explicit
-                    if impl.explicit == None:
-                        normal[component] = state
-                    elif impl.explicit == 'both':
-                        explicit[component] = state
-                    elif impl.explicit == 'on':
-                        explicit_on[component] = state
-                    elif impl.explicit == 'off':
-                        explicit_off[component] = state
-                    else:
-                        raise AssertionError(
-                            "BUG! component %s: unknown explicit tag '%s'" %
-                            (component, impl.explicit))
-                executor.shutdown(wait = True)
-            finally:
-                _config['daemon'] = daemon_orig
+        for component, impl, state in \
+            self._get_components(target, impls_non_aliased):
+            self.assert_return_type(state, bool, target,
+                                    component, "power.get", none_ok = True)
+            data[component] = {
+                "state": state
+            }
+            if impl.explicit:
+                data[component]['explicit'] = impl.explicit
+            if impl.explicit == None:
+                normal[component] = state
+            elif impl.explicit == 'both':
+                explicit[component] = state
+            elif impl.explicit == 'on':
+                explicit_on[component] = state
+            elif impl.explicit == 'off':
+                explicit_off[component] = state
+            else:
+                raise AssertionError(
+                    "BUG! component %s: unknown explicit tag '%s'" %
+                    (component, impl.explicit))
 
         # What state are we in?
         #
@@ -753,17 +1101,114 @@ class interface(ttbl.tt_interface):
         return state, data, substate
 
 
-    def _off(self, target, impls, why, whole_rail = True, explicit = False):
-        #
-        # Power off everything
+    def _graph_deps(self, impls):
+        # Return a dict keyed by the components in impls with the set
+        # of components in impls that have to be powered on before
+        # each; components that don't declare dependencies go after
+        # the one before them in the rail, as always
+        names = set(component for component, _impl in impls)
+        deps = {}
+        previous = None
+        for component, impl in impls:
+            depends = getattr(impl, "depends", None)
+            if depends == None:
+                deps[component] = { previous } if previous else set()
+            else:
+                deps[component] = set(depends) & names
+            previous = component
+        return deps
+
+    @staticmethod
+    def _graph_needed(impls):
+        # only if declared, otherwise it is all in rail order
+        if sequence_threads <= 1:
+            return False
+        for _component, impl in impls:
+            if getattr(impl, "depends", None) != None:
+                return True
+        return False
+
+    def _graph_run(self, target, impls, deps, fn, op, why):
+        # Call fn(impl, component) for each component in impls once
+        # all the components in deps[component] are done, in
+        # parallel when possible
         #
-        # We only power off whatever is on, hence why we ask what is
-        # on first.
+        # fn returns False if it skipped the component; on the first
+        # exception no more components are started and, once the
+        # ones running are done, it is raised.
         #
-        # If the user asked for the whole rail, then we'll also run
-        # the pre/post hooks.
-        _state, data, _substate = self._get(target, impls, whole_rail)
+        # Logs and returns the timeline (see timelines).
+        impls_by_name = dict(impls)
+        pending = collections.OrderedDict(
+            ( component, set(deps[component]) ) for component, _ in impls)
+        timeline = collections.OrderedDict()
+        ts0 = time.time()
+
+        def _fn(component):
+            ts = time.time()
+            if fn(impls_by_name[component], component) != False:
+                timeline[component] = ( ts - ts0, time.time() - ts0 )
+
+        running = {}
+        error = None
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers = sequence_threads,
+                thread_name_prefix = "power-sequence") as executor:
+            while pending or running:
+                if error == None:
+                    for component in [ component
+                                       for component, component_deps
+                                       in pending.items()
+                                       if not component_deps ]:
+                        del pending[component]
+                        running[executor.submit(
+                            _tls_wrap(_fn), component)] = component
+                if not running:
+                    break	# failed, the rest is not to be started
+                done, _ = concurrent.futures.wait(
+                    running, return_when = concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    component = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as e:
+                        if error == None:
+                            error = e
+                        continue
+                    for component_deps in pending.values():
+                        component_deps.discard(component)
+
+        self._timeline_report(target, deps, timeline, op, why)
+        if error != None:
+            raise error
+        return timeline
 
+    def _timeline_report(self, target, deps, timeline, op, why):
+        if not timeline:
+            return
+        # the critical path is the chain of components, each waiting
+        # on the previous, that ended last
+        def _end(component):
+            return timeline[component][1]
+
+        critical_path = []
+        components = list(timeline)
+        while components:
+            component = max(components, key = _end)
+            critical_path.insert(0, component)
+            components = [ dep for dep in deps[component] if dep in timeline ]
+        target.log.info(
+            "power-%s timeline%s: %s; critical path %s (%.2fs)",
+            op, why,
+            " ".join(f"{component}[+{start:.2f}s {end - start:.2f}s]"
+                     for component, ( start, end ) in timeline.items()),
+            " > ".join(critical_path),
+            max(end for _start, end in timeline.values()))
+        self.timelines[target.id] = dict(
+            op = op, timeline = timeline, critical_path = critical_path)
+
+
+    def _off_pre(self, target, why, whole_rail):
         target.log.info("powering off%s" % why)
         if whole_rail:
             target.log.debug(
@@ -773,43 +1218,7 @@ class interface(ttbl.tt_interface):
                 f(target)
             target.log.debug("power pre-off%s done" % why)
 
-        for component, impl in reversed(impls):
-            if component in self.aliases:
-                if whole_rail:
-                    # operate only on real ones when going over the whole rail
-                    target.log.debug("%s: power off%s: skipping (alias)"
-                                     % (component, why))
-                    continue
-                component_real = self.aliases[component]
-            else:
-                component_real = component
-            if data[component]['state'] == False:
-                target.log.debug("%s: powering off%s: skipping (already off)"
-                                 % (component, why))
-                continue            	# it says it is off, so we skip it
-            if whole_rail \
-               and impl.explicit in ( "off", "both" ) and not explicit:
-                target.log.debug("%s: powering off%s: skipping (explicit/%s)"
-                                 % (component, why, impl.explicit))
-                continue            	# it says it is off, so we skip it
-
-            target.log.debug("%s: powering off%s" % (component, why))
-            try:		        # we retry power off twice
-                self._impl_off(impl, target, component_real)
-                continue
-            except Exception as e:	# pylint: disable = broad-except
-                target.log.error("%s: power off%s: failed; retrying: %s"
-                                 % (component, why, e))
-            try:
-                self._impl_off(impl, target, component_real)
-                continue
-            except Exception as e:	# pylint: disable = broad-except
-                target.log.error(
-                    "%s: power off%s: failed twice; skipping: %s\n%s"
-                    % (component, why, e, traceback.format_exc()))
-                # we don't raise no more, we want to be able to
-                # cleanup state and continue with the rest
-                target.log.debug("%s: powered off%s" % (component, why))
+    def _off_post(self, target, why, whole_rail, explicit):
         if whole_rail:
             target.log.debug(
                 "power post-off%s; fns %s"
@@ -827,23 +1236,81 @@ class interface(ttbl.tt_interface):
             target.fsdb.set('powered', None)
         target.log.info("powered off%s" % why)
 
+    def _component_off(self, target, impl, component, why, data,
+                       whole_rail, explicit):
+        # power off a component of the rail, if needed; return False
+        # if skipped
+        if component in self.aliases:
+            if whole_rail:
+                # operate only on real ones when going over the whole rail
+                target.log.debug("%s: power off%s: skipping (alias)"
+                                 % (component, why))
+                return False
+            component_real = self.aliases[component]
+        else:
+            component_real = component
+        if data[component]['state'] == False:
+            target.log.debug("%s: powering off%s: skipping (already off)"
+                             % (component, why))
+            return False            	# it says it is off, so we skip it
+        if whole_rail \
+           and impl.explicit in ( "off", "both" ) and not explicit:
+            target.log.debug("%s: powering off%s: skipping (explicit/%s)"
+                             % (component, why, impl.explicit))
+            return False            	# it says it is off, so we skip it
+
+        target.log.debug("%s: powering off%s" % (component, why))
+        try:		        # we retry power off twice
+            self._impl_off(impl, target, component_real)
+            return True
+        except Exception as e:	# pylint: disable = broad-except
+            target.log.error("%s: power off%s: failed; retrying: %s"
+                             % (component, why, e))
+        try:
+            self._impl_off(impl, target, component_real)
+            return True
+        except Exception as e:	# pylint: disable = broad-except
+            target.log.error(
+                "%s: power off%s: failed twice; skipping: %s\n%s"
+                % (component, why, e, traceback.format_exc()))
+            # we don't raise no more, we want to be able to
+            # cleanup state and continue with the rest
+            target.log.debug("%s: powered off%s" % (component, why))
+        return True
 
-    def _on(self, target, impls, why, whole_rail = True, explicit = False):
+    def _off(self, target, impls, why, whole_rail = True, explicit = False):
         #
-        # Power on
+        # Power off everything
         #
-        # We only power on whatever is off, hence why we ask what is
-        # off first. Power rails have to always be powered on in the
-        # same sequence, so if it is half off half on, it should be
-        # powered off first. But that's the user's call (use cycle())
+        # We only power off whatever is on, hence why we ask what is
+        # on first.
         #
         # If the user asked for the whole rail, then we'll also run
         # the pre/post hooks.
-        #
-        # Recovery can be quite painful, since we might have to retry
-        # (a single component) or the whole rail. Code gets ugly.
         _state, data, _substate = self._get(target, impls, whole_rail)
 
+        self._off_pre(target, why, whole_rail)
+        if self._graph_needed(impls):
+            # in parallel, a component after all the ones that depend
+            # on it are off
+            deps_on = self._graph_deps(impls)
+            deps = dict(( component, set() ) for component in deps_on)
+            for component, component_deps in deps_on.items():
+                for dep in component_deps:
+                    deps[dep].add(component)
+            self._graph_run(
+                target, list(reversed(impls)), deps,
+                lambda impl, component: self._component_off(
+                    target, impl, component, why, data, whole_rail, explicit),
+                "off", why)
+        else:
+            for component, impl in reversed(impls):
+                self._component_off(target, impl, component, why, data,
+                                    whole_rail, explicit)
+        self._off_post(target, why, whole_rail, explicit)
+
+
+    def _on_pre(self, target, why, whole_rail):
         target.log.info("powering on%s" % why)
         if whole_rail:
             # since we are powering on, let's have whoever does this
@@ -857,42 +1324,148 @@ class interface(ttbl.tt_interface):
                 f(target)
             target.log.debug("power pre-on%s done" % why)
 
+    def _on_post(self, target, why, whole_rail, explicit):
+        if whole_rail:
+            target.log.debug(
+                "power post-on%s; fns: %s"
+                % (why, " ".join(str(f) for f in target.power_on_post_fns)))
+            for f in target.power_on_post_fns:
+                f(target)
+            target.log.debug("power post-on%s: done" % why)
+        if not isinstance(why, str):
+            raise TypeError(type(why))
+        target.log.info("powered on%s" % why)
+        if whole_rail and getattr(ttbl.tls, 'interface', None) == "power":
+            # update full power state in inventory ONLY if we are
+            # using this call in the *power* interface (eg not as part
+            # of the *buttons* interface)
+            target.fsdb.set('interfaces.power.state', True)
+            target.fsdb.set('interfaces.power.substate',
+                            "full" if explicit else "normal")
+            target.fsdb.set('powered', "On")
+
+    def _component_on(self, target, impl, component, why, data,
+                      whole_rail, explicit):
+        # power on a component of the rail, if needed; return False if
+        # skipped
+        #
+        # If it fails, retry by powering it off and then on again, if
+        # the component allows it; impl_c.retry_all_e is raised for
+        # the caller to retry the whole rail.
+        recovery_wait = 0.5
+        if component in self.aliases:
+            if whole_rail:
+                # operate only on real ones when going over the whole rail
+                target.log.debug("%s: power off%s: skipping (alias)"
+                                 % (component, why))
+                return False
+            component_real = self.aliases[component]
+        else:
+            component_real = component
+        if whole_rail \
+           and impl.explicit in ( "on", "both" ) and not explicit:
+            target.log.debug("%s: powering on%s: skipping (explicit/%s)"
+                             % (component, why, impl.explicit))
+            return False            	# it says it is off, so we skip it
+        if data[component]['state'] == True:
+            target.log.debug("%s: powering on%s: skipping (already on)"
+                             % (component, why))
+            return False            	# it says it is off, so we skip it
+        target.log.debug("%s: powering on%s" % (component, why))
+        try:
+            self._impl_on(impl, target, component_real)	# ok, power ir on
+            target.log.debug("%s: powered on%s" % (component, why))
+            return True
+
+        except impl_c.retry_all_e as e:
+            e.component = component
+            raise
+
+        except Exception as e:	# pylint: disable = broad-except
+            # This power component has errored when powering on.
+            # We'll retry by powering it off, then on again
+            if impl.power_on_recovery:
+                target.log.error(
+                    "%s: power-on%s failed: retrying after power-off: %s"
+                    % (component, why, e))
+            else:
+                target.log.error(
+                    "%s: power-on%s failed: not retrying: %s"
+                    % (component, why, e))
+                raise
+            # fall through!
+        try:
+            # power off to recover
+            self._impl_off(impl, target, component_real)
+        except Exception as e:	# pylint: disable = broad-except
+            target.log.error("%s: power off%s for recovery "
+                             "failed (ignoring): %s"
+                             % (component, why, e))
+        time.sleep(recovery_wait)
+        try:		        # Let's retry
+            self._impl_on(impl, target, component_real)
+        except Exception as e:
+            target.log.error(
+                "%s: power-on%s failed (again): aborting: %s"
+                % (component, why, e))
+            try:	        # ok, not good, giving up
+                # power off just in case, to avoid electrical
+                # issues, etc.
+                self._impl_off(impl, target, component_real)
+            except Exception as e:	# pylint: disable = broad-except
+                # is not much we can do if it fails
+                target.log.error(
+                    "%s: power-off%s due to failed power-on failed: %s"
+                    % (component, why, e))
+                # don't raise this, raise the original one
+            raise
+        target.log.debug("%s: powered on%s" % (component, why))
+        return True
+
+    def _on(self, target, impls, why, whole_rail = True, explicit = False):
+        #
+        # Power on
+        #
+        # We only power on whatever is off, hence why we ask what is
+        # off first. Power rails have to always be powered on in the
+        # same sequence, so if it is half off half on, it should be
+        # powered off first. But that's the user's call (use cycle())
+        #
+        # If the user asked for the whole rail, then we'll also run
+        # the pre/post hooks.
+        #
+        # If components declare dependencies (see impl_c), those
+        # that don't depend on each other are powered on in parallel
+        #
+        # Recovery can be quite painful, since we might have to retry
+        # (a single component) or the whole rail.
+        _state, data, _substate = self._get(target, impls, whole_rail)
+
+        self._on_pre(target, why, whole_rail)
+        graph = self._graph_needed(impls)
+        if graph:
+            deps = self._graph_deps(impls)
         # Power on in the specified order, off in the reverse
         # We use impl_index instead of iterating so we can reset
         # the index easily without having to deal with
         # StopIteration exceptions and try statements everywhere.
         index = 0
-        impls_items = impls
         retries = 0
         retries_max = 3
-        recovery_wait = 0.5
         while index < len(impls):
-            impl_item = impls_items[index]
-            component = impl_item[0]
-            impl = impl_item[1]
-            index += 1
-            if component in self.aliases:
-                if whole_rail:
-                    # operate only on real ones when going over the whole rail
-                    target.log.debug("%s: power off%s: skipping (alias)"
-                                     % (component, why))
-                    continue
-                component_real = self.aliases[component]
-            else:
-                component_real = component
-            if whole_rail \
-               and impl.explicit in ( "on", "both" ) and not explicit:
-                target.log.debug("%s: powering on%s: skipping (explicit/%s)"
-                                 % (component, why, impl.explicit))
-                continue            	# it says it is off, so we skip it
-            if data[component]['state'] == True:
-                target.log.debug("%s: powering on%s: skipping (already on)"
-                                 % (component, why))
-                continue            	# it says it is off, so we skip it
-            target.log.debug("%s: powering on%s" % (component, why))
             try:
-                self._impl_on(impl, target, component_real)	# ok, power ir on
-                continue	        # fallthrough is error recovery
+                if graph:
+                    self._graph_run(
+                        target, impls, deps,
+                        lambda impl, component: self._component_on(
+                            target, impl, component, why, data,
+                            whole_rail, explicit),
+                        "on", why)
+                    break
+                component, impl = impls[index]
+                index += 1
+                self._component_on(target, impl, component, why, data,
+                                   whole_rail, explicit)
 
             except impl_c.retry_all_e as e:
                 # This power component has errored when powering on.
@@ -907,80 +1480,20 @@ class interface(ttbl.tt_interface):
                         % (why, retries)) from e
                 target.log.error("%s: power-on%s failed: retrying (%d/%d) "
                                  "the whole power rail: %s",
-                                 component, why, retries, retries_max, e)
+                                 e.component, why, retries, retries_max, e)
                 try:
                     # power off the whole given rail, but no pre/post
                     # execution, since we are just dealing with the components
                     self._off(target, impls,
-                              " (retrying because %s failed)" % component,
+                              " (retrying because %s failed)" % e.component,
                               False)
                 except:		        # pylint: disable = bare-except
                     pass	        # yeah, we ignore errors here
                 index = 0	        # start again
                 if e.wait:
                     time.sleep(e.wait)
-                continue	        # fallthrough is error recovery!
-
-            except Exception as e:	# pylint: disable = broad-except
-                # This power component has errored when powering on.
-                # We'll retry by powering it off, then on again
-                if impl.power_on_recovery:
-                    target.log.error(
-                        "%s: power-on%s failed: retrying after power-off: %s"
-                        % (component, why, e))
-                else:
-                    target.log.error(
-                        "%s: power-on%s failed: not retrying: %s"
-                        % (component, why, e))
-                    raise
-                # fall through!
-            if impl.power_on_recovery:
-                try:
-                    # power off to recover
-                    self._impl_off(impl, target, component_real)
-                except Exception as e:	# pylint: disable = broad-except
-                    target.log.error("%s: power off%s for recovery "
-                                     "failed (ignoring): %s"
-                                     % (component, why, e))
-                time.sleep(recovery_wait)
-                try:		        # Let's retry
-                    self._impl_on(impl, target, component_real)
-                    continue	        # good, it worked
-                except Exception as e:
-                    target.log.error(
-                        "%s: power-on%s failed (again): aborting: %s"
-                        % (component, why, e))
-                    try:	        # ok, not good, giving up
-		        # power off just in case, to avoid electrical
-                        # issues, etc.
-                        self._impl_off(impl, target, component_real)
-                    except Exception as e:	# pylint: disable = broad-except
-                        # is not much we can do if it fails
-                        target.log.error(
-                            "%s: power-off%s due to failed power-on failed: %s"
-                            % (component, why, e))
-                        # don't raise this, raise the original one
-                    raise
 
-            target.log.debug("%s: powered on%s" % (component, why))
-        if whole_rail:
-            target.log.debug(
-                "power post-on%s; fns: %s"
-                % (why, " ".join(str(f) for f in target.power_on_post_fns)))
-            for f in target.power_on_post_fns:
-                f(target)
-            target.log.debug("power post-on%s: done" % why)
-        if not isinstance(why, str):
-            raise TypeError(type(why))
-        target.log.info("powered on%s" % why)
-        if whole_rail and getattr(ttbl.tls, 'interface', None) == "power":
-            # update full power state in inventory ONLY if we are
-            # using this call in the *power* interface (eg not as part
-            # of the *buttons* interface)
-            target.fsdb.set('interfaces.power.state', True)
-            target.fsdb.set('interfaces.power.substate',
-                            "full" if explicit else "normal")
-            target.fsdb.set('powered', "On")
+        self._on_post(target, why, whole_rail, explicit)
 
 
     # called by the daemon when a METHOD request comes to the HTTP path
@@ -3303,6 +3816,29 @@ def _execute_action(target: ttbl.test_target, state: bool, soft_failure: bool):
             "on" if state == True else "off", e)
 
 
+#: Maximum number of deferred power actions executed in parallel
+#:
+#: The power actions deferred with :func:`defer` (eg: to bring each
+#: target to its idle power state when the server starts) are
+#: executed by :func:`execute_defer_list` in up to this many
+#: threads; set to 1 to execute them one after another.
+defer_threads = 16
+
+#: Maximum number of deferred power actions executed at the same time
+#: on targets that share hardware
+#:
+#: Targets whose power rails have components in the same throttle
+#: group (eg: outlets in the same PDU, ports in the same USB hub; see
+#: the *throttle_group* argument to :class:`impl_c`) are powered on
+#: or off by :func:`execute_defer_list` at most this many at the same
+#: time, so the hardware is not overwhelmed.
+defer_group_concurrency = 2
+
+#: Timeline of the last execution of each defer list, keyed by name
+#:
+#: See :func:`execute_defer_list`.
+defer_timelines = {}
+
 _startup_defer_list = []
 
 def defer(target: ttbl.test_target, state: bool,
@@ -3360,11 +3896,39 @@ def defer(target: ttbl.test_target, state: bool,
 
 
 
+def _defer_groups(target: ttbl.test_target):
+    # throttle groups of the hardware the power rail of target acts on
+    power = getattr(target, "power", None)
+    if not isinstance(power, interface):
+        return set()
+    return set(
+        impl.throttle_group for impl in power.impls.values()
+        if impl.throttle_group != None
+    )
+
+
+
 def execute_defer_list(defer_list: list, name: str, serialize: bool = False,
-                       keepalive_fn: callable = None):
+                       keepalive_fn: callable = None,
+                       keepalive_period: float = 10):
     """
     Execute the deferred power actions in @defer_list
 
+    The actions are executed in parallel, in up to
+    :data:`defer_threads` threads, but:
+
+    - actions on targets whose power rails share hardware (components
+      with the same *throttle_group*, see :class:`impl_c`) are
+      executed at most :data:`defer_group_concurrency` at the same
+      time
+
+    - actions on the same target are executed one at a time, in the
+      order they were deferred
+
+    If an action fails and it was not deferred with *soft_failure*,
+    no more actions are started; once the ones in progress complete,
+    the exception is raised.
+
     :param list defer_list: list of deferred power actions filled by
       :func:`ttbl.power.defer`
 
@@ -3374,65 +3938,165 @@ def execute_defer_list(defer_list: list, name: str, serialize: bool = False,
       actions in a serial manner.
 
     :param callable keepalive_fn: (optional; defaults to *None*) if
-      defined, function to call every ten seconds while waiting for
-      *defer_list*.
+      defined, function to call every *keepalive_period* seconds while
+      waiting for *defer_list* (eg: to notify the service manager this
+      process is alive).
+
+    :param float keepalive_period: (optional; defaults to ten)
+      seconds between calls to *keepalive_fn*.
+
+    :returns dict: timeline of the execution (also kept in
+      :data:`defer_timelines`), with fields:
+
+      - *duration*: seconds it took to execute all the actions
 
+      - *actions*: list of dictionaries describing each action
+        (*target*, *state*, *groups*, *start* and *end*--in seconds
+        since the list started executing--and *error*, if any)
+
+      - *groups*: dictionary keyed by throttle group of the seconds
+        between the first action on a target in the group started and
+        the last one completed
     """
     assert keepalive_fn == None or callable(keepalive_fn)
+    assert isinstance(keepalive_period, numbers.Real) and keepalive_period > 0
     logging.info("power defer list '%s': executing", name)
     if serialize:
-        for ( target, state, soft_failure ) in defer_list:
-            _execute_action(target, state, soft_failure)
+        threads = 1
     else:
-        processes = max(20, len(defer_list))
-        current_process = multiprocessing.process.current_process()
-        _config = getattr(current_process, "_config", None)
-        daemon_orig = _config.get('daemon', None)
-        _config['daemon'] = False
-        executor = concurrent.futures.ProcessPoolExecutor(processes)
+        threads = max(1, defer_threads)
+
+    # actions with no state do nothing
+    pending = []
+    for target, state, soft_failure in defer_list:
+        if state == None:
+            continue
+        pending.append(( target, state, soft_failure, dict(
+            target = target.id, state = state,
+            groups = sorted(_defer_groups(target)),
+            start = None, end = None, error = None) ))
+    actions = [ action for _target, _state, _soft_failure, action in pending ]
+    groups_running = collections.Counter()
+    targets_running = set()
+    running = {}
+    exception = None
+
+    ts0 = time.time()
+
+    def _run(target, state, soft_failure, action):
+        action['start'] = time.time() - ts0
         try:
-            futures = {
-                executor.submit(_execute_action,
-                                target, state, soft_failure): (
-                                    target, state, soft_failure
-                                )
-                for ( target, state, soft_failure ) in defer_list
-            }
-            ts0 = time.time()
-            while True:
-                # We are going to run this in a loop and timeout every 10s
-                # so we can keepalive
-                try:
-                    for future in concurrent.futures.as_completed(
-                            futures, timeout = 10):
-                        target, state, soft_failure = futures[future]
-                        try:
-                            _ = future.result()
-                        except Exception as e:
-                            logging.error(
-                                "%s: exception running deferred power-%s"
-                                " operation: %s",
-                                target.id, "on" if state else "off", e)
-                            if not soft_failure:
-                                raise
-                    # if we end up here, it means the as_completed()
-                    # process is done with all tasks, so we can stop
-                    # repeating the loop
-                    break
-                except TimeoutError:
-                    # if this is being used from the cleanup process, we
-                    # want to run the keepalive function evrynow and then,
-                    # to notify the service manager this process is alive
-                    if keepalive_fn:
-                        ts = time.time()
-                        logging.info(
-                            "power defer list '%s': keepaliving @%.02fs",
-                            name, ts - ts0)
-                        keepalive_fn()
-                    continue
+            _execute_action(target, state, soft_failure)
         finally:
-            executor.shutdown(wait = True)
-            del executor
-            _config['daemon'] = daemon_orig
+            action['end'] = time.time() - ts0
 
-    logging.warning("power defer list '%s': executed", name)
+    ts_keepalive = ts0
+    executor = concurrent.futures.ThreadPoolExecutor(
+        threads, thread_name_prefix = f"power-defer-{name}")
+    try:
+        while pending or running:
+            # start as many actions as threads and groups allow,
+            # in the order they were deferred
+            for entry in list(pending):
+                if len(running) >= threads:
+                    break
+                target, state, soft_failure, action = entry
+                if target.id in targets_running:
+                    continue
+                if any(groups_running[group] >= defer_group_concurrency
+                       for group in action['groups']):
+                    continue
+                pending.remove(entry)
+                targets_running.add(target.id)
+                groups_running.update(action['groups'])
+                future = executor.submit(_run, *entry)
+                running[future] = entry
+
+            done, _not_done = concurrent.futures.wait(
+                running,
+                timeout = max(0, ts_keepalive + keepalive_period - time.time()),
+                return_when = concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                target, state, soft_failure, action = running.pop(future)
+                targets_running.discard(target.id)
+                groups_running.subtract(action['groups'])
+                try:
+                    future.result()
+                except Exception as e:
+                    action['error'] = str(e)
+                    logging.error(
+                        "%s: exception running deferred power-%s"
+                        " operation: %s",
+                        target.id, "on" if state else "off", e)
+                    if not soft_failure and exception == None:
+                        exception = e
+                        for _target, _state, _soft_failure, _action in pending:
+                            _action['error'] = "not executed"
+                        pending.clear()
+
+            # if this is being used from the cleanup process, we
+            # want to run the keepalive function every now and then,
+            # to notify the service manager this process is alive
+            ts = time.time()
+            if ts - ts_keepalive >= keepalive_period:
+                ts_keepalive = ts
+                if keepalive_fn:
+                    logging.info(
+                        "power defer list '%s': keepaliving @%.02fs"
+                        " (%d running, %d pending)",
+                        name, ts - ts0, len(running), len(pending))
+                    keepalive_fn()
+    finally:
+        executor.shutdown(wait = True)
+
+    timeline = _defer_timeline_report(name, actions, time.time() - ts0)
+    if exception:
+        raise exception
+    return timeline
+
+
+
+def _defer_timeline_report(name: str, actions: list, duration: float):
+    # log what was done when and how long it took, keep it in
+    # defer_timelines
+    groups = {}
+    for action in sorted(actions, key = lambda action: action['start'] or 0):
+        if action['start'] == None:
+            continue
+        logging.info(
+            "power defer list '%s': %s power-%s @%.02fs +%.02fs%s",
+            name, action['target'], "on" if action['state'] else "off",
+            action['start'], action['end'] - action['start'],
+            f" (failed: {action['error']})" if action['error'] else "")
+        for group in action['groups']:
+            start, end = groups.get(group, ( action['start'], action['end'] ))
+            groups[group] = (
+                min(start, action['start']), max(end, action['end']) )
+    timeline = dict(
+        duration = duration,
+        actions = actions,
+        groups = {
+            group: end - start for group, ( start, end ) in groups.items()
+        },
+    )
+    defer_timelines[name] = timeline
+
+    executed = [ action for action in actions if action['start'] != None ]
+    slowest = sorted(executed, reverse = True,
+                     key = lambda action: action['end'] - action['start'])[:5]
+    logging.warning(
+        "power defer list '%s': executed %d actions in %.02fs"
+        " (%d failed, %d not executed); slowest: %s",
+        name, len(executed), duration,
+        len([ action for action in executed if action['error'] ]),
+        len(actions) - len(executed),
+        ", ".join(
+            f"{action['target']} {action['end'] - action['start']:.02f}s"
+            for action in slowest) or "n/a")
+    if timeline['groups']:
+        group, span = max(timeline['groups'].items(),
+                          key = lambda item: item[1])
+        logging.warning(
+            "power defer list '%s': busiest throttle group %s: %.02fs",
+            name, group, span)
+    return timeline
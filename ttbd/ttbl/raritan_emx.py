@@ -195,6 +195,8 @@ class pci(ttbl.power.impl_c, ttbl.capture.impl_c): # pylint: disable = abstract-
 
         if not password:
             password = url.password
+        if self.throttle_group == None:
+            self.throttle_group = f"raritan:{url.hostname}"
 
         if not password:
             password_publish = None
@@ -284,7 +286,7 @@ class pci(ttbl.power.impl_c, ttbl.capture.impl_c): # pylint: disable = abstract-
 
 
 
-    def _raritan_api_handle_create(self, target: ttbl.test_target):
+    def _raritan_api_pdu_create(self, target: ttbl.test_target):
         try:
             # Load from the inventory the URL we have to use, so we can
             # update it real-time if we have to, or default to configuration
@@ -296,7 +298,7 @@ class pci(ttbl.power.impl_c, ttbl.capture.impl_c): # pylint: disable = abstract-
                 None)
             url, password, outlet_number = self._url_resolve(url_base, password)
 
-            # return a Raritan SDK outlet object on which we can run API
+            # return a Raritan SDK PDU object on which we can run API
             # calls; if not initialized, initialize it on the run.
             #
             # Why not do this in __init__? Because the server runs in
@@ -307,7 +309,7 @@ class pci(ttbl.power.impl_c, ttbl.capture.impl_c): # pylint: disable = abstract-
                 url.scheme, url.hostname, url.username, password,
                 disable_certificate_verification = not self.https_verify)
             pdu = raritan.rpc.pdumodel.Pdu("/model/pdu/0", agent)
-            return pdu.getOutlets()[outlet_number]
+            return pdu, url, outlet_number
         except Exception as e:
             target.log.error(
                 f"raritan: {target.id} exception creating handle: {e}",
@@ -315,49 +317,75 @@ class pci(ttbl.power.impl_c, ttbl.capture.impl_c): # pylint: disable = abstract-
             raise
 
 
+    def _raritan_api_handle_create(self, target: ttbl.test_target):
+        pdu, _url, outlet_number = self._raritan_api_pdu_create(target)
+        return pdu.getOutlets()[outlet_number]
+
+
+    def _poller(self, target: ttbl.test_target):
+        # all the outlets in the PDU share the state read from it;
+        # return the poller and our outlet number
+        pdu, url, outlet_number = self._raritan_api_pdu_create(target)
+
+        def _states_fetch():
+            # getOutlets() and then the getState() of all the outlets
+            # in a single bulk request, so it takes two round trips
+            # no matter how many outlets the PDU has
+            outlets = pdu.getOutlets()
+            bulk = raritan.rpc.BulkRequestHelper(pdu.agent)
+            for outlet_handle in outlets:
+                bulk.add_request(outlet_handle.getState)
+            responses = bulk.perform_bulk()
+            states = {}
+            for index, response in enumerate(responses):
+                if isinstance(response, KeyError):
+                    # Some PDUs (older?) return a state the SDK can't
+                    # decode, missing the 'isLoadShed' field:
+                    #
+                    ##   File "/usr/lib/python3.9/site-packages/raritan/rpc/pdumodel/__init__.py", line 3350, in decode
+                    ##     isLoadShed = json['isLoadShed'],
+                    ## KeyError: 'isLoadShed'
+                    #
+                    # so we extract the value manually from the raw
+                    # response; they also don't seem to use the enums
+                    # in the API, 0 is off.
+                    result = bulk.rawresults[index].json['result']
+                    states[index] = result['_ret_']['powerState'] != 0
+                elif isinstance(response, Exception):
+                    raise response
+                else:
+                    states[index] = response.powerState \
+                        != raritan.rpc.pdumodel.Outlet.PowerState.PS_OFF
+            return states
+
+        poller = ttbl.power.pdu_poller_get(
+            f"raritan:{url.username}@{url.hostname}", _states_fetch)
+        return poller, outlet_number
+
+
     def on(self, target, _component):
         outlet_handle = self._raritan_api_handle_create(target)
         outlet_handle.setPowerState(
             raritan.rpc.pdumodel.Outlet.PowerState.PS_ON)
+        poller, outlet_number = self._poller(target)
+        poller.invalidate(outlet_number, True)
 
 
     def off(self, target, _component):
         outlet_handle = self._raritan_api_handle_create(target)
         outlet_handle.setPowerState(
             raritan.rpc.pdumodel.Outlet.PowerState.PS_OFF)
+        poller, outlet_number = self._poller(target)
+        poller.invalidate(outlet_number, False)
 
 
     def get(self, target, component):
-        outlet_handle = self._raritan_api_handle_create(target)
-        # We cannot call self._outlet.getState() directly--there seems
-        # to be a compat issue between this version of the API in the
-        # unit I tested with and what this API expects, with a missing
-        # field 'loadShed' in the returned value dict.
-        #
-        # So we call getState by hand (from
-        # raritan/Interface.py:Interface.Method) and we extract the
-        # value manually.
+        # The state of all the outlets is read at once and shared for
+        # a short time (see ttbl.power.pdu_poller_c), so reading the
+        # state of all the targets in the PDU is done in one go.
+        poller, outlet_number = self._poller(target)
         try:
-            r = outlet_handle.getState().powerState
-        except KeyError as e:
-            # this happens on some PDUs (older?) where we get an exception like
-            #
-            ##   File "/usr/lib/python3.9/site-packages/ttbl/raritan_emx.py", line 221, in get
-            ##     r = self._outlet.getState().powerState
-            ##   File "/usr/lib/python3.9/site-packages/raritan/rpc/Interface.py", line 13, in __call__
-            ##     return self.decode(rsp, self.parent.agent)
-            ##   File "/usr/lib/python3.9/site-packages/raritan/rpc/pdumodel/__init__.py", line 3640, in decode
-            ##     _ret_ = raritan.rpc.pdumodel.Outlet.State.decode(rsp['_ret_'], agent)
-            ##   File "/usr/lib/python3.9/site-packages/raritan/rpc/pdumodel/__init__.py", line 3350, in decode
-            ##     isLoadShed = json['isLoadShed'],
-            ## KeyError: 'isLoadShed'
-            obj = outlet_handle.getState
-            result = obj.parent.agent.json_rpc(obj.parent.target, obj.name, {})
-            r = result['_ret_']['powerState']
-            if r == 0:
-                # Old PDUs don't seem to use the enums in the API, so
-                return False
-            return True
+            return poller.state_get(outlet_number)
         except raritan.rpc.HttpException as e:
             # We sometimes get network errors but
             # we don't want them to cause the whole initialziation
@@ -367,10 +395,6 @@ class pci(ttbl.power.impl_c, ttbl.capture.impl_c): # pylint: disable = abstract-
             target.log.error(f"power/{component}: network error: {e}")
             return None
 
-        if r == raritan.rpc.pdumodel.Outlet.PowerState.PS_OFF:
-            return False
-        return True
-
     #
     # ttbl.capture.impl_c: power capture stats
     #
@@ -222,6 +222,8 @@ class pc(rly08b, ttbl.power.impl_c):
         self.relay = relay
         ttbl.power.impl_c.__init__(self, **kwargs)
         rly08b.__init__(self, device_spec)
+        if self.throttle_group == None:
+            self.throttle_group = f"usbrly08b:{device_spec}"
         self.resilient = resilient
 
     def on(self, target, _component):